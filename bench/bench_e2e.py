@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' End-to-end benchmark of vm_cfg_path.py and xenview.py on a synthetic dom0 with stub Xen tools '''
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import optparse
+import subprocess
+try:
+    import json
+except ImportError:
+    import simplejson as json # pylint: disable=import-error
+
+C_UTILS_DIR = os.path.realpath('%s/../utils' % os.path.dirname(os.path.realpath(__file__)))
+C_SIZES = '10,100,1000,10000'
+C_TOOL_LOG = 'tool.log'
+C_RESULT_PREFIX = 'BENCH_RESULT '
+
+''' Stub executables, every call is appended to the tool log so forks of Xen tools can be counted '''
+C_STUB_DICT = {
+    'xm': '''#!/bin/sh
+echo "xm $*" >> "%(log)s"
+cat "%(data)s/xm.out"
+''',
+    'xenstore-ls': '''#!/bin/sh
+echo "xenstore-ls $*" >> "%(log)s"
+[ "$1" = "-f" ] && shift
+if [ "$1" = "/local/domain" ]; then
+    cat "%(data)s/xenstore.out"
+else
+    grep "^$1/" "%(data)s/xenstore.out"
+fi
+''',
+    'xenstore-list': '''#!/bin/sh
+echo "xenstore-list $*" >> "%(log)s"
+cat "%(data)s/domid.out"
+''',
+}
+
+''' One layout per vmcfg pattern of config/vm_cfg_path.json, domUs are spread round-robin over them '''
+C_LAYOUT_LIST = [
+    '/xen/%(name)s/vm.cfg',
+    '/OVS/Repositories/%(repo)s/VirtualMachines/%(name)s/vm.cfg',
+    '/etc/xen/domU/domU_%(name)s',
+    '/var/ovs/mount/%(repo)s/running_pool/%(name)s/vm.cfg',
+    '/OVS/running_pool/%(name)s/vm.cfg',
+    '/xen_local/%(name)s/vm.cfg',
+]
+C_AUTO_LAYOUT = '/OVS/running_pool/%(name)s/vm.cfg'
+C_LIST_EVERY = 10
+
+def write_file(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fo = open(path, 'w')
+    fo.write(content)
+    fo.close()
+
+''' Builds the dom0 tree, the rewritten configs and the stub tools under root, returns the domU count '''
+def make_dom0(root, count):
+    data_dir = os.path.join(root, 'bench')
+    bin_dir = os.path.join(data_dir, 'bin')
+    os.makedirs(bin_dir)
+
+    hostname = socket.gethostname()
+    vms_lines = []
+    xm_lines = ['Name                                        ID   Mem VCPUs      State   Time(s)',
+        'Domain-0                                     0  2048     4     r-----   1234.5']
+    xs_lines = ['/local = ""', '/local/domain = ""', '/local/domain/0 = ""', '/local/domain/0/name = "Domain-0"']
+    domid_lines = ['0']
+    for i in range(count):
+        name = 'domu%05d' % i
+        domu_id = i + 1
+        values = {'name': name, 'repo': 'repo%d' % (i % 4)}
+        vm_cfg = root + C_LAYOUT_LIST[i % len(C_LAYOUT_LIST)] % values
+        img = os.path.join(os.path.dirname(vm_cfg), 'System.img')
+        write_file(vm_cfg, "# synthetic\nname = '%s'\nmemory = 2048\nvcpus = 2\ndisk = ['file:%s,xvda,w']\nvif = ['bridge=xenbr0']\n" % (name, img))
+        if vm_cfg.endswith('/vm.cfg') and i % C_LIST_EVERY == 0:
+            vms_lines.append(vm_cfg)
+        if C_LAYOUT_LIST[i % len(C_LAYOUT_LIST)] == C_AUTO_LAYOUT:
+            auto = root + '/etc/xen/auto/%s' % name
+            if not os.path.isdir(os.path.dirname(auto)):
+                os.makedirs(os.path.dirname(auto))
+            os.symlink(vm_cfg, auto)
+
+        xm_lines.append('%-40s %5d  2048     2     -b----    100.0' % (name, domu_id))
+        domid_lines.append(str(domu_id))
+        backend = '/local/domain/0/backend/vbd/%d/51712' % domu_id
+        xs_lines += ['/local/domain/%d = ""' % domu_id,
+            '/local/domain/%d/name = "%s"' % (domu_id, name),
+            '/local/domain/%d/device/vbd/51712/backend = "%s"' % (domu_id, backend),
+            '%s/params = "%s"' % (backend, img)]
+
+    write_file(root + '/root/%s.vms' % hostname, '\n'.join(vms_lines) + '\n')
+    write_file(os.path.join(data_dir, 'xm.out'), '\n'.join(xm_lines) + '\n')
+    write_file(os.path.join(data_dir, 'xenstore.out'), '\n'.join(xs_lines) + '\n')
+    write_file(os.path.join(data_dir, 'domid.out'), '\n'.join(domid_lines) + '\n')
+
+    values = {'log': os.path.join(data_dir, C_TOOL_LOG), 'data': data_dir}
+    for (tool, script) in C_STUB_DICT.items():
+        write_file(os.path.join(bin_dir, tool), script % values)
+        os.chmod(os.path.join(bin_dir, tool), 0o755)
+
+    conf = json.load(open('%s/../config/vm_cfg_path.json' % C_UTILS_DIR))
+    for pttn in conf['vm_cfg_path_list']:
+        if pttn['type'] != 'xenstore':
+            pttn['path_pattern'] = root + pttn['path_pattern']
+    json.dump(conf, open(os.path.join(data_dir, 'vm_cfg_path.json'), 'w'), indent=2)
+
+    dir_list = ['/root', '/etc/xen/auto', '/etc/xen/domU', '/xen/*', '/xen_local/*', '/OVS/running_pool/*',
+        '/OVS/Repositories/*/VirtualMachines/*', '/var/ovs/mount/*/running_pool/*']
+    write_file(os.path.join(data_dir, 'vm_cfg_path.config'), '\n'.join([root + path for path in dir_list]) + '\n')
+    return count
+
+''' Child side: counts spawns and opened files around the real entry point, then prints them with peak RSS '''
+def run_child(target, root, args):
+    import resource
+    sys.path.insert(0, C_UTILS_DIR)
+    counter = {'spawns': 0, 'opens': 0}
+
+    original_popen_init = subprocess.Popen.__init__
+    def counting_popen_init(self, *popen_args, **popen_kwargs):
+        counter['spawns'] += 1
+        original_popen_init(self, *popen_args, **popen_kwargs)
+    subprocess.Popen.__init__ = counting_popen_init
+
+    try:
+        import __builtin__ as builtins # pylint: disable=import-error
+    except ImportError:
+        import builtins
+    original_open = builtins.open
+    def counting_open(*open_args, **open_kwargs):
+        counter['opens'] += 1
+        return original_open(*open_args, **open_kwargs)
+    builtins.open = counting_open
+
+    data_dir = os.path.join(root, 'bench')
+    devnull = original_open(os.devnull, 'w')
+    stdout = sys.stdout
+    sys.stdout = devnull
+    start = time.time()
+    try:
+        if target == 'xenview':
+            import xenview
+            xv = xenview.XenView(conf_path=os.path.join(data_dir, 'vm_cfg_path.config'))
+            xv.initialize_vm_cfg_dict()
+            resolved = len([path for path in xv.vm_cfg_dict.values() if path])
+        else:
+            import vm_cfg_path
+            sys.argv = ['vm_cfg_path.py', '-c', os.path.join(data_dir, 'vm_cfg_path.json')] + args
+            (opts, opt_args) = vm_cfg_path.parse_opts()
+            xv = vm_cfg_path.create_xenview(opts)
+            resolved = len(xv.get_all_domu_name_2_vm_cfg_dict())
+    finally:
+        elapsed = time.time() - start
+        sys.stdout = stdout
+        devnull.close()
+
+    result = {'wall': elapsed, 'spawns': counter['spawns'], 'opens': counter['opens'], 'resolved': resolved,
+        'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    print(C_RESULT_PREFIX + json.dumps(result))
+
+def run_case(python, root, target, args):
+    log = os.path.join(root, 'bench', C_TOOL_LOG)
+    if os.path.exists(log):
+        os.unlink(log)
+    env = dict(os.environ)
+    env['PATH'] = '%s%s%s' % (os.path.join(root, 'bench', 'bin'), os.pathsep, env.get('PATH', ''))
+    proc = subprocess.Popen([python, os.path.realpath(__file__), '--child', target, '--root', root, '--'] + args,
+        stdout=subprocess.PIPE, env=env, universal_newlines=True)
+    (out, err) = proc.communicate()
+    result = None
+    for line in out.splitlines():
+        if line.startswith(C_RESULT_PREFIX):
+            result = json.loads(line[len(C_RESULT_PREFIX):])
+    if result is None:
+        raise RuntimeError('benchmark child failed: %s %s' % (target, ' '.join(args)))
+    result['tool_execs'] = 0
+    if os.path.exists(log):
+        result['tool_execs'] = len(open(log).readlines())
+    return result
+
+C_CASE_LIST = [
+    ('vm_cfg_path', 'vm_cfg_path', ['--no-cache']),
+    ('vm_cfg_path -j 4', 'vm_cfg_path', ['--no-cache', '-j', '4']),
+    ('vm_cfg_path -t xm', 'vm_cfg_path', ['--no-cache', '-t', 'xm']),
+    ('vm_cfg_path warm cache', 'vm_cfg_path', ['--cache-file', '%(root)s/bench/cache']),
+    ('xenview', 'xenview', []),
+]
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]', description='Scale benchmark of the vm.cfg resolution engine on a synthetic dom0')
+    parser.add_option('-s', '--sizes', help='Comma separated domU counts [default: %default]', dest='sizes', default=C_SIZES)
+    parser.add_option('-p', '--python', help='Interpreter running the tools [default: %default]', dest='python', default=sys.executable)
+    parser.add_option('-k', '--keep', help='Keep the synthetic dom0 trees', action='store_true', dest='keep', default=False)
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP, dest='child', default=None)
+    parser.add_option('--root', help=optparse.SUPPRESS_HELP, dest='root', default=None)
+    (opts, args) = parser.parse_args()
+
+    if opts.child is not None:
+        run_child(opts.child, opts.root, args)
+        return
+
+    print('%-24s %7s %10s %7s %8s %8s %10s %9s' % ('case', 'domUs', 'wall(s)', 'spawns', 'execs', 'opens', 'rss(KB)', 'resolved'))
+    for size in [int(size) for size in opts.sizes.split(',')]:
+        root = tempfile.mkdtemp(prefix='bench_e2e.')
+        try:
+            make_dom0(root, size)
+            for (label, target, args) in C_CASE_LIST:
+                args = [arg % {'root': root} for arg in args]
+                if 'warm cache' in label:
+                    run_case(opts.python, root, target, args)
+                result = run_case(opts.python, root, target, args)
+                print('%-24s %7d %10.3f %7d %8d %8d %10d %9d' % (label, size, result['wall'], result['spawns'],
+                    result['tool_execs'], result['opens'], result['rss_kb'], result['resolved']))
+                sys.stdout.flush()
+        finally:
+            if opts.keep:
+                print('Kept %s' % root)
+            else:
+                shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' Memory held by the per-domain result state of XenView after a full scan of a synthetic dom0 '''
+
+import os
+import sys
+import shutil
+import tempfile
+import optparse
+import subprocess
+try:
+    import json
+except ImportError:
+    import simplejson as json # pylint: disable=import-error
+
+import bench_e2e
+import bench_startup
+
+C_RESULT_PREFIX = 'BENCH_RESULT '
+''' Result state of the parallel dicts layout, and of the registry replacing them '''
+C_STATE_LIST = ['running_domu_name_dict', 'running_domu_disk_dict', 'running_domu_vm_cfg_dict', 'vm_cfg_dict', 'domain_registry']
+
+''' Bytes of obj and everything it references, each object counted once '''
+def deep_size(obj, seen):
+    size = 0
+    stack = [obj]
+    while len(stack) != 0:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, (bool, int, float, type)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__') or hasattr(type(obj), '__slots__'):
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    stack.append(getattr(obj, slot, None))
+    return size
+
+''' Child side: one full scan with the tree's XenView, then the size of its result state '''
+def run_child(utils_dir, conf_path):
+    sys.path.insert(0, utils_dir)
+    from vm_cfg_path import XenView
+    xv = XenView(conf_path=conf_path)
+    count = len(xv.get_all_domu_name_2_vm_cfg_dict())
+    ''' The pattern config is owned by XenView anyway, the records only point at it '''
+    seen = set()
+    deep_size(xv.vm_cfg_pattern_list, seen)
+    deep_size(xv.vm_cfg_plan_list, seen)
+    size = 0
+    for name in C_STATE_LIST:
+        if hasattr(xv, name):
+            size += deep_size(getattr(xv, name), seen)
+    sys.stdout.write('%s%s\n' % (C_RESULT_PREFIX, json.dumps({'domains': count, 'bytes': size})))
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]', description='Bytes held by the name, disk and vm.cfg result state '
+        'of XenView after a full scan, for the working tree and optionally git revisions')
+    parser.add_option('-r', '--rev', help='Also measure this git revision, e.g. the one before a change', action='append', dest='rev_list', default=[])
+    parser.add_option('-s', '--size', help='domUs of the synthetic dom0 [default: %default]', type='int', dest='size', default=10000)
+    parser.add_option('-p', '--python', help='Interpreter running the scan [default: %default]', dest='python', default=sys.executable)
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP, nargs=2, dest='child')
+    (opts, args) = parser.parse_args()
+    if opts.child is not None:
+        run_child(opts.child[0], opts.child[1])
+        return
+
+    root = tempfile.mkdtemp(prefix='bench_memory.')
+    try:
+        bench_e2e.make_dom0(root, opts.size)
+        data_dir = os.path.join(root, 'bench')
+        env = dict(os.environ)
+        env['PATH'] = '%s%s%s' % (os.path.join(data_dir, 'bin'), os.pathsep, env.get('PATH', ''))
+
+        print('%-16s %8s %12s %12s %14s' % ('tree', 'domains', 'bytes', 'per domain', 'per 10000'))
+        for rev in opts.rev_list + [None]:
+            label = rev or 'working tree'
+            script = bench_startup.make_tree(os.path.join(root, 'tree.%s' % (rev or 'work').replace('/', '_')), data_dir, rev)
+            proc = subprocess.Popen([opts.python, os.path.realpath(__file__), '--child', os.path.dirname(script),
+                os.path.join(data_dir, 'vm_cfg_path.json')], stdout=subprocess.PIPE, env=env, universal_newlines=True)
+            (out, err) = proc.communicate()
+            result = None
+            for line in out.splitlines():
+                if line.startswith(C_RESULT_PREFIX):
+                    result = json.loads(line[len(C_RESULT_PREFIX):])
+            if result is None or result['domains'] == 0:
+                print('%-16s failed' % label)
+                continue
+            per_domain = float(result['bytes']) / result['domains']
+            print('%-16s %8d %12d %12.1f %14d' % (label, result['domains'], result['bytes'], per_domain, per_domain * 10000))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' Per-file latency and allocations of the vm.cfg name= lookup: legacy readlines() vs bounded reader '''
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, '%s/../utils' % os.path.dirname(os.path.realpath(__file__)))
+from vm_cfg_path import XenView
+
+''' Legacy code path, kept here only as the baseline '''
+def legacy_get_domain_name_from_file(filename):
+    fo = open(filename)
+    lines = fo.readlines()
+    contents = []
+    for line in lines:
+        line = line.strip()
+        if line == '' or line[0] == '#':
+            continue
+        contents.append(line)
+    fo.close()
+    for content in contents:
+        if not re.search(r'name\s*=', content):
+            continue
+        return content[content.find('=')+1:].strip().strip('\"').strip('\'')
+    return ''
+
+def make_vm_cfg(path, blob_lines):
+    fo = open(path, 'w')
+    fo.write("# generated\nvif_name = 'vif0'\npool_name = 'pool0'\nname = 'bench_domu'\n")
+    fo.write("disk = [\n")
+    for i in range(blob_lines):
+        fo.write("    'file:/OVS/Repositories/0004fb0000030000/VirtualDisks/0004fb00001200000000000000%06d.img,xvd%d,w',\n" % (i, i))
+    fo.write("]\n")
+    fo.close()
+
+def bench(label, func, path, count):
+    start = time.time()
+    for i in range(count):
+        name = func(path)
+    elapsed = time.time() - start
+    peak = ''
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func(path)
+        peak = '%10d bytes peak' % tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print('%-20s %-12s %10.2f us/file %s' % (label, name, elapsed * 1000000 / count, peak))
+
+def main():
+    parser = optparse.OptionParser(description='vm.cfg name= lookup before and after the bounded reader')
+    parser.add_option('-n', '--count', help='Reads per file [default: %default]', type='int', dest='count', default=2000)
+    (opts, args) = parser.parse_args()
+
+    xv = XenView(cache_path=None)
+    root = tempfile.mkdtemp(prefix='bench_name_reader.')
+    try:
+        for blob_lines in (0, 1000, 20000):
+            path = os.path.join(root, 'vm.cfg.%d' % blob_lines)
+            make_vm_cfg(path, blob_lines)
+            print('vm.cfg with %d disk lines, %d bytes' % (blob_lines, os.path.getsize(path)))
+            bench('legacy', legacy_get_domain_name_from_file, path, opts.count)
+            bench('bounded reader', xv._read_domain_name_from_file, path, opts.count)
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' Micro-benchmark of the per-file pattern overhead: legacy string-built regexes vs compiled VmCfgPlan '''
+
+import os
+import re
+import sys
+import glob
+import time
+import shutil
+import socket
+import tempfile
+import optparse
+try:
+    import json
+except ImportError:
+    import simplejson as json # pylint: disable=import-error
+
+sys.path.insert(0, '%s/../utils' % os.path.dirname(os.path.realpath(__file__)))
+from vm_cfg_path import XenView
+from vm_cfg_plan import VmCfgPlan
+
+''' Legacy per-file code path, kept here only as the baseline '''
+def legacy_translate_pattern_path(pttn_path):
+    if re.search(XenView.C_KEY_DOM0_HOSTNAME, pttn_path):
+        return (pttn_path.replace(XenView.C_KEY_DOM0_HOSTNAME, socket.gethostname()), XenView.C_KEY_DOM0_HOSTNAME)
+    elif re.search(XenView.C_KEY_DOMU_HOSTNAME, pttn_path):
+        return (pttn_path.replace(XenView.C_KEY_DOMU_HOSTNAME, '*'), XenView.C_KEY_DOMU_HOSTNAME)
+    return (pttn_path, '')
+
+def legacy_extract_domu_name(pttn_path, pttn_key, search_file_path):
+    m = re.match(pttn_path.replace(pttn_key, '(.*)'), search_file_path)
+    if m:
+        return m.group(1)
+    return ''
+
+def bench(label, func, count):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print('%-28s %10.3f ms %10.3f us/file' % (label, elapsed * 1000, elapsed * 1000000 / max(count, 1)))
+
+def make_tree(root, pttn_list, count):
+    for pttn in pttn_list:
+        for i in range(count):
+            path = root + pttn.replace('*', 'repo%d' % (i % 4)).replace(XenView.C_KEY_DOMU_HOSTNAME, 'domu%05d' % i)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+def main():
+    parser = optparse.OptionParser(description='Per-file pattern overhead before and after compiled plans')
+    parser.add_option('-n', '--files', help='Files per pattern [default: %default]', type='int', dest='files', default=2000)
+    (opts, args) = parser.parse_args()
+
+    pttn_list = [pttn['path_pattern'] for pttn in json.load(open(XenView.C_CONF_PATH))['vm_cfg_path_list']
+        if pttn['type'] == 'vmcfg']
+    root = tempfile.mkdtemp(prefix='bench_pattern.')
+    try:
+        make_tree(root, pttn_list, opts.files)
+        pttn_list = [root + pttn for pttn in pttn_list]
+        plan_list = [VmCfgPlan.compile({'path_pattern': pttn, 'type': 'vmcfg', 'enable': 'True'}) for pttn in pttn_list]
+        file_lists = [glob.glob(legacy_translate_pattern_path(pttn)[0]) for pttn in pttn_list]
+        total = sum([len(file_list) for file_list in file_lists])
+
+        def run_legacy_extract():
+            for (pttn, file_list) in zip(pttn_list, file_lists):
+                for file_name in file_list:
+                    (glob_path, search_key) = legacy_translate_pattern_path(pttn)
+                    legacy_extract_domu_name(pttn, search_key, file_name)
+
+        def run_plan_extract():
+            for (plan, file_list) in zip(plan_list, file_lists):
+                for file_name in file_list:
+                    plan.extract_domu_name(file_name)
+
+        def run_legacy_glob():
+            for pttn in pttn_list:
+                glob.glob(legacy_translate_pattern_path(pttn)[0])
+
+        def run_plan_expand():
+            for plan in plan_list:
+                plan.expand()
+
+        for (plan, file_list) in zip(plan_list, file_lists):
+            assert sorted(plan.expand()) == sorted(file_list), plan.path_pattern
+
+        print('%d patterns, %d files' % (len(pttn_list), total))
+        bench('extract: legacy', run_legacy_extract, total)
+        bench('extract: compiled plan', run_plan_extract, total)
+        bench('expand: glob.glob', run_legacy_glob, total)
+        bench('expand: compiled plan', run_plan_expand, total)
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' CPU used by the xenview.py --sample loop itself, xm excluded, with a stub xm listing a number of guests '''
+
+import os
+import sys
+import shutil
+import tempfile
+import optparse
+
+import bench_e2e
+sys.path.insert(0, bench_e2e.C_UTILS_DIR)
+from command_runner import CommandRunner
+from domain_sampler import DomainSampler
+
+C_HEADER = 'Name                                        ID   Mem VCPUs      State   Time(s)'
+C_DOM0 = 'Domain-0                                     0  2048     4     r-----   1234.5'
+
+''' Stub xm printing the table of count guests, whose CPU time moves on with each call '''
+def make_xm(bin_dir, count):
+    data_path = os.path.join(bin_dir, 'xm.out')
+    lines = [C_HEADER, C_DOM0]
+    for i in range(count):
+        lines.append('%-40s %5d  2048     2     -b----    %.1f' % ('domu%05d' % i, i + 1, 100.0 + i))
+    bench_e2e.write_file(data_path, '\n'.join(lines) + '\n')
+    bench_e2e.write_file(os.path.join(bin_dir, 'xm'), '#!/bin/sh\ncat "%s"\n' % data_path)
+    os.chmod(os.path.join(bin_dir, 'xm'), 0o755)
+
+''' Own user + system seconds of this process, children not counted '''
+def self_cpu():
+    times = os.times()
+    return times[0] + times[1]
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]', description='CPU cost of one DomainSampler sample, '
+        'with the xm call and without it, and of one top view')
+    parser.add_option('-g', '--guests', help='Guests listed by the stub xm [default: %default]', type='int', dest='guests', default=100)
+    parser.add_option('-n', '--samples', help='Samples taken [default: %default]', type='int', dest='samples', default=200)
+    (opts, args) = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_sampler.')
+    try:
+        bin_dir = os.path.join(root, 'bin')
+        make_xm(bin_dir, opts.guests)
+        os.environ['PATH'] = '%s%s%s' % (bin_dir, os.pathsep, os.environ.get('PATH', ''))
+
+        sampler = DomainSampler(CommandRunner(), 'xm')
+        start = self_cpu()
+        for i in range(opts.samples):
+            sampler.sample()
+        with_command = (self_cpu() - start) / opts.samples
+
+        ''' The same rows fed directly: parsing is left out, the ring buffer update is what remains '''
+        stat_list = sampler.toolstack_backend.list_domain_stats()
+        start = self_cpu()
+        for i in range(opts.samples):
+            sampler.sample_rows(stat_list)
+        update_only = (self_cpu() - start) / opts.samples
+
+        start = self_cpu()
+        for i in range(opts.samples):
+            sampler.format_top()
+        top_view = (self_cpu() - start) / opts.samples
+
+        print('python %s, %d guests, %d samples' % (sys.version.split()[0], opts.guests, opts.samples))
+        print('%-24s %10s %16s' % ('', 'ms/sample', '% core at 1s'))
+        print('%-24s %10.3f %16.2f' % ('sample with xm call', with_command * 1000, with_command * 100))
+        print('%-24s %10.3f %16.2f' % ('history update only', update_only * 1000, update_only * 100))
+        print('%-24s %10.3f %16.2f' % ('top view redraw', top_view * 1000, top_view * 100))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
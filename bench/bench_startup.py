@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' Startup benchmark of vm_cfg_path.py as run from cron: no arguments, time to the first output line '''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+import bench_e2e
+
+C_PACKAGE_DIR = os.path.realpath('%s/..' % os.path.dirname(os.path.realpath(__file__)))
+C_TREE_LIST = ['utils', 'config']
+''' Default locations of the cache files, in the tree and in older revisions '''
+C_STATE_PREFIX_LIST = ['/var/lib/vm_cfg_path', '/var/tmp/vm_cfg_path']
+
+''' Copies the tools of the working tree, or of a git revision, with the synthetic config installed as the default one.
+    The default cache files are moved under dest, a run never touches the ones of this host '''
+def make_tree(dest, data_dir, rev=None):
+    os.makedirs(dest)
+    if rev is None:
+        for name in C_TREE_LIST:
+            shutil.copytree(os.path.join(C_PACKAGE_DIR, name), os.path.join(dest, name))
+    else:
+        archive = subprocess.Popen(['git', 'archive', rev] + C_TREE_LIST, cwd=C_PACKAGE_DIR, stdout=subprocess.PIPE)
+        subprocess.check_call(['tar', '-x', '-C', dest], stdin=archive.stdout)
+        archive.stdout.close()
+        if archive.wait() != 0:
+            raise RuntimeError('git archive failed for %s' % rev)
+    shutil.copy(os.path.join(data_dir, 'vm_cfg_path.json'), os.path.join(dest, 'config', 'vm_cfg_path.json'))
+    state_prefix = os.path.join(dest, 'state', 'vm_cfg_path')
+    os.makedirs(os.path.dirname(state_prefix))
+    utils_dir = os.path.join(dest, 'utils')
+    for name in os.listdir(utils_dir):
+        if not name.endswith('.py'):
+            continue
+        path = os.path.join(utils_dir, name)
+        content = open(path).read()
+        new_content = content
+        for prefix in C_STATE_PREFIX_LIST:
+            new_content = new_content.replace(prefix, state_prefix)
+        if new_content != content:
+            fo = open(path, 'w')
+            fo.write(new_content)
+            fo.close()
+    return os.path.join(dest, 'utils', 'vm_cfg_path.py')
+
+''' Returns (seconds to the first output line, seconds to exit) of one run '''
+def run_once(python, script, env):
+    start = time.time()
+    proc = subprocess.Popen([python, script], stdout=subprocess.PIPE, env=env)
+    proc.stdout.readline()
+    first = time.time() - start
+    proc.stdout.read()
+    proc.wait()
+    return (first, time.time() - start)
+
+def median(value_list):
+    value_list = sorted(value_list)
+    return value_list[len(value_list) // 2]
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]', description='Time to first output of vm_cfg_path.py without arguments, as run from cron. '
+        'The default cache files are used as in production, but each tree has its own under the temporary directory.')
+    parser.add_option('-r', '--rev', help='Also measure this git revision, e.g. the one before a change', action='append', dest='rev_list', default=[])
+    parser.add_option('-n', '--runs', help='Runs per tree [default: %default]', type='int', dest='runs', default=20)
+    parser.add_option('-s', '--size', help='domUs of the synthetic dom0 [default: %default]', type='int', dest='size', default=10)
+    parser.add_option('-p', '--python', help='Interpreter running the tool [default: %default]', dest='python', default=sys.executable)
+    (opts, args) = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_startup.')
+    try:
+        bench_e2e.make_dom0(root, opts.size)
+        data_dir = os.path.join(root, 'bench')
+        env = dict(os.environ)
+        env['PATH'] = '%s%s%s' % (os.path.join(data_dir, 'bin'), os.pathsep, env.get('PATH', ''))
+
+        print('%-16s %12s %12s %12s' % ('tree', 'first(ms)', 'min(ms)', 'exit(ms)'))
+        for rev in opts.rev_list + [None]:
+            label = rev or 'working tree'
+            script = make_tree(os.path.join(root, 'tree.%s' % (rev or 'work').replace('/', '_')), data_dir, rev)
+            ''' The first run fills the caches, the following ones are what cron sees '''
+            run_once(opts.python, script, env)
+            result_list = [run_once(opts.python, script, env) for i in range(opts.runs)]
+            first_list = [first for (first, total) in result_list]
+            print('%-16s %12.1f %12.1f %12.1f' % (label, median(first_list) * 1000, min(first_list) * 1000,
+                median([total for (first, total) in result_list]) * 1000))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
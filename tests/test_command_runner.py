@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' CommandRunner against stub shell scripts: deadline, missing executable, run_all order and bound, latency '''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'utils'))
+from command_runner import CommandRunner
+
+''' Forks a child sleeping as long as the script, writes the child pid to $1, then waits for it '''
+C_FORK_STUB = '#!/bin/sh\nsleep 30 &\necho $! > "$1"\nwait\n'
+''' Sleeps $1 seconds, then prints $2 '''
+C_ECHO_STUB = '#!/bin/sh\nsleep "$1"\necho "$2"\n'
+''' Marks itself running in $1 while it sleeps, appending how many were running to $2 '''
+C_COUNT_STUB = '#!/bin/sh\ntouch "$1/$$"\nls "$1" | wc -l >> "$2"\nsleep 0.2\nrm -f "$1/$$"\n'
+C_FAIL_STUB = '#!/bin/sh\nexit 3\n'
+
+''' False once pid has exited, a zombie left for an init that does not reap counts as exited '''
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        fo = open('/proc/%d/stat' % pid)
+        try:
+            return fo.read().rsplit(')', 1)[1].split()[0] != 'Z'
+        finally:
+            fo.close()
+    except (IOError, OSError):
+        return True
+
+class CommandRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_command_runner.')
+        for (name, script) in [('fork_stub', C_FORK_STUB), ('echo_stub', C_ECHO_STUB), ('count_stub', C_COUNT_STUB),
+                ('fail_stub', C_FAIL_STUB)]:
+            path = os.path.join(self.tmp_dir, name)
+            fo = open(path, 'w')
+            try:
+                fo.write(script)
+            finally:
+                fo.close()
+            os.chmod(path, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def stub(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def test_timeout_kills_process_group(self):
+        pid_path = os.path.join(self.tmp_dir, 'child.pid')
+        runner = CommandRunner(timeout=0.5)
+        result = runner([self.stub('fork_stub'), pid_path])
+        ''' The child holds the pipes open: communicate() only returns this early if it was killed too '''
+        self.assertTrue(result.timed_out)
+        self.assertNotEqual(result.code, 0)
+        self.assertTrue(result.elapsed < 10)
+        fo = open(pid_path)
+        try:
+            child_pid = int(fo.read())
+        finally:
+            fo.close()
+        deadline = time.time() + 5
+        while is_alive(child_pid) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(is_alive(child_pid))
+        self.assertEqual(runner.get_stats()['timeouts'], 1)
+
+    def test_no_timeout(self):
+        result = CommandRunner(timeout=5)([self.stub('echo_stub'), '0', 'done'])
+        self.assertFalse(result.timed_out)
+        self.assertEqual(result.code, 0)
+        self.assertEqual(result.out, 'done\n')
+
+    def test_missing_executable(self):
+        runner = CommandRunner()
+        result = runner([os.path.join(self.tmp_dir, 'missing')])
+        self.assertEqual(result.code, CommandRunner.C_CODE_NOT_FOUND)
+        self.assertEqual(result.code, 127)
+        self.assertFalse(result.timed_out)
+        self.assertNotEqual(result.err, '')
+        self.assertEqual(runner.get_stats()['failures'], 1)
+
+    def test_run_all_order(self):
+        ''' The first command finishes last '''
+        argv_list = [[self.stub('echo_stub'), str(0.1 * (4 - index)), 'result%d' % index] for index in range(5)]
+        result_list = CommandRunner(concurrency=5).run_all(argv_list)
+        self.assertEqual([result.out for result in result_list], ['result%d\n' % index for index in range(5)])
+        self.assertEqual([result.argv for result in result_list], argv_list)
+
+    def test_run_all_concurrency(self):
+        running_dir = os.path.join(self.tmp_dir, 'running')
+        os.mkdir(running_dir)
+        count_path = os.path.join(self.tmp_dir, 'count')
+        runner = CommandRunner(concurrency=2)
+        start = time.time()
+        result_list = runner.run_all([[self.stub('count_stub'), running_dir, count_path]] * 6)
+        elapsed = time.time() - start
+        self.assertEqual([result.code for result in result_list], [0] * 6)
+        fo = open(count_path)
+        try:
+            count_list = [int(line) for line in fo.read().split()]
+        finally:
+            fo.close()
+        self.assertEqual(len(count_list), 6)
+        self.assertTrue(max(count_list) <= 2, count_list)
+        ''' 6 commands of 0.2s, 2 at a time: at least 3 rounds '''
+        self.assertTrue(elapsed >= 0.55, elapsed)
+
+    def test_latency(self):
+        runner = CommandRunner()
+        runner.run_all([[self.stub('echo_stub'), '0.2', 'a'], [self.stub('echo_stub'), '0', 'b']])
+        runner([self.stub('fail_stub')])
+        self.assertEqual(sorted(runner.latency_dict.keys()), ['echo_stub', 'fail_stub'])
+        self.assertEqual(len(runner.latency_dict['echo_stub']), 2)
+        stats = runner.get_stats()
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['timeouts'], 0)
+        self.assertEqual(stats['commands']['echo_stub']['calls'], 2)
+        self.assertTrue(stats['commands']['echo_stub']['max'] >= 0.2)
+        self.assertTrue(stats['max'] >= 0.2)
+        report = runner.format_report()
+        self.assertTrue('command echo_stub' in report)
+        self.assertTrue('commands: 3, failures: 1, timeouts: 0' in report)
+
+if __name__ == '__main__':
+    unittest.main()
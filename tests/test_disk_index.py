@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' DiskIndex: disk paths parsed from vm.cfg "disk = [...]" lists, and owners of a disk '''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'utils'))
+from disk_index import DiskIndex, DiskOwner
+
+class ParseDiskTest(unittest.TestCase):
+    def test_disk_spec_prefix(self):
+        for (spec, path) in [
+                ('file:/OVS/running_pool/g1/System.img,xvda,w', '/OVS/running_pool/g1/System.img'),
+                ('tap:aio:/OVS/running_pool/g1/System.img,xvda,w', '/OVS/running_pool/g1/System.img'),
+                ('tap2:tapdisk:aio:/OVS/g1/data.img,xvdb,w!', '/OVS/g1/data.img'),
+                ('phy:/dev/mapper/vg-g1,xvdc,w', '/dev/mapper/vg-g1'),
+                ('/OVS/g1/raw.img,xvdd,r', '/OVS/g1/raw.img'),
+                ('format=raw, vdev=xvda, access=rw, target=/OVS/g1/xl.img', '/OVS/g1/xl.img'),
+                (',hdc:cdrom,r', '')]:
+            self.assertEqual(DiskIndex.parse_disk_spec(spec), path, spec)
+
+    def test_single_line(self):
+        text = "name = 'g1'\ndisk = ['file:/OVS/g1/System.img,xvda,w', \"phy:/dev/vg/g1,xvdb,w\"]\nmemory = 1024\n"
+        self.assertEqual(DiskIndex.parse_disk_list(text), ['/OVS/g1/System.img', '/dev/vg/g1'])
+
+    def test_multi_line(self):
+        text = ("name = 'g1'\n"
+            "disk = [\n"
+            "    'file:/OVS/g1/System.img,xvda,w',\n"
+            "    'tap:aio:/OVS/g1/data.img,xvdb,w',\n"
+            "    ',hdc:cdrom,r',\n"
+            "    'phy:/dev/vg/g1,xvdc,w',\n"
+            "]\n"
+            "vif = ['bridge=xenbr0']\n")
+        self.assertEqual(DiskIndex.parse_disk_list(text), ['/OVS/g1/System.img', '/OVS/g1/data.img', '/dev/vg/g1'])
+
+    def test_comments(self):
+        text = ("# disk = ['file:/OVS/old/System.img,xvda,w']\n"
+            "disk = [ 'file:/OVS/g1/System.img,xvda,w', # was ['file:/OVS/old/System.img'] until [2019]\n"
+            "#        'file:/OVS/g1/removed.img,xvdb,w',\n"
+            "         # don't touch\n"
+            "         'file:/OVS/g1/data.img,xvdc,w' ] # done ]\n")
+        self.assertEqual(DiskIndex.parse_disk_list(text), ['/OVS/g1/System.img', '/OVS/g1/data.img'])
+
+    def test_no_list(self):
+        for text in ['', "name = 'g1'\n", "# disk = ['file:/OVS/g1/System.img,xvda,w']\n", "boot_disk = ['file:/x.img,xvda,w']\n",
+                "disk = ['file:/OVS/g1/System.img,xvda,w',\n", "disk = ['file:/OVS/g1/System.img,xvda,w]\n", 'disk = []\n']:
+            self.assertEqual(DiskIndex.parse_disk_list(text), [], text)
+
+class DiskIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = DiskIndex()
+
+    def test_shared_disk(self):
+        self.index.add('file:/OVS/shared/data.img', 'g1', '/OVS/g1/vm.cfg', False)
+        self.index.add('/OVS/shared//data.img', 'g2', '/OVS/g2/vm.cfg', False)
+        self.index.add('/OVS/g1/System.img', 'g1', '/OVS/g1/vm.cfg', False)
+        self.assertEqual(self.index.lookup('tap:aio:/OVS/shared/./data.img'), [
+            DiskOwner('/OVS/shared/data.img', 'g1', '/OVS/g1/vm.cfg', False),
+            DiskOwner('/OVS/shared/data.img', 'g2', '/OVS/g2/vm.cfg', False)])
+        self.assertEqual(len(self.index), 2)
+
+    def test_running_and_vm_cfg_merge(self):
+        ''' Seen running in xenstore first, without a vm.cfg, then from its vm.cfg '''
+        self.index.add('/OVS/g1/System.img', 'g1', None, True)
+        self.index.add('file:/OVS/g1/System.img', 'g1', '/OVS/g1/vm.cfg', False)
+        self.assertEqual(self.index.lookup('/OVS/g1/System.img'), [DiskOwner('/OVS/g1/System.img', 'g1', '/OVS/g1/vm.cfg', True)])
+
+    def test_unknown_and_symlink(self):
+        tmp_dir = tempfile.mkdtemp(prefix='test_disk_index.')
+        try:
+            real_path = os.path.join(os.path.realpath(tmp_dir), 'System.img')
+            open(real_path, 'w').close()
+            link_path = os.path.join(tmp_dir, 'link.img')
+            os.symlink(real_path, link_path)
+            self.index.add(real_path, 'g1', '/OVS/g1/vm.cfg', False)
+            self.assertEqual([owner.domu_name for owner in self.index.lookup(link_path)], ['g1'])
+            self.assertEqual(self.index.lookup(os.path.join(tmp_dir, 'other.img')), [])
+            self.assertEqual(self.index.lookup_list([real_path, '/nowhere.img']), [
+                (real_path, [DiskOwner(real_path, 'g1', '/OVS/g1/vm.cfg', False)]), ('/nowhere.img', [])])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' DomainRegistry path packing: every vm.cfg and disk path set on a record comes back unchanged '''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'utils'))
+from domain_registry import DomainRegistry
+
+''' (name, path, packed around the name) '''
+C_PATH_CASE_LIST = [
+    ('g1', '/OVS/running_pool/g1/vm.cfg', True),
+    ('g1', '/OVS/g1/g1/vm.cfg', True),
+    ('g1', '/g1/OVS/g1_old/g1.cfg', True),
+    ('g1', '/OVS/running_pool/g1_old/vm.cfg', True),
+    ('g1', '/OVS/images/g1.img', True),
+    ('g1', '/OVS/images/g1', True),
+    ('g1', '/OVS/running_pool/xg1/vm.cfg', False),
+    ('g1', '/OVS/running_pool/g1x/vm.cfg', False),
+    ('g1', '/OVS/running_pool/other/vm.cfg', False),
+    ('g1', 'g1/vm.cfg', False),
+    ('g1', '', False),
+    ('a.b', '/OVS/a.b/vm.cfg', True),
+    ('a.b', '/OVS/aXb/vm.cfg', False),
+    ('', '/OVS/running_pool/vm.cfg', False),
+]
+
+class DomainRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = DomainRegistry()
+
+    def test_vm_cfg_round_trip(self):
+        for (name, path, packed) in C_PATH_CASE_LIST:
+            registry = DomainRegistry()
+            record = registry.set_vm_cfg(name, path, 'pattern')
+            self.assertEqual(record.get_vm_cfg_path(), path, (name, path))
+            self.assertEqual(registry.get_vm_cfg_path(name), path)
+            self.assertEqual(record.vm_cfg_tail is not None, packed, (name, path))
+            self.assertTrue(record.is_vm_cfg_path(path), (name, path))
+            self.assertFalse(record.is_vm_cfg_path(path + 'x'), (name, path))
+            self.assertFalse(record.is_vm_cfg_path('/x' + path), (name, path))
+            self.assertEqual(registry.get_vm_cfg_dict(), {name: path})
+
+    def test_parts_are_shared(self):
+        first = self.registry.set_vm_cfg('g1', '/OVS/running_pool/g1/vm.cfg')
+        second = self.registry.set_vm_cfg('g2', '/OVS/running_pool/g2/vm.cfg')
+        self.assertTrue(first.vm_cfg_head is second.vm_cfg_head)
+        self.assertTrue(first.vm_cfg_tail is second.vm_cfg_tail)
+        self.assertEqual(self.registry.vm_cfg_count, 2)
+        self.assertEqual(self.registry.get_vm_cfg_dict(), {'g1': '/OVS/running_pool/g1/vm.cfg', 'g2': '/OVS/running_pool/g2/vm.cfg'})
+
+    def test_set_disk_list(self):
+        self.registry.add_running('5', 'g1')
+        self.assertEqual(self.registry.get_disk_list('5'), None)
+        self.assertEqual(self.registry.get('g1').get_first_disk(), None)
+        disk_list = [path for (name, path, packed) in C_PATH_CASE_LIST if name == 'g1' and path]
+        self.registry.set_disk_list('5', disk_list)
+        self.assertEqual(self.registry.get_disk_list('5'), disk_list)
+        self.assertEqual(self.registry.get('g1').get_first_disk(), disk_list[0])
+
+        ''' A new list replaces the previous one '''
+        self.registry.set_disk_list('5', ['/OVS/g1/System.img'])
+        self.assertEqual(self.registry.get_disk_list('5'), ['/OVS/g1/System.img'])
+        self.registry.set_disk_list('5', [])
+        self.assertEqual(self.registry.get_disk_list('5'), [])
+        self.assertEqual(self.registry.get('g1').get_first_disk(), None)
+
+        ''' Disks of a domain not running are not recorded '''
+        self.registry.set_disk_list('6', ['/OVS/g2/System.img'])
+        self.assertEqual(self.registry.get_disk_list('6'), None)
+        self.assertEqual(self.registry.get_by_id('6'), None)
+
+    def test_renamed_domain(self):
+        self.registry.add_running('5', 'old')
+        self.registry.set_disk_list('5', ['/OVS/old/System.img'])
+        self.registry.set_vm_cfg('old', '/OVS/old/vm.cfg')
+
+        record = self.registry.add_running('5', 'new')
+        self.assertEqual(record.name, 'new')
+        self.assertEqual(self.registry.get_name('5'), 'new')
+        self.assertEqual(self.registry.get_running_name_list(), ['new'])
+        ''' The disks were those of the old record, they are read again for the new name '''
+        self.assertEqual(self.registry.get_disk_list('5'), None)
+        self.registry.set_disk_list('5', ['/OVS/old/System.img'])
+        self.assertEqual(self.registry.get_disk_list('5'), ['/OVS/old/System.img'])
+        ''' The old name keeps its vm.cfg, no longer running '''
+        old_record = self.registry.get('old')
+        self.assertEqual(old_record.domu_id, None)
+        self.assertEqual(old_record.disks, None)
+        self.assertEqual(old_record.get_vm_cfg_path(), '/OVS/old/vm.cfg')
+
+    def test_release(self):
+        self.registry.add_running('5', 'g1')
+        self.registry.add_running('6', 'g2')
+        self.registry.set_vm_cfg('g2', '/OVS/g2/vm.cfg')
+        self.registry.remove_running('5')
+        self.registry.remove_running('6')
+        ''' Neither running nor resolved: dropped; resolved: kept '''
+        self.assertEqual(self.registry.get('g1'), None)
+        self.assertEqual(self.registry.get('g2').get_vm_cfg_path(), '/OVS/g2/vm.cfg')
+        self.assertEqual(self.registry.get_running_count(), 0)
+        self.registry.clear_vm_cfg()
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(self.registry.vm_cfg_count, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' DomainSampler: ring buffer wraparound, CPU rate between samples and over counter resets '''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'utils'))
+from command_runner import CommandResult
+from domain_sampler import DomainSampler
+
+C_HEADER = 'Name                                        ID   Mem VCPUs      State   Time(s)'
+C_DOM0 = 'Domain-0                                     0  2048     4     r-----   1234.5'
+
+''' (name, domu_id, mem MB, vcpus, state, cpu seconds) as list_domain_stats() gives them '''
+def row(name, cpu_time, domu_id='1', mem=1024, vcpus=2, state='-b----'):
+    return (name, domu_id, mem, vcpus, state, cpu_time)
+
+class FakeXm(object):
+    ''' docmd answering xm list with the next table of table_list '''
+
+    """ Class initializer """
+    def __init__(self, table_list):
+        self.table_list = list(table_list)
+
+    def __call__(self, argv):
+        if argv != ['xm', 'list'] or len(self.table_list) == 0:
+            return CommandResult(argv, '', 'Error', 1)
+        lines = [C_HEADER, C_DOM0]
+        for (name, domu_id, mem, vcpus, state, cpu_time) in self.table_list.pop(0):
+            lines.append('%-40s %5s %5d %5d     %s %9.1f' % (name, domu_id, mem, vcpus, state, cpu_time))
+        return CommandResult(argv, '\n'.join(lines) + '\n', '', 0)
+
+class DomainSamplerTest(unittest.TestCase):
+    def sampler(self, capacity=4):
+        return DomainSampler(None, 'xm', capacity)
+
+    def test_wraparound(self):
+        sampler = self.sampler(3)
+        for i in range(5):
+            sampler.sample_rows([row('g1', 10.0 * i, mem=1000 + i)], 100.0 + i)
+        history = sampler.history_dict['g1']
+        self.assertEqual(history.count, 3)
+        self.assertEqual(history.pos, 2)
+        self.assertEqual(history.get_slot_list(), [2, 0, 1])
+        self.assertEqual(history.get_last_slot(), 1)
+        domain = sampler.to_dict()['domains']['g1']
+        self.assertEqual(domain['time'], [102.0, 103.0, 104.0])
+        self.assertEqual(domain['mem'], [1002, 1003, 1004])
+        self.assertEqual(domain['cpu_time'], [20.0, 30.0, 40.0])
+        self.assertEqual(domain['cpu_delta'], [10.0, 10.0, 10.0])
+        self.assertEqual(sampler.to_dict()['samples'], 5)
+        self.assertEqual(sampler.to_dict()['capacity'], 3)
+
+    def test_partial_and_exact_fill(self):
+        sampler = self.sampler(3)
+        sampler.sample_rows([row('g1', 1.0)], 1.0)
+        sampler.sample_rows([row('g1', 2.0)], 2.0)
+        self.assertEqual(sampler.history_dict['g1'].get_slot_list(), [0, 1])
+        sampler.sample_rows([row('g1', 3.0)], 3.0)
+        ''' Full, the next slot is 0 again and pos - 1 is still the last one '''
+        history = sampler.history_dict['g1']
+        self.assertEqual((history.pos, history.count), (0, 3))
+        self.assertEqual(history.get_slot_list(), [0, 1, 2])
+        self.assertEqual(history.cpu_time[history.get_last_slot()], 3.0)
+
+    def test_minimum_capacity(self):
+        self.assertEqual(self.sampler(0).capacity, 2)
+
+    def test_rate(self):
+        sampler = self.sampler()
+        sampler.sample_rows([row('g1', 100.0)], 10.0)
+        self.assertEqual(sampler.get_top_list()[0][3], 0.0)
+        sampler.sample_rows([row('g1', 101.5)], 12.0)
+        ''' 1.5 CPU seconds in 2 seconds '''
+        self.assertEqual(sampler.get_top_list()[0][3], 75.0)
+        self.assertEqual(sampler.to_dict()['domains']['g1']['cpu_delta'], [0.0, 1.5])
+
+    def test_counter_reset(self):
+        sampler = self.sampler()
+        sampler.sample_rows([row('g1', 500.0)], 10.0)
+        ''' CPU time went back on the same ID: no negative rate, the next sample counts from the new value '''
+        sampler.sample_rows([row('g1', 2.0)], 11.0)
+        sampler.sample_rows([row('g1', 3.0)], 12.0)
+        domain = sampler.to_dict()['domains']['g1']
+        self.assertEqual(domain['cpu_delta'], [0.0, 0.0, 1.0])
+        self.assertEqual(domain['cpu_percent'], [0.0, 0.0, 100.0])
+
+    def test_restart_with_new_id(self):
+        sampler = self.sampler()
+        sampler.sample_rows([row('g1', 500.0, '1')], 10.0)
+        ''' Restarted and already past its old CPU time: the new ID tells it is a new counter '''
+        sampler.sample_rows([row('g1', 600.0, '7')], 11.0)
+        sampler.sample_rows([row('g1', 600.5, '7')], 12.0)
+        domain = sampler.to_dict()['domains']['g1']
+        self.assertEqual(domain['domu_id'], '7')
+        self.assertEqual(domain['cpu_delta'], [0.0, 0.0, 0.5])
+
+    def test_no_elapsed_time(self):
+        sampler = self.sampler()
+        sampler.sample_rows([row('g1', 1.0)], 10.0)
+        sampler.sample_rows([row('g1', 2.0)], 10.0)
+        self.assertEqual(sampler.to_dict()['domains']['g1']['cpu_percent'], [0.0, 0.0])
+
+    def test_domain_gone_and_back(self):
+        sampler = self.sampler()
+        sampler.sample_rows([row('g1', 1.0), row('g2', 5.0, '2')], 10.0)
+        sampler.sample_rows([row('g2', 6.0, '2')], 11.0)
+        self.assertEqual(sorted(sampler.history_dict.keys()), ['g2'])
+        sampler.sample_rows([row('g1', 9.0), row('g2', 7.0, '2')], 12.0)
+        self.assertEqual(sampler.to_dict()['domains']['g1']['cpu_time'], [9.0])
+        self.assertEqual(sampler.to_dict()['domains']['g1']['cpu_delta'], [0.0])
+        self.assertEqual(sampler.to_dict()['domains']['g2']['cpu_time'], [5.0, 6.0, 7.0])
+
+    def test_state_and_top(self):
+        sampler = self.sampler()
+        sampler.sample_rows([row('g1', 0.0, '1', 512, 1, 'r-----'), row('g2', 0.0, '2', 4096, 4, '--p---'), row('g3', 0.0, '3', 2048, 2, '-b-s--')], 0.0)
+        sampler.sample_rows([row('g1', 0.5, '1', 512, 1, 'r-----'), row('g2', 0.0, '2', 4096, 4, '--p---'), row('g3', 1.0, '3', 2048, 2, '-b-s--')], 1.0)
+        self.assertEqual([top[0] for top in sampler.get_top_list()], ['g3', 'g1', 'g2'])
+        self.assertEqual([top[0] for top in sampler.get_top_list('mem')], ['g2', 'g3', 'g1'])
+        self.assertEqual([top[0] for top in sampler.get_top_list('name', 2)], ['g1', 'g2'])
+        self.assertEqual(dict([(top[0], top[2]) for top in sampler.get_top_list()]), {'g1': 'r-----', 'g2': '--p---', 'g3': '-b-s--'})
+        self.assertEqual(sampler.to_dict()['domains']['g3']['state'], ['-b-s--', '-b-s--'])
+
+    def test_sample_from_xm(self):
+        sampler = DomainSampler(FakeXm([[row('g 1', 10.0, '3')], [row('g 1', 12.0, '3')]]), 'xm', 4)
+        self.assertTrue(sampler.sample(100.0))
+        self.assertTrue(sampler.sample(104.0))
+        self.assertEqual(sampler.get_top_list(), [('g 1', '3', '-b----', 50.0, 12.0, 1024, 2)])
+        ''' The table is gone: the sample fails, the history stays '''
+        self.assertFalse(sampler.sample(105.0))
+        self.assertEqual(sampler.sample_count, 2)
+        self.assertTrue('g 1' in sampler.format_top())
+
+if __name__ == '__main__':
+    unittest.main()
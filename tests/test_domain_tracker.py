@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' DomainTracker driven by a local fake watch stream and a fake xenstore behind docmd '''
+
+import os
+import sys
+import unittest
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'utils'))
+from command_runner import CommandResult
+from domain_tracker import DomainTracker
+
+class FakeXenStore(object):
+    ''' Answers the xenstore-ls -f and xenstore-list calls of the tracker from a path -> value dict '''
+
+    """ Class initializer """
+    def __init__(self):
+        self.node_dict = {'/local/domain/0/name': 'Domain-0'}
+        self.argv_list = []
+
+    def add_domain(self, domu_id, name, disk_list=None):
+        self.node_dict['/local/domain/%s/name' % domu_id] = name
+        for (index, disk) in enumerate(disk_list or []):
+            backend = '/local/domain/0/backend/vbd/%s/%d' % (domu_id, 51712 + index)
+            self.node_dict['/local/domain/%s/device/vbd/%d/backend' % (domu_id, 51712 + index)] = backend
+            if disk is not None:
+                self.node_dict['%s/params' % backend] = disk
+
+    def set_params(self, domu_id, index, disk):
+        self.node_dict['/local/domain/0/backend/vbd/%s/%d/params' % (domu_id, 51712 + index)] = disk
+
+    def remove_domain(self, domu_id):
+        for prefix in ['/local/domain/%s/' % domu_id, '/local/domain/0/backend/vbd/%s/' % domu_id]:
+            for path in [path for path in self.node_dict if path.startswith(prefix)]:
+                del self.node_dict[path]
+
+    def __call__(self, argv):
+        self.argv_list.append(list(argv))
+        if argv[:2] == ['xenstore-ls', '-f']:
+            prefix = '%s/' % argv[2].rstrip('/')
+            lines = ['%s = "%s"' % (path, self.node_dict[path]) for path in sorted(self.node_dict) if path.startswith(prefix)]
+            return CommandResult(argv, '\n'.join(lines) + '\n', '', 0)
+        if argv[0] == 'xenstore-list':
+            prefix = '%s/' % argv[1].rstrip('/')
+            child_set = set([path[len(prefix):].split('/')[0] for path in self.node_dict if path.startswith(prefix)])
+            return CommandResult(argv, '\n'.join(sorted(child_set)) + '\n', '', 0)
+        return CommandResult(argv, '', 'unknown command', 1)
+
+class DomainTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.xenstore = FakeXenStore()
+        self.xenstore.add_domain('1', 'alpha', ['/OVS/alpha/System.img'])
+        self.tracker = DomainTracker(self.xenstore)
+        self.assertTrue(self.tracker.initialize())
+        self.registry = self.tracker.domain_registry
+        self.changed_list = []
+
+    def consume(self, text):
+        self.tracker.consume(StringIO(text), lambda tracker: self.changed_list.append(sorted(tracker.domain_registry.get_running_id_list())))
+
+    def test_initialize(self):
+        self.assertEqual(self.registry.get_running_id_list(), ['1'])
+        self.assertEqual(self.registry.get_name('1'), 'alpha')
+        self.assertEqual(self.registry.get_disk_list('1'), ['/OVS/alpha/System.img'])
+
+    def test_introduce(self):
+        self.xenstore.add_domain('2', 'beta', ['/OVS/beta/System.img', '/OVS/beta/data.img'])
+        self.consume('@introduceDomain\n')
+        self.assertEqual(sorted(self.registry.get_running_id_list()), ['1', '2'])
+        record = self.registry.get('beta')
+        self.assertEqual(record.domu_id, '2')
+        self.assertEqual(record.get_disk_list(), ['/OVS/beta/System.img', '/OVS/beta/data.img'])
+        self.assertEqual(self.changed_list, [['1', '2']])
+        ''' Only the new domain is read again, not the whole tree '''
+        self.assertTrue(['xenstore-ls', '-f', '/local/domain/2'] in self.xenstore.argv_list)
+        self.assertEqual(self.xenstore.argv_list.count(['xenstore-ls', '-f', '/local/domain']), 1)
+
+    def test_release(self):
+        self.xenstore.remove_domain('1')
+        self.consume('@releaseDomain\n')
+        self.assertEqual(self.registry.get_running_id_list(), [])
+        self.assertEqual(self.registry.get('alpha'), None)
+        self.assertEqual(self.registry.get_disk_list('1'), None)
+        self.assertEqual(self.changed_list, [[]])
+
+    def test_pending(self):
+        ''' Introduced before its vbd backend has params: running, disks unknown until a later event '''
+        self.xenstore.add_domain('3', 'gamma', [None])
+        self.consume('@introduceDomain\n')
+        self.assertEqual(self.registry.get_name('3'), 'gamma')
+        self.assertEqual(self.registry.get_disk_list('3'), None)
+        self.assertTrue('3' in self.tracker.pending_set)
+
+        self.xenstore.set_params('3', 0, '/OVS/gamma/System.img')
+        self.consume('@introduceDomain\n')
+        self.assertEqual(self.registry.get_disk_list('3'), ['/OVS/gamma/System.img'])
+        self.assertFalse('3' in self.tracker.pending_set)
+
+    def test_unrelated_and_partial_lines(self):
+        self.xenstore.add_domain('2', 'beta', ['/OVS/beta/System.img'])
+        self.assertFalse(self.tracker.feed('/local/domain/2/name token\n'))
+        self.assertEqual(self.registry.get_running_id_list(), ['1'])
+        self.assertFalse(self.tracker.feed('@introduce'))
+        self.assertTrue(self.tracker.feed('Domain\n'))
+        self.assertEqual(sorted(self.registry.get_running_id_list()), ['1', '2'])
+
+    def test_no_change(self):
+        self.consume('@introduceDomain\n@releaseDomain\n')
+        self.assertEqual(self.changed_list, [])
+        self.assertEqual(self.registry.get_running_id_list(), ['1'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' VmCfgPlan glob translation against glob.glob, and domain name extraction, on a small fixture tree '''
+
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'utils'))
+from vm_cfg_plan import VmCfgPlan
+
+''' Domain names holding glob magic or braces, each with a vm.cfg under xen/ '''
+C_ODD_NAME_LIST = ['a*b', 'q?x', 'br[1]', 'c{u}r', 'x]y', 'n!m']
+''' Names the odd ones would match as globs, so a narrowed plan matching them is caught '''
+C_DECOY_NAME_LIST = ['aXXb', 'qzx', 'br1', 'plain']
+
+class VmCfgPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='test_vm_cfg_plan.')
+        for name in C_ODD_NAME_LIST + C_DECOY_NAME_LIST + ['br[1]_old']:
+            self.touch('xen/%s/vm.cfg' % name)
+        self.touch('xen/plain/other.cfg')
+        self.touch('xen/.hidden/vm.cfg')
+        self.touch('OVS/Repositories/r1/VirtualMachines/vm1/vm.cfg')
+        self.touch('OVS/Repositories/r2/VirtualMachines/vm2/vm.cfg')
+        self.touch('OVS/Repositories/r2/VirtualMachines/vm3/System.img')
+        self.touch('OVS/Repositories/.snap/VirtualMachines/vm4/vm.cfg')
+        os.mkdir(os.path.join(self.root, 'xen', 'dangling'))
+        os.symlink(os.path.join(self.root, 'nowhere'), os.path.join(self.root, 'xen', 'dangling', 'vm.cfg'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def touch(self, relative_path):
+        path = os.path.join(self.root, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def plan(self, relative_pattern):
+        return VmCfgPlan.compile({'path_pattern': '%s/%s' % (self.root, relative_pattern), 'type': 'vmcfg', 'enable': 'True'})
+
+    def test_expand_matches_glob(self):
+        for relative_pattern in ['xen/{DOMU_HOSTNAME}/vm.cfg', 'OVS/Repositories/*/VirtualMachines/{DOMU_HOSTNAME}/vm.cfg',
+                'OVS/Repositories/*/VirtualMachines/*/*', 'xen/[ab]*/vm.cfg', 'xen/[!abq]*/vm.cfg', 'xen/?lain/*.cfg',
+                'xen/br[[]1]/vm.cfg', 'xen/[]x]]y/vm.cfg', 'xen/.*/vm.cfg', 'xen/plain/vm.cfg', 'missing/*/vm.cfg', 'xen/*/missing']:
+            plan = self.plan(relative_pattern)
+            self.assertEqual(sorted(plan.expand()), sorted(glob.glob(plan.glob_path)), relative_pattern)
+
+    def test_match_path_matches_glob(self):
+        plan = self.plan('xen/{DOMU_HOSTNAME}/vm.cfg')
+        expected = sorted(glob.glob(plan.glob_path))
+        candidate_list = sorted(glob.glob(os.path.join(self.root, 'xen', '*', '*')) + glob.glob(os.path.join(self.root, 'xen', '.*', '*')))
+        self.assertEqual([path for path in candidate_list if plan.match_path(path) and not os.path.basename(os.path.dirname(path)).startswith('.')], expected)
+
+    def test_skip_set(self):
+        plan = self.plan('OVS/Repositories/*/VirtualMachines/{DOMU_HOSTNAME}/vm.cfg')
+        skipped = os.path.join(self.root, 'OVS', 'Repositories', 'r1')
+        self.assertEqual(plan.expand(set([skipped])), [os.path.join(self.root, 'OVS/Repositories/r2/VirtualMachines/vm2/vm.cfg')])
+
+    def test_extract_domu_name(self):
+        plan = self.plan('xen/{DOMU_HOSTNAME}/vm.cfg')
+        for name in C_ODD_NAME_LIST:
+            self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'xen', name, 'vm.cfg')), name)
+        self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'xen', 'plain', 'other.cfg')), '')
+        self.assertEqual(plan.extract_domu_name('/elsewhere/xen/plain/vm.cfg'), '')
+        self.assertEqual(self.plan('xen/plain/vm.cfg').extract_domu_name(os.path.join(self.root, 'xen', 'plain', 'vm.cfg')), '')
+
+        plan = self.plan('OVS/Repositories/*/VirtualMachines/{DOMU_HOSTNAME}/vm.cfg')
+        self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'OVS/Repositories/r2/VirtualMachines/vm2/vm.cfg')), 'vm2')
+        self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'OVS/Repositories/r2/x/VirtualMachines/vm2/vm.cfg')), '')
+
+    def test_extract_from_pattern_with_magic_around_key(self):
+        ''' Magic characters of the pattern itself are globs, those of the name are literal '''
+        plan = self.plan('xen/[ab]{DOMU_HOSTNAME}b/vm.cfg')
+        self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'xen', 'aXXb', 'vm.cfg')), 'XX')
+        self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'xen', 'a*b', 'vm.cfg')), '*')
+        self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'xen', 'plain', 'vm.cfg')), '')
+        plan = self.plan('xen/?{DOMU_HOSTNAME}/vm.cfg')
+        self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'xen', 'q?x', 'vm.cfg')), '?x')
+        self.assertEqual(plan.extract_domu_name(os.path.join(self.root, 'xen', 'br[1]', 'vm.cfg')), 'r[1]')
+
+    def test_narrow_is_literal(self):
+        plan = self.plan('xen/{DOMU_HOSTNAME}/vm.cfg')
+        for name in C_ODD_NAME_LIST:
+            narrowed = plan.narrow(name)
+            self.assertEqual(narrowed.expand(), [os.path.join(self.root, 'xen', name, 'vm.cfg')], name)
+            ''' Matching and extraction stay those of the full pattern '''
+            self.assertEqual(narrowed.extract_domu_name(narrowed.expand()[0]), name)
+        self.assertEqual(plan.narrow('missing').expand(), [])
+        self.assertEqual(self.plan('xen/plain/vm.cfg').narrow('plain'), None)
+
+    def test_narrow_prefix(self):
+        plan = self.plan('xen/{DOMU_HOSTNAME}/vm.cfg')
+        self.assertEqual(plan.narrow('br[1]', True).expand(), [os.path.join(self.root, 'xen', 'br[1]_old', 'vm.cfg')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' VmCfgSnapshot: what --diff reports between two runs, and a previous snapshot that is missing or unusable '''
+
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'utils'))
+from vm_cfg_snapshot import VmCfgSnapshot
+
+C_PATTERN = '/OVS/running_pool/{DOMU_HOSTNAME}/vm.cfg'
+C_OTHER_PATTERN = '/OVS/Repositories/*/VirtualMachines/{DOMU_HOSTNAME}/vm.cfg'
+
+def item(name, path=None, pattern=C_PATTERN, key=None):
+    if path is None:
+        path = '/OVS/running_pool/%s/vm.cfg' % name
+    if key is None:
+        key = [2049, len(name), 1700000000.0, 512]
+    return (name, path, pattern, key)
+
+class VmCfgSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_vm_cfg_snapshot.')
+        os.chmod(self.tmp_dir, 0o700)
+        self.path = os.path.join(self.tmp_dir, 'snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    ''' Snapshot of a first run over item_list, saved and read back as the next run would '''
+    def previous(self, item_list):
+        snapshot = VmCfgSnapshot(self.path)
+        snapshot.diff(item_list)
+        self.assertTrue(snapshot.save())
+        return VmCfgSnapshot(self.path)
+
+    def test_first_run(self):
+        snapshot = VmCfgSnapshot(self.path)
+        self.assertEqual(snapshot.entry_dict, {})
+        self.assertEqual(snapshot.diff([item('g2'), item('g1')]), [
+            ('added', 'g1', '/OVS/running_pool/g1/vm.cfg', '', C_PATTERN),
+            ('added', 'g2', '/OVS/running_pool/g2/vm.cfg', '', C_PATTERN)])
+        self.assertTrue(snapshot.save())
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode) & 0o022, 0)
+
+    def test_unchanged(self):
+        snapshot = self.previous([item('g1'), item('g2')])
+        self.assertEqual(snapshot.diff([item('g1'), item('g2')]), [])
+        self.assertFalse(snapshot.dirty)
+
+    def test_added_removed_moved(self):
+        snapshot = self.previous([item('g1'), item('g2'), item('g3')])
+        moved_path = '/OVS/Repositories/r1/VirtualMachines/g2/vm.cfg'
+        change_list = snapshot.diff([item('g1'), item('g2', moved_path, C_OTHER_PATTERN), item('g4')])
+        self.assertEqual(change_list, [
+            ('moved', 'g2', moved_path, '/OVS/running_pool/g2/vm.cfg', C_OTHER_PATTERN),
+            ('removed', 'g3', '/OVS/running_pool/g3/vm.cfg', '', C_PATTERN),
+            ('added', 'g4', '/OVS/running_pool/g4/vm.cfg', '', C_PATTERN)])
+        self.assertTrue(snapshot.save())
+        ''' The next run compares with this one '''
+        self.assertEqual(VmCfgSnapshot(self.path).diff([item('g1'), item('g2', moved_path, C_OTHER_PATTERN), item('g4')]), [])
+
+    def test_renamed(self):
+        ''' Same vm.cfg, new name: the old name is removed and the new one added, both at that path '''
+        snapshot = self.previous([item('g1')])
+        path = '/OVS/running_pool/g1/vm.cfg'
+        self.assertEqual(snapshot.diff([item('g1new', path)]), [
+            ('removed', 'g1', path, '', C_PATTERN),
+            ('added', 'g1new', path, '', C_PATTERN)])
+
+    def test_incomplete_run(self):
+        ''' Names a partial run did not see may only have timed out, they are kept and not reported '''
+        snapshot = self.previous([item('g1'), item('g2')])
+        self.assertEqual(snapshot.diff([item('g1'), item('g3')], complete=False), [
+            ('added', 'g3', '/OVS/running_pool/g3/vm.cfg', '', C_PATTERN)])
+        self.assertTrue(snapshot.save())
+        self.assertEqual(VmCfgSnapshot(self.path).diff([item('g1'), item('g3')]), [
+            ('removed', 'g2', '/OVS/running_pool/g2/vm.cfg', '', C_PATTERN)])
+
+    def test_domain_name_by_stat_key(self):
+        snapshot = self.previous([item('g1')])
+        path = '/OVS/running_pool/g1/vm.cfg'
+        key = item('g1')[3]
+        self.assertEqual(snapshot.get_domain_name(path, key), 'g1')
+        self.assertEqual(snapshot.get_domain_name(path, [key[0], key[1], key[2] + 1, key[3]]), None)
+        self.assertEqual(snapshot.get_domain_name(path, None), None)
+        self.assertEqual(snapshot.get_domain_name('/OVS/running_pool/g2/vm.cfg', key), None)
+        self.assertEqual((snapshot.hits, snapshot.misses), (1, 3))
+
+    def check_unusable(self):
+        snapshot = VmCfgSnapshot(self.path)
+        self.assertEqual(snapshot.entry_dict, {})
+        self.assertEqual(snapshot.get_domain_name('/OVS/running_pool/g1/vm.cfg', item('g1')[3]), None)
+        self.assertEqual([change[0] for change in snapshot.diff([item('g1')])], ['added'])
+        ''' Replaced by a good one '''
+        self.assertTrue(snapshot.save())
+        self.assertEqual(VmCfgSnapshot(self.path).diff([item('g1')]), [])
+
+    def write(self, text, mode=0o600):
+        fo = open(self.path, 'w')
+        try:
+            fo.write(text)
+        finally:
+            fo.close()
+        os.chmod(self.path, mode)
+
+    def test_missing_snapshot(self):
+        self.check_unusable()
+
+    def test_corrupt_snapshot(self):
+        for text in ['{"version": 1, "entries": {"g1": ["/OVS/running', '', 'null', '[]', '{"version": 1, "entries": []}',
+                '{"version": 0, "entries": {}}']:
+            self.write(text)
+            self.check_unusable()
+
+    def test_untrusted_snapshot(self):
+        self.previous([item('g1')])
+        os.chmod(self.path, 0o666)
+        self.check_unusable()
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode) & 0o022, 0)
+
+    def test_symlink_not_followed(self):
+        target = os.path.join(self.tmp_dir, 'target')
+        self.path, real_path = target, self.path
+        self.previous([item('g1')])
+        self.path = real_path
+        os.symlink(target, self.path)
+        self.check_unusable()
+        self.assertFalse(os.path.islink(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' xenview.py candidate scan: the in-process walk and ignore rules against the find/grep pipeline they replaced '''
+
+import os
+import re
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from subprocess import Popen, PIPE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'utils'))
+import xenview
+from xenview import XenView
+
+C_TOOL_DIR_LIST = ['/usr/bin', '/bin']
+
+def has_tool(name):
+    for dir_path in C_TOOL_DIR_LIST:
+        if os.access(os.path.join(dir_path, name), os.X_OK):
+            return True
+    return False
+
+''' Candidates as the baseline found them: find/grep -Iq over the conf paths, .vms lists expanded, then every
+    ignore rule tried on the file name '''
+def baseline_candidate_list(conf_path_list, ignore_regex_list):
+    cmd = 'find %s -maxdepth 1 -type f -exec grep -Iq . {} \\; -print 2>&1 |grep -v "No such file"' % ' '.join(conf_path_list)
+    out = Popen(cmd, shell=True, stdout=PIPE, universal_newlines=True,
+        env={'PATH': ':'.join(C_TOOL_DIR_LIST), 'LC_ALL': 'C'}).communicate()[0]
+    path_list = []
+    for file_path in out.splitlines():
+        if re.search(r"\.vms$", file_path):
+            fo = open(file_path)
+            try:
+                path_list += [line.strip() for line in fo if line.strip() and not line.strip().startswith('#')]
+            finally:
+                fo.close()
+        else:
+            path_list.append(file_path)
+    result_list = []
+    for file_path in path_list:
+        if not os.path.isfile(file_path):
+            continue
+        if [regex for regex in ignore_regex_list if re.search(regex, os.path.basename(file_path), re.IGNORECASE)]:
+            continue
+        result_list.append(file_path)
+    return sorted(set(result_list))
+
+class XenViewScanTest(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp(prefix='test_xenview_scan.'))
+        for (relative_path, content) in [
+                ('cfg/vm.cfg', "name = 'g1'\n"),
+                ('cfg/g2.cfg', "name = 'g2'  # renamed in 2019\n"),
+                ('cfg/.hidden.cfg', "name = 'g9'\n"),
+                ('cfg/vm.cfg.bak', "name = 'g1'\n"),
+                ('cfg/old_g3.cfg', "name = 'g3'\n"),
+                ('cfg/JAN.cfg', "name = 'g3'\n"),
+                ('cfg/notes.txt', 'notes\n'),
+                ('cfg/empty.cfg', ''),
+                ('cfg/newlines.cfg', '\n\n\n'),
+                ('cfg/image.img', 'name = \0\0\0'),
+                ('cfg/sub/deep.cfg', "name = 'g4'\n"),
+                ('pool1/a/vm.cfg', "name = 'g10'\n"),
+                ('pool2/b/vm.cfg', "name = 'g11'\n"),
+                ('pool2/b/vm.cfg.orig', "name = 'g11'\n"),
+                ('direct/g5.cfg', "name = 'g5'\n"),
+                ('listed/g6.cfg', "name = 'g6'\n"),
+                ('listed/g7.bak', "name = 'g7'\n"),
+                ('listed/data.bin', '\0\0'),
+                ('lists/host.vms', '# autostart\n%(root)s/listed/g6.cfg\n%(root)s/listed/g7.bak\n%(root)s/listed/data.bin\n'
+                    '%(root)s/listed/missing.cfg\n\n%(root)s/cfg/vm.cfg\n')]:
+            self.write(relative_path, content % {'root': self.root})
+        os.symlink(os.path.join(self.root, 'cfg', 'vm.cfg'), os.path.join(self.root, 'cfg', 'link.cfg'))
+        os.symlink(os.path.join(self.root, 'cfg'), os.path.join(self.root, 'linkdir'))
+        self.conf_path_list = ['%s/%s' % (self.root, path) for path in ['cfg', 'pool*/*', 'direct/g5.cfg', 'lists', 'nothere', 'linkdir']]
+        self.write('vm_cfg_path.config', '# conf\n%s\n' % '\n'.join(self.conf_path_list))
+        self.ignore_conf_path = XenView.C_IGNORE_CONF_PATH
+        self.scandir = xenview.scandir
+
+    def tearDown(self):
+        xenview.scandir = self.scandir
+        shutil.rmtree(self.root)
+
+    def write(self, relative_path, content):
+        path = os.path.join(self.root, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fo = open(path, 'w')
+        try:
+            fo.write(content)
+        finally:
+            fo.close()
+        return path
+
+    ''' No Xen tool on PATH: the domain listing fails at once, the scan does not need it '''
+    def create_xenview(self):
+        path = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.path.join(self.root, 'nothere')
+        try:
+            return XenView(conf_path=os.path.join(self.root, 'vm_cfg_path.config'), ignore_conf_path=self.ignore_conf_path)
+        finally:
+            os.environ['PATH'] = path
+
+    def get_ignore_regex_list(self):
+        fo = open(self.ignore_conf_path)
+        try:
+            return json.load(fo)['ignore_regex_list']
+        finally:
+            fo.close()
+
+    def candidate_list(self, xv):
+        return sorted(xv._get_all_possible_vm_cfg_list())
+
+    def expected(self, *relative_path_list):
+        return sorted([os.path.join(self.root, path) for path in relative_path_list])
+
+    def test_candidates(self):
+        self.assertEqual(self.candidate_list(self.create_xenview()), self.expected('cfg/vm.cfg', 'cfg/g2.cfg', 'cfg/.hidden.cfg',
+            'pool1/a/vm.cfg', 'pool2/b/vm.cfg', 'direct/g5.cfg', 'listed/g6.cfg', 'listed/data.bin'))
+
+    @unittest.skipUnless(has_tool('find') and has_tool('grep'), 'find and grep are needed for the baseline')
+    def test_same_as_find_grep(self):
+        expected = baseline_candidate_list(self.conf_path_list, self.get_ignore_regex_list())
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(self.candidate_list(self.create_xenview()), expected)
+
+    @unittest.skipUnless(has_tool('find') and has_tool('grep'), 'find and grep are needed for the baseline')
+    def test_same_as_find_grep_without_scandir(self):
+        xenview.scandir = None
+        self.assertEqual(self.candidate_list(self.create_xenview()), baseline_candidate_list(self.conf_path_list, self.get_ignore_regex_list()))
+
+    def test_ignore_stats(self):
+        xv = self.create_xenview()
+        self.candidate_list(xv)
+        hit_dict = dict(xv.get_ignore_stats())
+        self.assertEqual(hit_dict['\\.bak'], 2)
+        self.assertEqual(hit_dict['old'], 1)
+        self.assertEqual(hit_dict['Jan'], 1)
+        self.assertEqual(hit_dict['\\.orig'], 1)
+        self.assertEqual(hit_dict['txt$'], 1)
+
+    def test_ignore_reload(self):
+        self.ignore_conf_path = self.write('ignore.json', json.dumps({'ignore_regex_list': ['\\.bak$']}))
+        xv = self.create_xenview()
+        before = self.candidate_list(xv)
+        self.assertTrue(os.path.join(self.root, 'cfg', 'old_g3.cfg') in before)
+        self.assertFalse(os.path.join(self.root, 'cfg', 'vm.cfg.bak') in before)
+
+        self.write('ignore.json', json.dumps({'ignore_regex_list': ['\\.bak$', '^old_', 'g5']}))
+        xv.reload_ignore_list()
+        self.assertEqual(xv.possible_vm_cfg_list, [])
+        self.assertEqual(sorted(xv.get_ignore_stats()), [('\\.bak$', 0), ('^old_', 0), ('g5', 0)])
+        after = self.candidate_list(xv)
+        self.assertEqual(sorted(set(before) - set(after)), self.expected('cfg/old_g3.cfg', 'direct/g5.cfg'))
+        hit_dict = dict(xv.get_ignore_stats())
+        self.assertEqual((hit_dict['^old_'], hit_dict['g5']), (1, 1))
+
+        ''' No rule at all '''
+        self.write('ignore.json', json.dumps({'ignore_regex_list': []}))
+        xv.reload_ignore_list()
+        self.assertEqual(xv.get_ignore_stats(), [])
+        self.assertTrue(os.path.join(self.root, 'cfg', 'JAN.cfg') in self.candidate_list(xv))
+
+    def test_name_index(self):
+        xv = self.create_xenview()
+        xv.domu_dict = {'1': 'g1', '2': 'g2', '3': 'g6', '4': 'g3', '5': 'g4'}
+        xv.initialize_vm_cfg_dict()
+        self.assertEqual(xv.vm_cfg_dict, {'1': os.path.join(self.root, 'cfg', 'vm.cfg'), '2': os.path.join(self.root, 'cfg', 'g2.cfg'),
+            '3': os.path.join(self.root, 'listed', 'g6.cfg'), '4': '', '5': ''})
+
+if __name__ == '__main__':
+    unittest.main()
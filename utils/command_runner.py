@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import signal
+import threading
+from subprocess import Popen, PIPE
+
+class CommandResult(object):
+    ''' Outcome of one command; out, err and code are what callers of the old shell DOCMD read '''
+
+    """ Class initializer """
+    def __init__(self, argv, out='', err='', code=None, elapsed=0.0, timed_out=False):
+        self.argv = argv
+        self.out = out
+        self.err = err
+        self.code = code
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+class CommandRunner(object):
+    ''' Runs argv lists without a shell: each command has a deadline after which its process group is killed,
+        at most concurrency of them run at once, and the latency of every call is kept per executable.
+        Called as docmd(argv) by the toolstack backends, the xenstore snapshot and the domain tracker '''
+
+    ''' Constants '''
+    C_DEFAULT_TIMEOUT = 30.0
+    C_DEFAULT_CONCURRENCY = 4
+    ''' Same code a shell reports for a command that cannot be found '''
+    C_CODE_NOT_FOUND = 127
+
+    """ Class initializer """
+    def __init__(self, timeout=C_DEFAULT_TIMEOUT, concurrency=C_DEFAULT_CONCURRENCY, debug=False):
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.debug = debug
+        self.slot = threading.BoundedSemaphore(self.concurrency)
+        self.lock = threading.Lock()
+        ''' Executable -> list of seconds, in call order '''
+        self.latency_dict = {}
+        self.timeout_list = []
+        self.failure_count = 0
+
+    ''' Only to print debugging information '''
+    def _dprint(self, msg):
+        if self.debug:
+            print('DEBUG: %s' % msg)
+
+    def __call__(self, argv, timeout=None):
+        return self.run(argv, timeout)
+
+    ''' Runs one command, waiting for a free slot first; timeout None is the runner default, 0 none '''
+    def run(self, argv, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        self.slot.acquire()
+        try:
+            result = self._run(list(argv), timeout)
+        finally:
+            self.slot.release()
+        self._record(result)
+        return result
+
+    ''' Runs independent commands concurrently, up to the concurrency limit; results keep the order of argv_list '''
+    def run_all(self, argv_list, timeout=None):
+        result_list = [None] * len(argv_list)
+        if len(argv_list) == 1:
+            result_list[0] = self.run(argv_list[0], timeout)
+            return result_list
+
+        def worker(index):
+            result_list[index] = self.run(argv_list[index], timeout)
+
+        threads = []
+        for index in range(len(argv_list)):
+            thread = threading.Thread(target=worker, args=(index,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return result_list
+
+    def _run(self, argv, timeout):
+        start = time.time()
+        try:
+            proc = Popen(argv, stdin=PIPE, stdout=PIPE, stderr=PIPE, universal_newlines=True, **self._get_session_kwargs())
+        except OSError:
+            return CommandResult(argv, '', str(sys.exc_info()[1]), self.C_CODE_NOT_FOUND, time.time() - start)
+
+        ''' communicate() has no timeout before Python 3.3, a timer kills the group so the pipes close '''
+        killed = []
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self._kill, (proc, killed))
+            timer.daemon = True
+            timer.start()
+        try:
+            (out, err) = proc.communicate()
+        finally:
+            if timer is not None:
+                ''' Joined so no timer thread is left waiting when the interpreter exits '''
+                timer.cancel()
+                timer.join()
+        result = CommandResult(argv, out, err, proc.returncode, time.time() - start, len(killed) != 0)
+        if result.timed_out:
+            self._dprint('Command timed out after %.1fs: %s' % (timeout, ' '.join(argv)))
+        return result
+
+    ''' Own process group, so a killed wrapper script does not leave a child holding the pipes open '''
+    def _get_session_kwargs(self):
+        if sys.version_info[0] >= 3:
+            return {'start_new_session': True}
+        return {'preexec_fn': os.setsid}
+
+    def _kill(self, proc, killed):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            ''' Already gone '''
+            return
+        killed.append(True)
+
+    def _record(self, result):
+        self.lock.acquire()
+        try:
+            self.latency_dict.setdefault(os.path.basename(result.argv[0]), []).append(result.elapsed)
+            if result.timed_out:
+                self.timeout_list.append(' '.join(result.argv))
+            if result.code != 0:
+                self.failure_count += 1
+        finally:
+            self.lock.release()
+
+    ''' {'calls', 'failures', 'timeouts', 'total', 'max', 'commands': {executable: {'calls', 'total', 'max'}}} '''
+    def get_stats(self):
+        self.lock.acquire()
+        try:
+            command_dict = {}
+            for (name, latency_list) in self.latency_dict.items():
+                command_dict[name] = {'calls': len(latency_list), 'total': sum(latency_list), 'max': max(latency_list)}
+            stats = {'calls': sum([value['calls'] for value in command_dict.values()]), 'failures': self.failure_count,
+                'timeouts': len(self.timeout_list), 'total': sum([value['total'] for value in command_dict.values()]),
+                'max': 0.0, 'commands': command_dict}
+            if len(command_dict) != 0:
+                stats['max'] = max([value['max'] for value in command_dict.values()])
+            return stats
+        finally:
+            self.lock.release()
+
+    def format_report(self):
+        stats = self.get_stats()
+        lines = []
+        for name in sorted(stats['commands'].keys()):
+            value = stats['commands'][name]
+            lines.append('command %-16s calls: %4d, total: %7.3fs, max: %7.3fs' % (name, value['calls'], value['total'], value['max']))
+        lines.append('commands: %d, failures: %d, timeouts: %d' % (stats['calls'], stats['failures'], stats['timeouts']))
+        return '\n'.join(lines)
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from collections import namedtuple
+
+DiskOwner = namedtuple('DiskOwner', 'disk_path domu_name vm_cfg_path running')
+
+class DiskIndex(object):
+    ''' Constants '''
+    C_RE_DISK_START = re.compile('^\\s*disk\\s*=\\s*\\[', re.M)
+    ''' "file:", "tap:aio:", "phy:" ... in front of the path of an xm style disk spec '''
+    C_RE_DISK_PREFIX = re.compile('^(?:[A-Za-z0-9]+:)*')
+    C_KEY_TARGET = 'target='
+
+    """ Class initializer """
+    def __init__(self):
+        ''' Normalized disk path -> list of DiskOwner, a shared disk has several '''
+        self.owner_dict = {}
+
+    ''' Path of one disk spec: "file:/OVS/x.img,xvda,w", "tap:aio:/x.img,..." or xl style "target=/x.img,..." '''
+    @classmethod
+    def parse_disk_spec(cls, spec):
+        field_list = [field.strip() for field in spec.split(',')]
+        for field in field_list:
+            if field.startswith(cls.C_KEY_TARGET):
+                return field[len(cls.C_KEY_TARGET):]
+        return cls.C_RE_DISK_PREFIX.sub('', field_list[0])
+
+    ''' Disk paths of the "disk = [...]" assignment of a vm.cfg content, empty specs (e.g. cdrom) are skipped.
+        The list may span lines; a "#" comment in it is skipped, brackets and quotes it holds included.
+        A list not closed within text gives none '''
+    @classmethod
+    def parse_disk_list(cls, text):
+        m = cls.C_RE_DISK_START.search(text)
+        if m is None:
+            return []
+        spec_list = []
+        pos = m.end()
+        n = len(text)
+        while pos < n:
+            c = text[pos]
+            if c == ']':
+                break
+            if c == '#':
+                pos = text.find('\n', pos)
+                if pos < 0:
+                    return []
+            elif c in '\'"':
+                end = text.find(c, pos + 1)
+                if end < 0:
+                    return []
+                spec_list.append(text[pos + 1:end])
+                pos = end
+            pos += 1
+        else:
+            return []
+        disk_list = []
+        for spec in spec_list:
+            path = cls.parse_disk_spec(spec)
+            if path:
+                disk_list.append(path)
+        return disk_list
+
+    def _normalize(self, path):
+        return os.path.normpath(self.C_RE_DISK_PREFIX.sub('', path.strip()))
+
+    ''' Same domU seen from xenstore and from its vm.cfg is one owner, running if either says so '''
+    def add(self, disk_path, domu_name, vm_cfg_path, running):
+        disk_path = self._normalize(disk_path)
+        owner_list = self.owner_dict.setdefault(disk_path, [])
+        for (i, owner) in enumerate(owner_list):
+            if owner.domu_name == domu_name:
+                owner_list[i] = DiskOwner(disk_path, domu_name, owner.vm_cfg_path or vm_cfg_path, owner.running or running)
+                return
+        owner_list.append(DiskOwner(disk_path, domu_name, vm_cfg_path, running))
+
+    ''' Owners of one disk, [] if unknown; a symlinked path is retried once resolved '''
+    def lookup(self, disk_path):
+        disk_path = self._normalize(disk_path)
+        owner_list = self.owner_dict.get(disk_path)
+        if owner_list is None:
+            owner_list = self.owner_dict.get(os.path.realpath(disk_path), [])
+        return owner_list
+
+    ''' Owners of each disk of path_list, in the same order '''
+    def lookup_list(self, path_list):
+        return [(path, self.lookup(path)) for path in path_list]
+
+    def __len__(self):
+        return len(self.owner_dict)
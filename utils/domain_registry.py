@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+class DomainRecord(object):
+    ''' One domain: running id and disks from xenstore, vm.cfg path and the pattern that found it.
+        A path holding the name, e.g. /OVS/running_pool/<name>/vm.cfg, is kept as the parts around it,
+        which are shared by every record of the registry '''
+    __slots__ = ('name', 'domu_id', 'disks', 'vm_cfg_head', 'vm_cfg_tail', 'pattern')
+
+    """ Class initializer """
+    def __init__(self, name):
+        self.name = name
+        ''' None when not running '''
+        self.domu_id = None
+        ''' Flat (head, tail, head, tail, ...) tuple, None until known '''
+        self.disks = None
+        ''' None when no vm.cfg was found '''
+        self.vm_cfg_head = None
+        self.vm_cfg_tail = None
+        self.pattern = None
+
+    def _unpack(self, head, tail):
+        if tail is None:
+            return head
+        return '%s%s%s' % (head, self.name, tail)
+
+    def get_vm_cfg_path(self):
+        if self.vm_cfg_head is None:
+            return None
+        return self._unpack(self.vm_cfg_head, self.vm_cfg_tail)
+
+    ''' get_vm_cfg_path() == path, without building the path '''
+    def is_vm_cfg_path(self, path):
+        head = self.vm_cfg_head
+        tail = self.vm_cfg_tail
+        if tail is None:
+            return head == path
+        return len(path) == len(head) + len(self.name) + len(tail) and path.startswith(head) and \
+            path.startswith(self.name, len(head)) and path.endswith(tail)
+
+    ''' First disk, None when there is none (yet) '''
+    def get_first_disk(self):
+        if not self.disks:
+            return None
+        return self._unpack(self.disks[0], self.disks[1])
+
+    def get_disk_list(self):
+        if self.disks is None:
+            return None
+        return [self._unpack(self.disks[i], self.disks[i + 1]) for i in range(0, len(self.disks), 2)]
+
+class DomainRegistry(object):
+    ''' DomainRecord by running domain id and by name, in place of parallel id- and name-keyed dicts.
+        Shared by XenView and the DomainTracker feeding it '''
+
+    ''' Constants '''
+    ''' Characters that may follow the name for a path to be packed around it, e.g. "/<name>_old/vm.cfg" '''
+    C_NAME_END = '/_.'
+
+    """ Class initializer """
+    def __init__(self):
+        self.id_dict = {}
+        self.name_dict = {}
+        ''' Path parts shared by the records, e.g. "/OVS/running_pool/" and "/vm.cfg" '''
+        self.part_dict = {}
+        self.vm_cfg_count = 0
+
+    ''' (head, tail) with head + name + tail == path when the name is a component, or the start of one; else (path, None) '''
+    def _pack(self, name, path):
+        if not name:
+            return (path, None)
+        needle = '/' + name
+        pos = path.rfind(needle)
+        while pos >= 0:
+            end = pos + len(needle)
+            if end == len(path) or path[end] in self.C_NAME_END:
+                head = path[:pos + 1]
+                tail = path[end:]
+                return (self.part_dict.setdefault(head, head), self.part_dict.setdefault(tail, tail))
+            pos = path.rfind(needle, 0, pos)
+        return (path, None)
+
+    ''' setdefault keeps a -j pool thread and the merging thread from creating the same record twice '''
+    def _get_record(self, name):
+        record = self.name_dict.get(name)
+        if record is None:
+            record = self.name_dict.setdefault(name, DomainRecord(name))
+        return record
+
+    ''' Records neither running nor resolved are dropped '''
+    def _release(self, record):
+        if record.domu_id is None and record.vm_cfg_head is None:
+            self.name_dict.pop(record.name, None)
+
+    def get(self, name):
+        return self.name_dict.get(name)
+
+    def get_by_id(self, domu_id):
+        return self.id_dict.get(domu_id)
+
+    def __len__(self):
+        return len(self.name_dict)
+
+    ''' Running domains '''
+    def add_running(self, domu_id, name):
+        record = self.id_dict.get(domu_id)
+        if record is not None and record.name != name:
+            ''' Renamed while running '''
+            self.remove_running(domu_id)
+            record = None
+        if record is None:
+            record = self._get_record(name)
+            self.id_dict[domu_id] = record
+        record.domu_id = domu_id
+        return record
+
+    def remove_running(self, domu_id):
+        record = self.id_dict.pop(domu_id, None)
+        if record is None or record.domu_id != domu_id:
+            return
+        record.domu_id = None
+        record.disks = None
+        self._release(record)
+
+    def clear_running(self):
+        for domu_id in list(self.id_dict.keys()):
+            self.remove_running(domu_id)
+
+    def get_name(self, domu_id):
+        record = self.id_dict.get(domu_id)
+        if record is None:
+            return None
+        return record.name
+
+    def get_running_id_list(self):
+        return list(self.id_dict.keys())
+
+    def get_running_name_list(self):
+        return [record.name for record in self.id_dict.values()]
+
+    def get_running_record_list(self):
+        return list(self.id_dict.values())
+
+    def get_running_count(self):
+        return len(self.id_dict)
+
+    def set_disk_list(self, domu_id, disk_list):
+        record = self.id_dict.get(domu_id)
+        if record is None:
+            return
+        name = record.name
+        disks = ()
+        for disk_path in disk_list:
+            disks += self._pack(name, disk_path)
+        record.disks = disks
+
+    ''' Disks of a running domain, None when not known (yet) '''
+    def get_disk_list(self, domu_id):
+        record = self.id_dict.get(domu_id)
+        if record is None:
+            return None
+        return record.get_disk_list()
+
+    ''' Resolved vm.cfg paths '''
+    def set_vm_cfg(self, name, vm_cfg_path, pattern=None):
+        record = self._get_record(name)
+        if record.vm_cfg_head is None:
+            self.vm_cfg_count += 1
+        (record.vm_cfg_head, record.vm_cfg_tail) = self._pack(name, vm_cfg_path)
+        record.pattern = pattern
+        return record
+
+    def has_vm_cfg(self, name):
+        record = self.name_dict.get(name)
+        return record is not None and record.vm_cfg_head is not None
+
+    def get_vm_cfg_path(self, name):
+        record = self.name_dict.get(name)
+        if record is None:
+            return None
+        return record.get_vm_cfg_path()
+
+    def clear_vm_cfg(self):
+        for record in list(self.name_dict.values()):
+            record.vm_cfg_head = None
+            record.vm_cfg_tail = None
+            record.pattern = None
+            self._release(record)
+        self.vm_cfg_count = 0
+
+    ''' (name, vm cfg path) of every resolved domain '''
+    def iter_vm_cfg(self):
+        for record in list(self.name_dict.values()):
+            if record.vm_cfg_head is not None:
+                yield (record.name, record.get_vm_cfg_path())
+
+    def get_vm_cfg_dict(self):
+        return dict(self.iter_vm_cfg())
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+from array import array
+import toolstack
+
+class DomainHistory(object):
+    ''' Last capacity samples of one domain, in arrays allocated once: a sample overwrites the oldest slot '''
+    __slots__ = ('name', 'domu_id', 'capacity', 'pos', 'count', 'time', 'cpu_time', 'cpu_delta', 'cpu_percent', 'mem', 'vcpus', 'state')
+
+    """ Class initializer """
+    def __init__(self, name, domu_id, capacity):
+        self.name = name
+        self.domu_id = domu_id
+        self.capacity = capacity
+        ''' Slot the next sample goes to, and how many slots hold one '''
+        self.pos = 0
+        self.count = 0
+        self.time = array('d', [0.0]) * capacity
+        self.cpu_time = array('d', [0.0]) * capacity
+        ''' CPU seconds used since the previous sample, 0 for the first one and after a restart '''
+        self.cpu_delta = array('d', [0.0]) * capacity
+        self.cpu_percent = array('d', [0.0]) * capacity
+        self.mem = array('l', [0]) * capacity
+        self.vcpus = array('l', [0]) * capacity
+        ''' State flags as a bit mask, see DomainSampler.C_STATE_FLAGS '''
+        self.state = array('B', [0]) * capacity
+
+    def add(self, now, domu_id, mem, vcpus, state, cpu_time):
+        cpu_delta = 0.0
+        cpu_percent = 0.0
+        if self.count != 0:
+            last = self.pos - 1
+            elapsed = now - self.time[last]
+            ''' A new ID is the domain restarted, its CPU time started again from 0 '''
+            if domu_id == self.domu_id and cpu_time >= self.cpu_time[last] and elapsed > 0:
+                cpu_delta = cpu_time - self.cpu_time[last]
+                cpu_percent = cpu_delta * 100.0 / elapsed
+        self.domu_id = domu_id
+        pos = self.pos
+        self.time[pos] = now
+        self.cpu_time[pos] = cpu_time
+        self.cpu_delta[pos] = cpu_delta
+        self.cpu_percent[pos] = cpu_percent
+        self.mem[pos] = mem
+        self.vcpus[pos] = vcpus
+        self.state[pos] = state
+        ''' pos - 1 is the last slot, also when pos wraps to 0 '''
+        self.pos = (pos + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    ''' Slots holding a sample, oldest first '''
+    def get_slot_list(self):
+        if self.count < self.capacity:
+            return list(range(self.count))
+        return list(range(self.pos, self.capacity)) + list(range(self.pos))
+
+    def get_last_slot(self):
+        return self.pos - 1
+
+class DomainSampler(object):
+    ''' Memory, VCPUs, state and CPU time of every domain from one xl/xm list call per sample,
+        with the CPU used between two samples and a fixed-size history per domain '''
+
+    ''' Constants '''
+    C_DEFAULT_CAPACITY = 300
+    ''' xm/xl state columns, one flag per position: running, blocked, paused, shutdown, crashed, dying '''
+    C_STATE_FLAGS = 'rbpscd'
+    C_SORT_KEY_LIST = ['cpu', 'mem', 'name']
+
+    """ Class initializer """
+    def __init__(self, docmd, toolstack_name=toolstack.C_AUTO, capacity=C_DEFAULT_CAPACITY, debug=False):
+        self.docmd = docmd
+        self.toolstack_name = toolstack_name
+        self.capacity = max(2, capacity)
+        self.debug = debug
+        self.toolstack_backend = None
+        ''' Domain name -> DomainHistory, a domain missing from a sample is dropped '''
+        self.history_dict = {}
+        ''' State column -> bit mask, the few distinct values are converted once '''
+        self.state_mask_dict = {}
+        self.sample_count = 0
+        self.last_time = None
+
+    ''' Only to print debugging information '''
+    def _dprint(self, msg):
+        if self.debug:
+            print('DEBUG: %s' % msg)
+
+    def _get_state_mask(self, state):
+        mask = self.state_mask_dict.get(state)
+        if mask is None:
+            mask = 0
+            for (bit, flag) in enumerate(self.C_STATE_FLAGS):
+                if flag in state:
+                    mask |= 1 << bit
+            self.state_mask_dict[state] = mask
+        return mask
+
+    def format_state(self, mask):
+        return ''.join([(mask >> bit) & 1 and flag or '-' for (bit, flag) in enumerate(self.C_STATE_FLAGS)])
+
+    ''' Takes one sample of every domain; the backend picked by the first call is kept. False on failure '''
+    def sample(self, now=None):
+        if self.toolstack_backend is None:
+            (self.toolstack_backend, stat_list) = toolstack.list_domain_stats(self.docmd, self.toolstack_name)
+            if stat_list is None:
+                self.toolstack_backend = None
+        else:
+            stat_list = self.toolstack_backend.list_domain_stats()
+        if stat_list is None:
+            self._dprint('Unable to get the domain stats')
+            return False
+        self.sample_rows(stat_list, now)
+        return True
+
+    ''' Records rows of list_domain_stats() as one sample taken at now '''
+    def sample_rows(self, stat_list, now=None):
+        if now is None:
+            now = time.time()
+        history_dict = self.history_dict
+        seen_dict = {}
+        for (name, domu_id, mem, vcpus, state, cpu_time) in stat_list:
+            history = history_dict.get(name)
+            if history is None:
+                history = DomainHistory(name, domu_id, self.capacity)
+            history.add(now, domu_id, mem, vcpus, self._get_state_mask(state), cpu_time)
+            seen_dict[name] = history
+        self.history_dict = seen_dict
+        self.sample_count += 1
+        self.last_time = now
+
+    ''' (name, domu_id, state, cpu %, cpu seconds, mem MB, vcpus) of the last sample, sorted by sort_key '''
+    def get_top_list(self, sort_key='cpu', limit=None):
+        row_list = []
+        for history in self.history_dict.values():
+            slot = history.get_last_slot()
+            row_list.append((history.name, history.domu_id, self.format_state(history.state[slot]), history.cpu_percent[slot],
+                history.cpu_time[slot], history.mem[slot], history.vcpus[slot]))
+        if sort_key == 'name':
+            row_list.sort()
+        elif sort_key == 'mem':
+            row_list.sort(key=lambda row: (-row[5], row[0]))
+        else:
+            row_list.sort(key=lambda row: (-row[3], row[0]))
+        if limit:
+            row_list = row_list[:limit]
+        return row_list
+
+    ''' A screen like the one of top: totals, then one line per domain '''
+    def format_top(self, sort_key='cpu', limit=None):
+        row_list = self.get_top_list(sort_key)
+        lines = []
+        when = '-'
+        if self.last_time is not None:
+            when = time.strftime('%H:%M:%S', time.localtime(self.last_time))
+        backend = '-'
+        if self.toolstack_backend is not None:
+            backend = self.toolstack_backend.C_NAME
+        lines.append('xenview - %s, %d domains, sample %d, toolstack: %s' % (when, len(row_list), self.sample_count, backend))
+        lines.append('CPU: %.1f%%, Mem: %d MB, VCPUs: %d' % (sum([row[3] for row in row_list]), sum([row[5] for row in row_list]),
+            sum([row[6] for row in row_list])))
+        lines.append('')
+        lines.append('%-32s %6s %-6s %7s %12s %8s %5s' % ('NAME', 'ID', 'STATE', 'CPU%', 'CPU(s)', 'MEM(MB)', 'VCPUS'))
+        if limit:
+            row_list = row_list[:limit]
+        for row in row_list:
+            lines.append('%-32s %6s %-6s %7.1f %12.1f %8d %5d' % row)
+        return '\n'.join(lines)
+
+    ''' {'capacity', 'samples', 'domains': {name: {'domu_id', columns...}}}, each column oldest first '''
+    def to_dict(self):
+        domain_dict = {}
+        for (name, history) in self.history_dict.items():
+            slot_list = history.get_slot_list()
+            domain_dict[name] = {
+                'domu_id': history.domu_id,
+                'time': [history.time[slot] for slot in slot_list],
+                'cpu_time': [history.cpu_time[slot] for slot in slot_list],
+                'cpu_delta': [history.cpu_delta[slot] for slot in slot_list],
+                'cpu_percent': [history.cpu_percent[slot] for slot in slot_list],
+                'mem': [history.mem[slot] for slot in slot_list],
+                'vcpus': [history.vcpus[slot] for slot in slot_list],
+                'state': [self.format_state(history.state[slot]) for slot in slot_list],
+            }
+        return {'capacity': self.capacity, 'samples': self.sample_count, 'domains': domain_dict}
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+from subprocess import Popen,PIPE
+from xenstore_snapshot import XenStoreSnapshot
+from domain_registry import DomainRegistry
+
+class DomainTracker(object):
+    ''' Constants '''
+    C_DOM0_ID = '0'
+    C_EVENT_INTRODUCE = '@introduceDomain'
+    C_EVENT_RELEASE = '@releaseDomain'
+    C_WATCH_ARGV = ['xenstore-watch', C_EVENT_INTRODUCE, C_EVENT_RELEASE]
+    C_VBD_BACKEND_ROOT = '%s/%s/backend/vbd' % (XenStoreSnapshot.C_DOMAIN_ROOT, C_DOM0_ID)
+
+    """ Class initializer """
+    def __init__(self, docmd, debug=False):
+        self.docmd = docmd
+        self.debug = debug
+
+        ''' Running part of the records, XenView shares the registry (see XenView.set_domain_tracker) '''
+        self.domain_registry = DomainRegistry()
+
+        self.snapshot = None
+        ''' Introduced domains whose vbd backends were not written yet '''
+        self.pending_set = set()
+        self.watch_proc = None
+        self.buffer = ''
+
+    ''' Only to print debugging information '''
+    def _dprint(self, msg):
+        if self.debug:
+            print('DEBUG: %s' % msg)
+
+    ''' Takes the one full snapshot, later changes only come from watch events '''
+    def initialize(self):
+        self.snapshot = XenStoreSnapshot(self.docmd)
+        if not self.snapshot.load():
+            self.snapshot = None
+            return False
+        for domu_id in self.snapshot.get_domu_id_list():
+            self._add_domain(domu_id)
+        return True
+
+    def _add_domain(self, domu_id):
+        if domu_id == self.C_DOM0_ID:
+            return
+        name = self.snapshot.read('%s/%s/name' % (self.snapshot.root, domu_id))
+        if not name:
+            self.pending_set.add(domu_id)
+            return
+        self.domain_registry.add_running(domu_id, name)
+        disks = self.snapshot.get_disk_list(domu_id)
+        if disks is None or len(disks) == 0:
+            self.pending_set.add(domu_id)
+            return
+        self.domain_registry.set_disk_list(domu_id, disks)
+        self.pending_set.discard(domu_id)
+
+    def _remove_domain(self, domu_id):
+        self.domain_registry.remove_running(domu_id)
+        self.pending_set.discard(domu_id)
+        self.snapshot.drop_path('%s/%s' % (self.snapshot.root, domu_id))
+        self.snapshot.drop_path('%s/%s' % (self.C_VBD_BACKEND_ROOT, domu_id))
+
+    ''' The frontend and vbd backend subtrees of every domain are independent, they are read in one batch '''
+    def _load_domain_list(self, domu_id_list):
+        path_list = []
+        for domu_id in domu_id_list:
+            path_list.append('%s/%s' % (self.snapshot.root, domu_id))
+            path_list.append('%s/%s' % (self.C_VBD_BACKEND_ROOT, domu_id))
+        self.snapshot.load_path_list(path_list)
+        for domu_id in domu_id_list:
+            self._add_domain(domu_id)
+
+    ''' Diff the domain list against the known one and apply only the difference, True if anything changed '''
+    def sync(self):
+        if self.snapshot is None:
+            return False
+        cmd = self.docmd(['xenstore-list', self.snapshot.root])
+        if cmd.code != 0:
+            return False
+        current_set = set(cmd.out.split())
+        known_set = set(self.snapshot.get_domu_id_list())
+
+        changed = False
+        for domu_id in known_set - current_set:
+            self._dprint('Domain released: %s (%s)' % (domu_id, self.domain_registry.get_name(domu_id) or ''))
+            self._remove_domain(domu_id)
+            changed = True
+        load_list = sorted((current_set - known_set) | (self.pending_set & current_set))
+        if len(load_list) != 0:
+            self._load_domain_list(load_list)
+            changed = True
+        for domu_id in load_list:
+            self._dprint('Domain introduced: %s (%s)' % (domu_id, self.domain_registry.get_name(domu_id) or ''))
+        return changed
+
+    def handle_event(self, line):
+        token = line.split()
+        if len(token) == 0:
+            return False
+        if token[0] not in (self.C_EVENT_INTRODUCE, self.C_EVENT_RELEASE):
+            return False
+        return self.sync()
+
+    ''' Feed raw watch output, partial lines are kept until completed '''
+    def feed(self, data):
+        if not isinstance(data, str):
+            data = data.decode('utf-8', 'replace')
+        self.buffer += data
+        changed = False
+        while '\n' in self.buffer:
+            (line, self.buffer) = self.buffer.split('\n', 1)
+            if self.handle_event(line):
+                changed = True
+        return changed
+
+    ''' Blocking consumption of a watch stream (xenstore-watch stdout, or any file-like object) '''
+    def consume(self, stream, callback=None):
+        while True:
+            line = stream.readline()
+            if not line:
+                break
+            if self.feed(line) and callback is not None:
+                callback(self)
+
+    ''' Starts xenstore-watch, its stdout fd can be polled and passed to read_watch() '''
+    def start_watch(self):
+        devnull = open(os.devnull, 'w')
+        try:
+            self.watch_proc = Popen(self.C_WATCH_ARGV, stdin=PIPE, stdout=PIPE, stderr=devnull)
+        finally:
+            devnull.close()
+        return self.watch_proc.stdout.fileno()
+
+    ''' True if the running set changed, the watch is stopped when xenstore-watch exits '''
+    def read_watch(self):
+        data = os.read(self.watch_proc.stdout.fileno(), 4096)
+        if not data:
+            self.stop_watch()
+            return False
+        return self.feed(data)
+
+    def stop_watch(self):
+        if self.watch_proc is None:
+            return
+        if self.watch_proc.poll() is None:
+            self.watch_proc.terminate()
+        self.watch_proc.wait()
+        self.watch_proc = None
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import state_file
+
+class MountBackoff(object):
+    ''' Mount points whose walk went past its deadline, e.g. a stale NFS or OCFS2 mount.
+        Later runs skip them until the backoff expires, the delay doubling with each new timeout '''
+
+    ''' Constants '''
+    C_VERSION = 1
+    C_BASE_DELAY = 300
+    C_MAX_DELAY = 3600
+
+    """ Class initializer """
+    def __init__(self, backoff_path):
+        self.backoff_path = backoff_path
+        ''' mount point -> [skipped until, consecutive timeouts] '''
+        self.entry_dict = {}
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        entry_dict = state_file.load_json_entries(self.backoff_path, self.C_VERSION)
+        if entry_dict is not None:
+            self.entry_dict = entry_dict
+
+    ''' Time until which mount_point is skipped, None when it may be walked '''
+    def get_until(self, mount_point, now=None):
+        if now is None:
+            now = time.time()
+        entry = self.entry_dict.get(mount_point)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[0]
+
+    def record_timeout(self, mount_point, now=None):
+        if now is None:
+            now = time.time()
+        failures = self.entry_dict.get(mount_point, [0, 0])[1] + 1
+        delay = min(self.C_BASE_DELAY * (2 ** (failures - 1)), self.C_MAX_DELAY)
+        self.entry_dict[mount_point] = [now + delay, failures]
+        self.dirty = True
+        return delay
+
+    def record_success(self, mount_point):
+        if self.entry_dict.pop(mount_point, None) is not None:
+            self.dirty = True
+
+    ''' Write atomically, only when something changed '''
+    def save(self):
+        if not self.dirty:
+            return True
+        if not state_file.save_json_entries(self.backoff_path, self.C_VERSION, self.entry_dict):
+            return False
+        self.dirty = False
+        return True
+
+''' Mount points of this host, read from the kernel table which never blocks on a hung mount '''
+def read_mount_point_list(mounts_path='/proc/mounts'):
+    mount_point_list = []
+    try:
+        fo = open(mounts_path)
+        try:
+            for line in fo:
+                field_list = line.split()
+                if len(field_list) < 2:
+                    continue
+                ''' Blanks and backslashes are octal escapes, e.g. "\\040" '''
+                mount_point = field_list[1].replace('\\040', ' ').replace('\\011', '\t').replace('\\134', '\\')
+                if mount_point != '/':
+                    mount_point_list.append(mount_point)
+        finally:
+            fo.close()
+    except (IOError, OSError):
+        return []
+    return mount_point_list
+
+''' Innermost mount point holding path, None when it is on the root filesystem '''
+def find_mount_point(path, mount_point_list):
+    found = None
+    for mount_point in mount_point_list:
+        if path == mount_point or path.startswith('%s/' % mount_point):
+            if found is None or len(mount_point) > len(found):
+                found = mount_point
+    return found
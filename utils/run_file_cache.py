@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+
+class RunFileCache(object):
+    ''' Filesystem lookups memoized for one run and shared by every pattern handler,
+        so a file reached through several patterns is resolved and read once '''
+    C_KIND_LIST = ['realpath', 'stat', 'name', 'content']
+
+    """ Class initializer """
+    def __init__(self):
+        ''' kind -> {key: value}; with -j two threads may both compute a missing key, with the same result '''
+        self.value_dict = dict([(kind, {}) for kind in self.C_KIND_LIST])
+        self.hit_dict = dict([(kind, 0) for kind in self.C_KIND_LIST])
+        self.miss_dict = dict([(kind, 0) for kind in self.C_KIND_LIST])
+
+    def lookup(self, kind, key, compute):
+        cache_dict = self.value_dict[kind]
+        try:
+            value = cache_dict[key]
+        except KeyError:
+            self.miss_dict[kind] += 1
+            value = compute(key)
+            cache_dict[key] = value
+            return value
+        self.hit_dict[kind] += 1
+        return value
+
+    ''' os.stat, None when the path does not exist '''
+    def stat(self, path):
+        return self.lookup('stat', path, self._stat)
+
+    def _stat(self, path):
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
+
+    def get_stats(self):
+        stats = {}
+        for kind in self.C_KIND_LIST:
+            total = self.hit_dict[kind] + self.miss_dict[kind]
+            ratio = 0.0
+            if total != 0:
+                ratio = float(self.hit_dict[kind]) / total
+            stats[kind] = {'hits': self.hit_dict[kind], 'misses': self.miss_dict[kind], 'ratio': ratio}
+        return stats
+
+    def format_report(self):
+        stats = self.get_stats()
+        lines = []
+        for kind in self.C_KIND_LIST:
+            lines.append('file cache %-8s hits: %6d, misses: %6d, hit ratio: %5.1f%%' % (kind, stats[kind]['hits'],
+                stats[kind]['misses'], stats[kind]['ratio'] * 100))
+        return '\n'.join(lines)
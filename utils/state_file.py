@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+''' Files kept from one run to the next (name cache, plan cache, mount backoff, diff snapshot). Root runs them from cron,
+    so a file is only trusted when owned by the effective user and not writable by others, and is written through
+    a new file of its own (O_EXCL) renamed over the old one: nothing another local user planted is read or followed '''
+
+import os
+import stat
+try:
+    import json
+except ImportError:
+    import simplejson as json # pylint: disable=import-error
+
+''' Private to the user running the tool, created 0700 on the first save '''
+C_STATE_DIR = '/var/lib/vm_cfg_path'
+C_DIR_MODE = 0o700
+
+''' True when st is owned by the effective user and neither group nor world can write it '''
+def is_trusted(st):
+    return st.st_uid == os.geteuid() and (st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)) == 0
+
+''' Opens a trusted regular file for reading, a symlink is not followed; None when missing or not trusted '''
+def open_trusted(path, binary=False):
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        return None
+    try:
+        st = os.fstat(fd)
+    except OSError:
+        os.close(fd)
+        return None
+    if not stat.S_ISREG(st.st_mode) or not is_trusted(st):
+        os.close(fd)
+        return None
+    mode = 'r'
+    if binary:
+        mode = 'rb'
+    return os.fdopen(fd, mode)
+
+''' load(fo) of a trusted file, None when it is missing, not trusted or not readable by load '''
+def read_state(path, load, binary=False):
+    fo = open_trusted(path, binary)
+    if fo is None:
+        return None
+    try:
+        try:
+            return load(fo)
+        finally:
+            fo.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+
+''' Writes path through dump(fo) atomically: a concurrent run reads either the old or the new content.
+    A missing directory is created private to the effective user. False on failure '''
+def write_state(path, dump, binary=False):
+    ''' tempfile imports shutil and random, only runs that write pay for them '''
+    import tempfile
+    dir_path = os.path.dirname(os.path.abspath(path))
+    try:
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path, C_DIR_MODE)
+        (fd, tmp_path) = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path), dir=dir_path)
+    except (IOError, OSError):
+        return False
+    mode = 'w'
+    if binary:
+        mode = 'wb'
+    try:
+        fo = os.fdopen(fd, mode)
+        try:
+            dump(fo)
+        finally:
+            fo.close()
+        os.rename(tmp_path, path)
+    except (IOError, OSError, ValueError, TypeError):
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+''' The entries of a trusted {'version', 'entries'} json file, None when missing, not trusted or of another version '''
+def load_json_entries(path, version):
+    data = read_state(path, json.load)
+    if not isinstance(data, dict) or data.get('version') != version or not isinstance(data.get('entries'), dict):
+        return None
+    return data['entries']
+
+def save_json_entries(path, version, entries):
+    return write_state(path, lambda fo: json.dump({'version': version, 'entries': entries}, fo))
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json # pylint: disable=import-error
+from xenstore_snapshot import XenStoreSnapshot
+
+class ToolstackBackend(object):
+    ''' Lists the domains of this dom0, every command is timed '''
+    C_NAME = ''
+    C_EXECUTABLE = ''
+    C_DOM0_NAME = 'Domain-0'
+    C_HEADER_NAME = 'Name'
+
+    """ Class initializer """
+    def __init__(self, docmd):
+        self.docmd = docmd
+        self.latency_list = []
+
+    ''' command is an argv list, run without a shell '''
+    def _run(self, command):
+        start = time.time()
+        cmd = self.docmd(command)
+        self.latency_list.append(time.time() - start)
+        return cmd
+
+    def is_available(self):
+        for path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+            if os.access(os.path.join(path, self.C_EXECUTABLE), os.X_OK):
+                return True
+        return False
+
+    ''' Returns a domu_id -> name dict without Domain-0, or None on failure '''
+    def list_domains(self, running=True):
+        raise NotImplementedError
+
+    ''' Returns (name, domu_id, mem MB, vcpus, state, cpu seconds) of every live domain but Domain-0, in one call,
+        or None on failure or when the backend has no such columns '''
+    def list_domain_stats(self):
+        return None
+
+    ''' Rows of the "Name ID Mem VCPUs State Time(s)" table of xm list and xl list. Columns are taken from the right,
+        so a name with blanks stays whole; domains without an ID are not running and are skipped '''
+    def _parse_domain_stats(self, out):
+        stat_list = []
+        for line in out.splitlines():
+            field_list = line.rsplit(None, 5)
+            if len(field_list) != 6 or field_list[0] == self.C_HEADER_NAME or field_list[0] == self.C_DOM0_NAME:
+                continue
+            (name, domu_id, mem, vcpus, state, cpu_time) = field_list
+            if not domu_id.isdigit():
+                continue
+            try:
+                stat_list.append((name, domu_id, int(mem), int(vcpus), state, float(cpu_time)))
+            except ValueError:
+                continue
+        return stat_list
+
+    def get_stats(self):
+        total = sum(self.latency_list)
+        stats = {'backend': self.C_NAME, 'calls': len(self.latency_list), 'total': total, 'max': 0.0, 'last': 0.0}
+        if len(self.latency_list) != 0:
+            stats['max'] = max(self.latency_list)
+            stats['last'] = self.latency_list[-1]
+        return stats
+
+class XmBackend(ToolstackBackend):
+    ''' Goes through xend, the slowest but available on every OVM 2.x/3.x dom0 '''
+    C_NAME = 'xm'
+    C_EXECUTABLE = 'xm'
+
+    def list_domains(self, running=True):
+        if running:
+            cmd = self._run(['xm', 'list', '--state=running'])
+        else:
+            cmd = self._run(['xm', 'list'])
+        if cmd.code != 0:
+            return None
+
+        domu_dict = {}
+        for domu in cmd.out.splitlines():
+            ''' Only the header is dropped, "grep -v Name" also lost domUs with Name in theirs '''
+            if len(domu.split()) < 2 or domu.split()[0] == self.C_HEADER_NAME:
+                continue
+            if self.C_DOM0_NAME in domu:
+                continue
+            if domu.split()[1]:
+                domu_dict[domu.split()[1]] = domu.split()[0]
+        return domu_dict
+
+    def list_domain_stats(self):
+        cmd = self._run(['xm', 'list'])
+        if cmd.code != 0:
+            return None
+        return self._parse_domain_stats(cmd.out)
+
+class XlBackend(ToolstackBackend):
+    ''' JSON from libxl, no xend round-trip; lists every live domain regardless of running '''
+    C_NAME = 'xl'
+    C_EXECUTABLE = 'xl'
+
+    def list_domains(self, running=True):
+        cmd = self._run(['xl', 'list', '-l'])
+        if cmd.code != 0:
+            return None
+        try:
+            domain_list = json.loads(cmd.out)
+        except ValueError:
+            return None
+
+        domu_dict = {}
+        for domain in domain_list:
+            try:
+                domu_id = str(domain['domid'])
+                name = domain['config']['c_info']['name']
+            except (KeyError, TypeError):
+                continue
+            if domu_id == '0' or name == self.C_DOM0_NAME:
+                continue
+            domu_dict[domu_id] = name
+        return domu_dict
+
+    ''' The plain table, the JSON of -l has no CPU time '''
+    def list_domain_stats(self):
+        cmd = self._run(['xl', 'list'])
+        if cmd.code != 0:
+            return None
+        return self._parse_domain_stats(cmd.out)
+
+class XenStoreBackend(ToolstackBackend):
+    ''' Reads /local/domain directly, the dump is kept so disk lookups can reuse it '''
+    C_NAME = 'xenstore'
+    C_EXECUTABLE = 'xenstore-ls'
+
+    """ Class initializer """
+    def __init__(self, docmd):
+        ToolstackBackend.__init__(self, docmd)
+        self.snapshot = None
+
+    def list_domains(self, running=True):
+        snapshot = XenStoreSnapshot(lambda command: self._run(command))
+        if not snapshot.load():
+            return None
+        self.snapshot = snapshot
+
+        domu_dict = {}
+        for domu_id in snapshot.get_domu_id_list():
+            name = snapshot.read('%s/%s/name' % (snapshot.root, domu_id))
+            if domu_id == '0' or not name or name == self.C_DOM0_NAME:
+                continue
+            domu_dict[domu_id] = name
+        return domu_dict
+
+''' Backends by name, and the auto-selection order from the cheapest to the most expensive '''
+C_BACKEND_DICT = {
+    XenStoreBackend.C_NAME: XenStoreBackend,
+    XlBackend.C_NAME: XlBackend,
+    XmBackend.C_NAME: XmBackend,
+}
+C_AUTO_ORDER = [XenStoreBackend.C_NAME, XlBackend.C_NAME, XmBackend.C_NAME]
+C_AUTO = 'auto'
+''' Backends with memory, VCPU, state and CPU time columns, xenstore has none of them '''
+C_STATS_ORDER = [XlBackend.C_NAME, XmBackend.C_NAME]
+
+''' Returns (backend, domu_id -> name dict); with auto the first available backend that works wins '''
+def list_domains(docmd, name=C_AUTO, running=True):
+    if name == C_AUTO:
+        name_list = C_AUTO_ORDER
+    else:
+        name_list = [name]
+
+    backend = None
+    for backend_name in name_list:
+        backend = C_BACKEND_DICT[backend_name](docmd)
+        if name == C_AUTO and not backend.is_available():
+            continue
+        domu_dict = backend.list_domains(running)
+        if domu_dict is not None:
+            return (backend, domu_dict)
+    return (backend, None)
+
+''' Returns (backend, list_domain_stats() rows) like list_domains, auto trying the backends of C_STATS_ORDER '''
+def list_domain_stats(docmd, name=C_AUTO):
+    if name == C_AUTO:
+        name_list = C_STATS_ORDER
+    else:
+        name_list = [name]
+
+    backend = None
+    for backend_name in name_list:
+        backend = C_BACKEND_DICT[backend_name](docmd)
+        if name == C_AUTO and not backend.is_available():
+            continue
+        stat_list = backend.list_domain_stats()
+        if stat_list is not None:
+            return (backend, stat_list)
+    return (backend, None)
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import state_file
+
+class VmCfgCache(object):
+    ''' Constants '''
+    C_VERSION = 2
+    C_MAX_ENTRIES = 20000
+    ''' Last use is refreshed at most once a day, so a warm run only rewrites the file when something changed '''
+    C_USED_RESOLUTION = 86400
+
+    """ Class initializer """
+    def __init__(self, cache_path, max_entries=C_MAX_ENTRIES, rebuild=False):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+
+        ''' vm cfg path -> {'key': [dev, ino, mtime, size], 'name': domain name, 'used': last use} '''
+        self.entry_dict = {}
+        self.now = time.time()
+        self.dirty = False
+        ''' Only loaded with the cache itself, import vm_cfg_path alone does not pay for threading '''
+        import threading
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if rebuild:
+            self.dirty = True
+        else:
+            self._load()
+
+    ''' Only a file of our own that nobody else can write is trusted, see state_file '''
+    def _load(self):
+        entry_dict = state_file.load_json_entries(self.cache_path, self.C_VERSION)
+        if entry_dict is not None:
+            self.entry_dict = entry_dict
+
+    ''' Write the cache back atomically, evicting least recently used entries beyond max_entries '''
+    def save(self):
+        if not self.dirty:
+            return True
+        if len(self.entry_dict) > self.max_entries:
+            paths = sorted(self.entry_dict.keys(), key=lambda path: self.entry_dict[path]['used'])
+            for path in paths[:len(paths) - self.max_entries]:
+                del self.entry_dict[path]
+
+        if not state_file.save_json_entries(self.cache_path, self.C_VERSION, self.entry_dict):
+            return False
+        self.dirty = False
+        return True
+
+    ''' Return the cached domain name of a file, calling extract(filename) on a miss. key is the [dev, ino, mtime, size]
+        the caller already has from its per-run stat (XenView._get_stat_key), None when the file is not a regular file '''
+    def get_domain_name(self, filename, key, extract):
+        if key is None:
+            ''' File has disappeared, drop its entry right away '''
+            self.lock.acquire()
+            try:
+                if self.entry_dict.pop(filename, None) is not None:
+                    self.dirty = True
+            finally:
+                self.lock.release()
+            return ''
+
+        self.lock.acquire()
+        try:
+            entry = self.entry_dict.get(filename)
+            if entry is not None and entry['key'] == key:
+                self.hits += 1
+                if self.now - entry['used'] >= self.C_USED_RESOLUTION:
+                    entry['used'] = self.now
+                    self.dirty = True
+                return entry['name']
+            self.misses += 1
+        finally:
+            self.lock.release()
+
+        domain_name = extract(filename)
+        self.lock.acquire()
+        try:
+            self.entry_dict[filename] = {'key': key, 'name': domain_name, 'used': self.now}
+            self.dirty = True
+        finally:
+            self.lock.release()
+        return domain_name
@@ -0,0 +1,474 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import errno
+import select
+import signal
+import socket
+import struct
+import optparse
+import traceback
+import ctypes
+import ctypes.util
+from vm_cfg_path import XenView
+from domain_tracker import DomainTracker
+from command_runner import CommandRunner
+
+class Inotify(object):
+    ''' Constants '''
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    C_WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    C_EVENT_HEADER = struct.Struct('iIII')
+    C_READ_SIZE = 65536
+
+    """ Class initializer """
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.wd_dict = {}
+        self.path_dict = {}
+
+    def _encode(self, path):
+        if isinstance(path, bytes):
+            return path
+        return path.encode(sys.getfilesystemencoding() or 'utf-8')
+
+    def _decode(self, name):
+        if isinstance(name, str):
+            return name
+        return name.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+
+    def add_watch(self, path):
+        if path in self.path_dict:
+            return self.path_dict[path]
+        wd = self.libc.inotify_add_watch(self.fd, self._encode(path), self.C_WATCH_MASK)
+        if wd < 0:
+            return -1
+        self.wd_dict[wd] = path
+        self.path_dict[path] = wd
+        return wd
+
+    def rm_watch(self, path):
+        wd = self.path_dict.pop(path, None)
+        if wd is None:
+            return
+        del self.wd_dict[wd]
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    ''' Returns a list of (watched dir, entry name, mask), watched dir is None on queue overflow '''
+    def read_events(self):
+        data = os.read(self.fd, self.C_READ_SIZE)
+        events = []
+        pos = 0
+        while pos + self.C_EVENT_HEADER.size <= len(data):
+            (wd, mask, cookie, length) = self.C_EVENT_HEADER.unpack_from(data, pos)
+            pos += self.C_EVENT_HEADER.size
+            name = self._decode(data[pos:pos+length].rstrip(b'\0'))
+            pos += length
+            path = self.wd_dict.get(wd)
+            if mask & self.IN_IGNORED:
+                ''' Watch removed by the kernel, the directory is gone '''
+                if path is not None:
+                    del self.wd_dict[wd]
+                    del self.path_dict[path]
+            events.append((path, name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class VmCfgDaemon(object):
+    ''' Constants '''
+    C_SOCKET_PATH = '/var/run/vm_cfg_path.sock'
+    C_RESCAN_INTERVAL = 600
+    C_XENSTORE_INTERVAL = 60
+    C_CLIENT_TIMEOUT = 1.0
+
+    """ Class initializer """
+    def __init__(self, socket_path=C_SOCKET_PATH, debug=False, rescan_interval=C_RESCAN_INTERVAL, xenstore_interval=C_XENSTORE_INTERVAL, conf_path=XenView.C_CONF_PATH):
+        self.socket_path = socket_path
+        self.debug = debug
+        self.rescan_interval = rescan_interval
+        self.xenstore_interval = xenstore_interval
+        self.conf_path = conf_path
+
+        self.xv = None
+        ''' Enabled plans in config order, and per plan: [(file name, (domain name, vm cfg path) or None)] '''
+        self.plan_list = []
+        self.plan_result_lists = []
+        ''' Per plan: directories whose changes can affect its result '''
+        self.plan_dir_sets = []
+        ''' Watched dir -> set of plan indexes; resolved symlink target -> set of (plan index, file name) '''
+        self.dir_plan_dict = {}
+        self.real_path_dict = {}
+
+        self.server = None
+        self.inotify = None
+        self.tracker = None
+        self.next_rescan = 0
+        self.next_xenstore = 0
+
+    ''' Only to print debugging information '''
+    def _dprint(self, msg):
+        if self.debug:
+            print('DEBUG: %s' % msg)
+            sys.stdout.flush()
+
+    ''' A failed step is reported and skipped, the loop goes on serving the index it has '''
+    def _log_error(self, what):
+        sys.stderr.write('ERROR: %s failed: %s\n' % (what, sys.exc_info()[1]))
+        if self.debug:
+            traceback.print_exc()
+        sys.stderr.flush()
+
+    ''' On failure the previous plans and their results are put back and merged again, then the error is raised;
+        the next attempt is the next rescan, not the next loop iteration '''
+    def _build(self):
+        now = time.time()
+        self.next_rescan = now + self.rescan_interval
+        self.next_xenstore = now + self.xenstore_interval
+        previous = (self.xv, self.plan_list, self.plan_result_lists, self.plan_dir_sets)
+        try:
+            self.xv = XenView(self.debug, conf_path=self.conf_path)
+            self.xv.set_domain_tracker(self.tracker)
+            self.plan_list = [plan for plan in self.xv.vm_cfg_plan_list if plan.enable]
+            self.plan_result_lists = [None] * len(self.plan_list)
+            self.plan_dir_sets = [None] * len(self.plan_list)
+            for index in range(len(self.plan_list)):
+                self._evaluate_plan(index)
+            self._merge()
+            self._refresh_watches()
+        except Exception:
+            error = sys.exc_info()
+            (self.xv, self.plan_list, self.plan_result_lists, self.plan_dir_sets) = previous
+            if self.xv is not None:
+                self._merge()
+            raise error[1]
+        self._dprint('Built %d entries from %d patterns, watching %d directories' % (self.xv.domain_registry.vm_cfg_count, len(self.plan_list), len(self.dir_plan_dict)))
+
+    def _evaluate_plan(self, index):
+        plan = self.plan_list[index]
+        result_list = []
+        dir_set = set()
+        if plan.type == 'vmcfg':
+            (file_list, dir_list) = plan.walk()
+            dir_set.update(dir_list)
+            for file_name in file_list:
+                dir_set.add(os.path.dirname(file_name))
+                dir_set.add(os.path.dirname(os.path.realpath(file_name)))
+                result_list.append((file_name, self.xv._apply_vm_cfg_pattern_to_file(plan, file_name)))
+        else:
+            if plan.type == 'list':
+                dir_set.add(os.path.dirname(plan.glob_path))
+            for (domain_name, vmcfg_path) in self.xv._apply_vm_cfg_pattern_by_type(plan):
+                dir_set.add(os.path.dirname(vmcfg_path))
+                result_list.append((vmcfg_path, (domain_name, vmcfg_path)))
+        self.plan_result_lists[index] = result_list
+        self.plan_dir_sets[index] = dir_set
+
+    ''' Re-evaluate one file of a vmcfg plan, keeping its position in the plan result '''
+    def _update_plan_file(self, index, file_name):
+        plan = self.plan_list[index]
+        result_list = self.plan_result_lists[index]
+        pos = None
+        for i in range(len(result_list)):
+            if result_list[i][0] == file_name:
+                pos = i
+                break
+
+        if not os.path.lexists(file_name):
+            if pos is not None:
+                del result_list[pos]
+            return
+        result = (file_name, self.xv._apply_vm_cfg_pattern_to_file(plan, file_name))
+        if pos is None:
+            result_list.append(result)
+        else:
+            result_list[pos] = result
+        self.plan_dir_sets[index].add(os.path.dirname(os.path.realpath(file_name)))
+
+    def _merge(self):
+        result_lists = []
+        for result_list in self.plan_result_lists:
+            result_lists.append([result for (file_name, result) in result_list if result is not None])
+        self.xv._merge_vm_cfg_result_lists(result_lists)
+
+    def _refresh_watches(self):
+        dir_plan_dict = {}
+        real_path_dict = {}
+        for index in range(len(self.plan_list)):
+            for dir_path in self.plan_dir_sets[index]:
+                dir_plan_dict.setdefault(dir_path, set()).add(index)
+            if self.plan_list[index].type != 'vmcfg':
+                continue
+            for (file_name, result) in self.plan_result_lists[index]:
+                real_path = os.path.realpath(file_name)
+                if real_path != file_name:
+                    real_path_dict.setdefault(real_path, set()).add((index, file_name))
+        dir_plan_dict.setdefault(os.path.dirname(os.path.realpath(self.conf_path)), set())
+        self.dir_plan_dict = dir_plan_dict
+        self.real_path_dict = real_path_dict
+
+        if self.inotify is None:
+            return
+        for dir_path in list(self.inotify.path_dict.keys()):
+            if dir_path not in dir_plan_dict:
+                self.inotify.rm_watch(dir_path)
+        for dir_path in dir_plan_dict.keys():
+            if os.path.isdir(dir_path):
+                self.inotify.add_watch(dir_path)
+
+    def _handle_events(self, events):
+        conf_path = os.path.realpath(self.conf_path)
+        rerun_set = set()
+        file_update_list = []
+        for (dir_path, name, mask) in events:
+            if mask & Inotify.IN_Q_OVERFLOW:
+                self._dprint('Event queue overflow, rebuilding')
+                self._build()
+                return
+            if dir_path is None:
+                continue
+            path = dir_path
+            if name:
+                path = os.path.join(dir_path, name)
+            if path == conf_path:
+                self._dprint('Config changed, reloading: %s' % conf_path)
+                self._build()
+                return
+
+            for index in self.dir_plan_dict.get(dir_path, ()):
+                plan = self.plan_list[index]
+                if plan.type != 'vmcfg':
+                    tracked = [file_name for (file_name, result) in self.plan_result_lists[index]]
+                    if path == plan.glob_path or path in tracked:
+                        rerun_set.add(index)
+                elif name and not (mask & Inotify.IN_ISDIR) and plan.match_path(path):
+                    file_update_list.append((index, path))
+                elif path.count('/') < plan.glob_path.count('/'):
+                    ''' Intermediate directory changed, new or removed subtrees need a walk '''
+                    rerun_set.add(index)
+            for (index, file_name) in self.real_path_dict.get(path, ()):
+                file_update_list.append((index, file_name))
+
+        if len(rerun_set) == 0 and len(file_update_list) == 0:
+            return
+        for index in rerun_set:
+            self._evaluate_plan(index)
+        for (index, file_name) in file_update_list:
+            if index not in rerun_set:
+                self._update_plan_file(index, file_name)
+        self._merge()
+        self._refresh_watches()
+        self._dprint('Updated %d files, re-ran %d patterns' % (len(file_update_list), len(rerun_set)))
+
+    ''' Running domains are not visible to inotify, xenstore patterns follow the tracker or a timer '''
+    def _refresh_xenstore(self):
+        if self.tracker is None:
+            self.xv._reset_running_domu_list()
+        refreshed = False
+        for index in range(len(self.plan_list)):
+            if self.plan_list[index].type == 'xenstore':
+                self._evaluate_plan(index)
+                refreshed = True
+        if refreshed:
+            self._merge()
+            self._refresh_watches()
+
+    ''' Running domains come from one snapshot plus @introduceDomain/@releaseDomain watch events '''
+    def _start_tracker(self):
+        tracker = DomainTracker(CommandRunner(debug=self.debug), self.debug)
+        if not tracker.initialize():
+            return
+        try:
+            tracker.start_watch()
+        except OSError:
+            self._dprint('xenstore-watch is not available, refreshing xenstore patterns every %d seconds' % self.xenstore_interval)
+            return
+        self.tracker = tracker
+
+    ''' One request per connection; a request that fails gets an ERROR line, other clients are not affected '''
+    def _handle_client(self, conn):
+        conn.settimeout(self.C_CLIENT_TIMEOUT)
+        try:
+            data = b''
+            while b'\n' not in data:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            request = data.decode('utf-8', 'replace').strip().split(None, 1)
+            registry = self.xv.domain_registry
+            if len(request) == 0:
+                response = ''
+            elif request[0] == 'GET' and len(request) == 2:
+                response = ''
+                vmcfg_path = registry.get_vm_cfg_path(request[1])
+                if vmcfg_path is not None:
+                    response = '%s|%s\n' % (request[1], vmcfg_path)
+            elif request[0] == 'ALL':
+                response = ''.join(['%s|%s\n' % item for item in sorted(registry.iter_vm_cfg())])
+            elif request[0] == 'RELOAD':
+                self._build()
+                response = 'OK\n'
+            elif request[0] == 'PING':
+                response = 'OK\n'
+            else:
+                response = 'ERROR: Unknown request: %s\n' % request[0]
+            conn.sendall(response.encode('utf-8'))
+        except (socket.error, socket.timeout):
+            pass
+        except Exception:
+            self._log_error('Request')
+            try:
+                conn.sendall(('ERROR: %s\n' % sys.exc_info()[1]).encode('utf-8'))
+            except (socket.error, socket.timeout):
+                pass
+        conn.close()
+
+    def _open_socket(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self.server.listen(64)
+
+    def serve_forever(self):
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError):
+            self.inotify = None
+            self._dprint('inotify is not available, rescanning every %d seconds' % self.rescan_interval)
+        self._start_tracker()
+        self._build()
+        self._open_socket()
+        try:
+            while True:
+                now = time.time()
+                timeout = max(0, min(self.next_rescan, self.next_xenstore) - now)
+                rlist = [self.server]
+                if self.inotify is not None:
+                    rlist.append(self.inotify.fd)
+                if self.tracker is not None:
+                    rlist.append(self.tracker.watch_proc.stdout.fileno())
+                try:
+                    (ready, wlist, xlist) = select.select(rlist, [], [], timeout)
+                except (select.error, OSError):
+                    if sys.exc_info()[1].args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                if self.inotify is not None and self.inotify.fd in ready:
+                    try:
+                        self._handle_events(self.inotify.read_events())
+                    except Exception:
+                        ''' Some plan results may be updated and others not, a full rebuild sorts them out '''
+                        self._log_error('Event handling')
+                        self.next_rescan = 0
+                if self.tracker is not None and self.tracker.watch_proc.stdout.fileno() in ready:
+                    try:
+                        if self.tracker.read_watch():
+                            self._refresh_xenstore()
+                    except Exception:
+                        self._log_error('xenstore refresh')
+                    if self.tracker.watch_proc is None:
+                        self._dprint('xenstore-watch exited, refreshing xenstore patterns every %d seconds' % self.xenstore_interval)
+                        self.tracker = None
+                        self.xv.set_domain_tracker(None)
+                if self.server in ready:
+                    try:
+                        (conn, addr) = self.server.accept()
+                    except socket.error:
+                        self._log_error('Accept')
+                    else:
+                        self._handle_client(conn)
+
+                now = time.time()
+                if now >= self.next_rescan:
+                    try:
+                        self._build()
+                    except Exception:
+                        self._log_error('Rescan')
+                elif now >= self.next_xenstore:
+                    self.next_xenstore = now + self.xenstore_interval
+                    if self.tracker is None:
+                        try:
+                            self._refresh_xenstore()
+                        except Exception:
+                            self._log_error('xenstore refresh')
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            if self.inotify is not None:
+                self.inotify.close()
+            if self.tracker is not None:
+                self.tracker.stop_watch()
+
+def query(socket_path, request):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    client.sendall(('%s\n' % request).encode('utf-8'))
+    data = []
+    while True:
+        chunk = client.recv(65536)
+        if not chunk:
+            break
+        data.append(chunk)
+    client.close()
+    return b''.join(data).decode('utf-8')
+
+def parse_opts():
+    """Parse program options."""
+    parser = optparse.OptionParser(description='Resident daemon serving Xen VM name to configuration file path lookups')
+    parser.add_option('-d', '--debug', help='Turn on debug information', action='store_true', dest='debug', default=False)
+    parser.add_option('-c', '--config', help='Pattern configuration file [default: %default]', dest='config', default=XenView.C_CONF_PATH)
+    parser.add_option('-s', '--socket', help='Unix socket path [default: %default]', dest='socket_path', default=VmCfgDaemon.C_SOCKET_PATH)
+    parser.add_option('--rescan-interval', help='Seconds between full rescans [default: %default]', type='int', dest='rescan_interval', default=VmCfgDaemon.C_RESCAN_INTERVAL)
+    parser.add_option('--xenstore-interval', help='Seconds between xenstore pattern refreshes [default: %default]', type='int', dest='xenstore_interval', default=VmCfgDaemon.C_XENSTORE_INTERVAL)
+    parser.add_option('-q', '--query', help='Ask a running daemon for the vm.cfg of one domU', dest='query', default=None)
+    parser.add_option('-a', '--query-all', help='Ask a running daemon for the full map', action='store_true', dest='query_all', default=False)
+    parser.add_option('--reload', help='Ask a running daemon to rebuild its map', action='store_true', dest='reload', default=False)
+    (opts, args) = parser.parse_args()
+    return (opts, args)
+
+def main():
+    (opts, args) = parse_opts()
+    request = None
+    if opts.query is not None:
+        request = 'GET %s' % opts.query
+    elif opts.query_all:
+        request = 'ALL'
+    elif opts.reload:
+        request = 'RELOAD'
+
+    if request is not None:
+        response = query(opts.socket_path, request)
+        sys.stdout.write(response)
+        if len(response) == 0:
+            sys.exit(1)
+        return
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    daemon = VmCfgDaemon(opts.socket_path, opts.debug, opts.rescan_interval, opts.xenstore_interval, opts.config)
+    daemon.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -2,16 +2,27 @@
 # -*- coding: utf-8 -*-
 
 import os
-import glob
 import re
+import errno
+import stat
 import sys
-import socket
-import optparse
+import time
 try:
     import json
 except ImportError:
     import simplejson as json # pylint: disable=import-error
-from subprocess import Popen,PIPE
+from xenstore_snapshot import XenStoreSnapshot
+from vm_cfg_cache import VmCfgCache
+from vm_cfg_snapshot import VmCfgSnapshot
+from vm_cfg_plan import VmCfgPlan
+from vm_cfg_plan_cache import VmCfgPlanCache
+from domain_registry import DomainRegistry
+from run_file_cache import RunFileCache
+import state_file
+import toolstack
+''' csv, multiprocessing, optparse, threading, and the stats, disk index and command runner modules
+    are imported where they are used: a plain run from cron only pays for what it needs. threading comes
+    with the thread pool, and with the name cache and diff snapshot, which lock against that pool '''
 
 class XenView(object):
     ''' Constants '''
@@ -20,33 +31,83 @@ class XenView(object):
     C_KEY_IMG_FILE_DIR = '{IMG_FILE_DIR}'
     C_VM_CFG_NAME = 'vm.cfg'
     C_CONF_PATH = '%s/../config/vm_cfg_path.json' % os.path.dirname(os.path.realpath(__file__))
-
-    class DOCMD(object):
-        def __init__(self,command):
-            self.command = command
-            p = Popen(self.command, stdin=PIPE, stdout=PIPE, \
-                stderr=PIPE, shell=True)
-            self.out,self.err = p.communicate()
-            self.code = p.returncode
-        def out(self):
-            return self.out
-        def err(self):
-            return self.err
-        def code(self):
-            return self.code
+    C_CACHE_PATH = '%s/cache' % state_file.C_STATE_DIR
+    C_PLAN_CACHE_PATH = '%s/plan' % state_file.C_STATE_DIR
+    C_BACKOFF_PATH = '%s/backoff' % state_file.C_STATE_DIR
+    C_SNAPSHOT_PATH = '%s/snapshot' % state_file.C_STATE_DIR
+    C_MAX_NAME_READ_SIZE = 65536
+    C_RE_NAME = re.compile('name\\s*=(.*)')
+    C_FORMAT_TEXT = 'text'
+    C_FORMAT_JSON = 'json'
+    C_FORMAT_CSV = 'csv'
+    C_FORMAT_LIST = [C_FORMAT_TEXT, C_FORMAT_JSON, C_FORMAT_CSV]
+    C_FIELD_LIST = ['name', 'path', 'pattern']
+    C_BATCH_FIELD_LIST = ['host'] + C_FIELD_LIST
+    C_DISK_FIELD_LIST = ['disk', 'name', 'path', 'state']
+    C_DIFF_FIELD_LIST = ['change', 'name', 'path', 'previous_path', 'pattern']
+    C_MAX_SYMLINKS = 40
 
     """ Class initializer """
-    def __init__(self, debug=False):
-        ''' Final result with domu_id as key'''
-        self.running_domu_name_dict = {}
-        self.running_domu_disk_dict = {}
-        self.running_domu_vm_cfg_dict = {}
-        self.vm_cfg_dict = {}
+    def __init__(self, debug=False, cache_path=None, rebuild_cache=False, jobs=1, toolstack_name=toolstack.C_AUTO, conf_path=C_CONF_PATH, stats=False, root=None, hostname=None, plan_cache_path=None,
+            command_timeout=None, command_jobs=None, pattern_timeout=None, backoff_path=None, snapshot_path=None):
+        ''' Final result: one record per domain, by running domain id and by name '''
+        self.domain_registry = DomainRegistry()
+        self.vm_cfg_complete = False
 
         self.debug = debug
+        self.jobs = jobs
+        self.toolstack_name = toolstack_name
+        self.conf_path = conf_path
+        ''' Offline mode: every path is looked up under root, e.g. a dom0 filesystem snapshot; xenstore is not used '''
+        self.root = None
+        if root:
+            self.root = os.path.abspath(root).rstrip('/')
+        self.hostname = hostname
 
         ''' Interim result '''
         self.vm_cfg_pattern_list = None
+        self.vm_cfg_plan_list = None
+        self.vm_cfg_plan_cache = None
+        if plan_cache_path:
+            self.vm_cfg_plan_cache = VmCfgPlanCache(plan_cache_path)
+        self.xenstore_snapshot = None
+        self.domain_tracker = None
+        ''' The toolstack is asked once, later lookups reuse its answer until _reset_running_domu_list '''
+        self.domu_listed = False
+        ''' Started by the first Xen tool call, a run without any (e.g. --root) never imports subprocess '''
+        self.command_runner = None
+        self.command_timeout = command_timeout
+        self.command_jobs = command_jobs
+        ''' Seconds each pattern, or its part under one mount point, may take; None waits for ever '''
+        self.pattern_timeout = pattern_timeout
+        self.backoff_path = backoff_path
+        self.mount_backoff = None
+        ''' Pattern index -> reasons its result is incomplete, e.g. a timed out or skipped mount '''
+        self.partial_pattern_dict = {}
+        self.timed_out_mount_set = set()
+        self.abandoned_job_count = 0
+        self.toolstack_backend = None
+        self.vm_cfg_cache = None
+        if cache_path:
+            self.vm_cfg_cache = VmCfgCache(cache_path, rebuild=rebuild_cache)
+        ''' Result of the last run for the differential report; its names are reused while their vm.cfg is unchanged '''
+        self.vm_cfg_snapshot = None
+        if snapshot_path:
+            self.vm_cfg_snapshot = VmCfgSnapshot(snapshot_path)
+        ''' Per-pattern counters, None unless asked for so the handlers only pay for a None check '''
+        self.run_stats = None
+        if stats:
+            from vm_cfg_stats import RunStats
+            self.run_stats = RunStats()
+        self.disk_index = None
+        ''' Started by each full scan or lookup batch and dropped when it ends: handlers called in between (e.g. by the
+            daemon) go to the filesystem, and no run sees what an earlier one stat'ed. The last one is kept for --stats '''
+        self.file_cache = None
+        self.last_file_cache = None
+        ''' Running-only scan: names still to resolve, None otherwise so the handlers keep every candidate '''
+        self.wanted_name_set = None
+        self.tried_pattern_list = []
+        self.unresolved_name_list = []
 
         self._initialize_conf_list()
 
@@ -55,52 +116,107 @@ class XenView(object):
         if self.debug:
             print('DEBUG: %s' % msg)
 
+    ''' Count one event against the pattern being evaluated on this thread '''
+    def _count(self, counter, value=1):
+        if self.run_stats is not None:
+            self.run_stats.add(counter, value)
+
+    ''' Every Xen tool call goes through here so spawns can be counted per pattern; command is an argv list '''
+    def _docmd(self, command):
+        self._count('subprocesses')
+        return self._get_command_runner().run(command)
+
+    def _get_command_runner(self):
+        if self.command_runner is None:
+            from command_runner import CommandRunner
+            timeout = self.command_timeout
+            if timeout is None:
+                timeout = CommandRunner.C_DEFAULT_TIMEOUT
+            concurrency = self.command_jobs
+            if concurrency is None:
+                concurrency = CommandRunner.C_DEFAULT_CONCURRENCY
+            self.command_runner = CommandRunner(timeout, concurrency, self.debug)
+        return self.command_runner
+
     ''' Gets a list of running domUs '''
     def _initialize_domu_list(self, running=True):
-        if running:
-            cmd = self.DOCMD("xm list --state=running | grep -v Name")
+        if self.domain_tracker is not None:
+            ''' The registry is shared with the tracker, which keeps it up to date from watch events '''
+            return True
+        if self.domu_listed:
+            return True
+
+        ''' The backend picked by the first call is kept, so its latency history covers the whole run '''
+        if self.toolstack_backend is None:
+            (self.toolstack_backend, domu_dict) = toolstack.list_domains(self._docmd, self.toolstack_name, running)
         else:
-            cmd = self.DOCMD("xm list | grep -v Name")
-        if cmd.code != 0:
+            domu_dict = self.toolstack_backend.list_domains(running)
+        if domu_dict is None:
+            self.toolstack_backend = None
             print("ERROR: Unable to get domU list")
             return
 
-        for domu in cmd.out.splitlines():
-            if "Domain-0" in domu:
-                continue
-            if domu.split()[1]:
-                self.running_domu_name_dict[domu.split()[1]] = domu.split()[0]
+        stats = self.toolstack_backend.get_stats()
+        self._dprint('Toolstack: %s, calls: %d, last: %.3fs' % (stats['backend'], stats['calls'], stats['last']))
+        if getattr(self.toolstack_backend, 'snapshot', None) is not None:
+            self.xenstore_snapshot = self.toolstack_backend.snapshot
+        for (domu_id, name) in domu_dict.items():
+            self.domain_registry.add_running(domu_id, name)
+        self.domu_listed = True
         return True
 
+    ''' Backend name and latency of the toolstack calls, None if no domain listing was done '''
+    def get_toolstack_stats(self):
+        if self.toolstack_backend is None:
+            return None
+        return self.toolstack_backend.get_stats()
+
+    ''' Dump xenstore once per run, all domU/backend lookups are answered from it '''
+    def _initialize_xenstore_snapshot(self):
+        if self.xenstore_snapshot is None:
+            snapshot = XenStoreSnapshot(self._docmd)
+            if not snapshot.load():
+                return
+            self.xenstore_snapshot = snapshot
+        return self.xenstore_snapshot
+
     ''' Get img disk list path from xenstore for a given domU '''
     def _initialize_disk_for_domu(self, domu_id):
-        backends = []
-        disks = []
-        cmd = self.DOCMD("xenstore-ls /local/domain/%s" % domu_id)
-        if cmd.code != 0:
+        snapshot = self._initialize_xenstore_snapshot()
+        if snapshot is None:
+            return
+        disks = snapshot.get_disk_list(domu_id)
+        if disks is None:
             return
-        for line in cmd.out.splitlines():
-            if re.search("backend =.*vbd",line):
-                backends.append(line.split("=")[1].replace('"',''))
-
-        for back in backends:
-            cmd = self.DOCMD("xenstore-ls -f %s | grep params" % back)
-            if cmd.code != 0:
-                return
-            disks.append(cmd.out.split("=")[1].replace('"','').strip())
 
-        self.running_domu_disk_dict[domu_id] = disks
+        self.domain_registry.set_disk_list(domu_id, disks)
         return True
 
+    ''' Forget running domUs and the xenstore snapshot so they are read again '''
+    def _reset_running_domu_list(self):
+        self.domain_registry.clear_running()
+        self.xenstore_snapshot = None
+        self.domu_listed = False
+
     def _initialize_disk_list(self):
-        if len(self.running_domu_name_dict) == 0:
+        if self.domain_tracker is not None:
             return
-        for domu_id in self.running_domu_name_dict.keys():
+        for domu_id in self.domain_registry.get_running_id_list():
             self._initialize_disk_for_domu(domu_id)
 
+    ''' Runs on the domains of tracker, which from now on keeps the running part of the registry up to date;
+        None goes back to asking the toolstack, the records already known are kept '''
+    def set_domain_tracker(self, tracker):
+        self.domain_tracker = tracker
+        if tracker is not None:
+            self.domain_registry = tracker.domain_registry
+
     def _get_file_content(self, filename):
         fo = open(filename)
         lines = fo.readlines()
+        if self.run_stats is not None:
+            self._count('files_opened')
+            self._count('bytes_read', sum([len(line) for line in lines]))
         new_lines = []
         for line in lines:
             line = line.strip()
@@ -110,141 +226,1017 @@ class XenView(object):
         fo.close()
         return new_lines
 
+    ''' Parsed and validated once per config change, later runs take the list from the plan cache '''
+    def _load_vm_cfg_pattern_list(self):
+        if self.vm_cfg_plan_cache is not None:
+            pattern_list = self.vm_cfg_plan_cache.load(self.conf_path)
+            if pattern_list is not None:
+                return pattern_list
+
+        pattern_list = json.load(open(self.conf_path))['vm_cfg_path_list']
+        for pttn in pattern_list:
+            VmCfgPlan.validate(pttn)
+        if self.vm_cfg_plan_cache is not None and not self.vm_cfg_plan_cache.save(self.conf_path, pattern_list):
+            self._dprint('Unable to save plan cache file: %s' % self.vm_cfg_plan_cache.cache_path)
+        return pattern_list
+
     def _initialize_conf_list(self):
-        self.vm_cfg_pattern_list = json.load(open(self.C_CONF_PATH))['vm_cfg_path_list']
+        self.vm_cfg_pattern_list = self._load_vm_cfg_pattern_list()
+        hostname = self.hostname
+        if self.root is None:
+            self.vm_cfg_plan_list = [VmCfgPlan.compile(pttn, hostname) for pttn in self.vm_cfg_pattern_list]
+            return
+
+        self.vm_cfg_plan_list = []
+        for pttn in self.vm_cfg_pattern_list:
+            if pttn['type'] != 'xenstore':
+                pttn = dict(pttn, path_pattern=self._in_root(pttn['path_pattern']))
+            self.vm_cfg_plan_list.append(VmCfgPlan.compile(pttn, hostname))
+
+    ''' Path as seen by this process for a path of the (possibly offline) dom0 '''
+    def _in_root(self, path):
+        if self.root is None:
+            return path
+        return '%s/%s' % (self.root, path.lstrip('/'))
+
+    ''' Path as seen on the dom0, for reporting '''
+    def _host_path(self, path):
+        if self.root is None:
+            return path
+        if path.startswith(self.root + '/'):
+            return path[len(self.root):]
+        return path
+
+    ''' os.path.realpath; under a root, absolute symlink targets and ".." stay inside the root.
+        During a run, resolved directories come from the file cache so a new path costs one lstat '''
+    def _realpath(self, path):
+        if self.root is None and self.file_cache is None:
+            return os.path.realpath(path)
+        if self.root is None:
+            return self._resolve_path(os.path.abspath(path), 0) or '/'
+        return self.root + (self._resolve_path(self._host_path(path), 0) or '/')
 
+    ''' Resolved dom0 path of an absolute dom0 path, '' for "/" '''
+    def _resolve_path(self, path, links):
+        if path == '' or path == '/':
+            return ''
+        (parent, part) = path.rsplit('/', 1)
+        resolved = self._cached('realpath', parent, lambda key: self._resolve_path(key, links))
+        if part == '' or part == '.':
+            return resolved
+        if part == '..':
+            return resolved.rsplit('/', 1)[0]
+
+        candidate = '%s/%s' % (resolved, part)
+        local_path = candidate
+        if self.root is not None:
+            local_path = self.root + candidate
+        if links >= self.C_MAX_SYMLINKS or not os.path.islink(local_path):
+            return candidate
+        target = os.readlink(local_path)
+        if not target.startswith('/'):
+            target = '%s/%s' % (resolved, target)
+        return self._resolve_path(target, links + 1)
+
+    ''' Memoized in the per-run file cache when one is active '''
+    def _cached(self, kind, key, compute):
+        file_cache = self.file_cache
+        if file_cache is None:
+            return compute(key)
+        return file_cache.lookup(kind, key, compute)
+
+    def _isfile(self, path):
+        file_cache = self.file_cache
+        if file_cache is None:
+            return os.path.isfile(path)
+        st = file_cache.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    ''' Within a run, a name is parsed once per physical file (device, inode) whichever path or pattern leads to it '''
     def _get_domain_name_from_file(self, filename):
-        if not os.path.isfile(filename):
+        file_cache = self.file_cache
+        if file_cache is None:
+            return self._get_domain_name_from_storage(filename)
+        st = file_cache.stat(filename)
+        if st is None or not stat.S_ISREG(st.st_mode):
+            return ''
+        return file_cache.lookup('name', (st.st_dev, st.st_ino), lambda key: self._get_domain_name_from_storage(filename))
+
+    ''' Domain names are served from the last snapshot or the persistent cache when the file is unchanged '''
+    def _get_domain_name_from_storage(self, filename):
+        if self.vm_cfg_snapshot is None and self.vm_cfg_cache is None:
+            return self._read_domain_name_from_file(filename)
+        ''' One stat for both, answered by the per-run file cache when there is one '''
+        key = self._get_stat_key(filename)
+        if self.vm_cfg_snapshot is not None:
+            domain_name = self.vm_cfg_snapshot.get_domain_name(self._host_path(filename), key)
+            if domain_name is not None:
+                return domain_name
+        if self.vm_cfg_cache is not None:
+            return self.vm_cfg_cache.get_domain_name(filename, key, self._read_domain_name_from_file)
+        return self._read_domain_name_from_file(filename)
+
+    ''' [dev, ino, mtime, size] of a regular file, the key the name cache and the snapshot compare; None otherwise '''
+    def _get_stat_key(self, filename):
+        file_cache = self.file_cache
+        if file_cache is not None:
+            st = file_cache.stat(filename)
+        else:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            return None
+        return [st.st_dev, st.st_ino, st.st_mtime, st.st_size]
+
+    ''' Stops at the first "name =" assignment, vif_name= and the like are not matched.
+        Read as bytes: an invalid UTF-8 sequence in a comment must not end the scan, and a file
+        that vanished or cannot be read has no name, as it had none for grep '''
+    def _read_domain_name_from_file(self, filename):
+        if not self._isfile(filename):
             return ''
 
-        contents = self._get_file_content(filename)
         domain_name = ''
-        for content in contents:
-            if not re.search('name\s*=', content):
-                continue
-            pos = content.find('=')
-            domain_name = content[pos+1:]
-            domain_name = domain_name.strip().strip('\"').strip('\'')
-            break
+        remaining = self.C_MAX_NAME_READ_SIZE
+        try:
+            fo = open(filename, 'rb')
+            try:
+                while remaining > 0:
+                    line = fo.readline(remaining)
+                    if not line:
+                        break
+                    remaining -= len(line)
+                    if not isinstance(line, str):
+                        line = line.decode('utf-8', 'replace')
+                    m = self.C_RE_NAME.match(line.strip())
+                    if m is None:
+                        continue
+                    domain_name = m.group(1).strip().strip('\"').strip('\'')
+                    break
+            finally:
+                fo.close()
+        except (IOError, OSError):
+            return ''
+        if self.run_stats is not None:
+            self._count('files_opened')
+            self._count('bytes_read', self.C_MAX_NAME_READ_SIZE - remaining)
         return domain_name
 
-    def _update_vm_cfg_dict(self, domain_name, vmcfg_path):
+    ''' False when the domain is already known with another path '''
+    def _update_vm_cfg_dict(self, domain_name, vmcfg_path, path_pattern=None):
         if len(domain_name) == 0 or len(vmcfg_path) == 0:
-            return
+            return True
 
-        if domain_name in self.vm_cfg_dict.keys():
-            if self.vm_cfg_dict[domain_name] != vmcfg_path:
-                self._dprint('Domain %s conflicted: path1: %s; path2: %s' % (domain_name, self.vm_cfg_dict[domain_name], vmcfg_path))
-                return
+        record = self.domain_registry.get(domain_name)
+        if record is not None and record.vm_cfg_head is not None:
+            if not record.is_vm_cfg_path(vmcfg_path):
+                self._dprint('Domain %s conflicted: path1: %s; path2: %s' % (domain_name, record.get_vm_cfg_path(), vmcfg_path))
+                return False
         else:
-            self.vm_cfg_dict[domain_name] = vmcfg_path
-
-    def _translate_pattern_path(self, pttn_path):
-        glob_path = ''
-        search_key = ''
-        if re.search(self.C_KEY_DOM0_HOSTNAME, pttn_path):
-            hostname = socket.gethostname()
-            glob_path = pttn_path.replace(self.C_KEY_DOM0_HOSTNAME, hostname)
-            search_key = self.C_KEY_DOM0_HOSTNAME
-        elif re.search(self.C_KEY_DOMU_HOSTNAME, pttn_path):
-            glob_path = pttn_path.replace(self.C_KEY_DOMU_HOSTNAME, '*')
-            search_key = self.C_KEY_DOMU_HOSTNAME
-        else:
-            glob_path = pttn_path
-        return (glob_path, search_key)
-
-    def _extract_domu_name_from_file_path(self, pttn_path, pttn_key, search_file_path):
-        re_pttn = pttn_path.replace(pttn_key, '(.*)')
-        m = re.match(re_pttn, search_file_path)
-        if m:
-            return m.group(1)
-        else:
-            return ''
+            self.domain_registry.set_vm_cfg(domain_name, vmcfg_path, path_pattern)
+        return True
 
-    def _apply_vm_cfg_pattern_type_list(self, pttn_path):
-        (filename, search_key) = self._translate_pattern_path(pttn_path)
-        if not os.path.isfile(filename):
+    ''' Final result as a name -> vm cfg path dict, built from the registry '''
+    def get_vm_cfg_dict(self):
+        return self.domain_registry.get_vm_cfg_dict()
+
+    def _iter_vm_cfg_pattern_type_list(self, plan):
+        filename = plan.glob_path
+        if not self._isfile(filename):
             return
 
-        lines = self._get_file_content(filename)
+        lines = self._cached('content', filename, self._get_file_content)
+        self._count('matches', len(lines))
         for line in lines:
             if os.path.basename(line) != self.C_VM_CFG_NAME:
                 continue
+            line = self._in_root(line)
             domain_name_in_vm_cfg = self._get_domain_name_from_file(line)
-            self._update_vm_cfg_dict(domain_name_in_vm_cfg, line)
+            yield (domain_name_in_vm_cfg, line)
+
+    ''' Returns the (domain name, vm cfg path) pair of one file matched by a vmcfg pattern, or None '''
+    def _apply_vm_cfg_pattern_to_file(self, plan, file_name):
+        domu_name_in_path = plan.extract_domu_name(file_name)
+        early_name = file_name
+        file_name = self._realpath(file_name)
+        if len(domu_name_in_path) == 0:
+            return None
+        domu_name_in_vm_cfg = self._get_domain_name_from_file(file_name)
+        if domu_name_in_path != domu_name_in_vm_cfg and ('/%s_' % domu_name_in_vm_cfg) not in early_name:
+            self._count('name_mismatches')
+            self._dprint('Domain Name Mismatch: file_name: %s, domu_name_in_path: %s, domu_name_in_vm_cfg: %s' % (file_name, domu_name_in_path, domu_name_in_vm_cfg))
+            return None
+        return (domu_name_in_vm_cfg, file_name)
+
+    ''' False when a file matched by a vmcfg pattern cannot name a wanted domU, so it is neither resolved nor read.
+        Same rule as the name check: the name in the path, or a "/<name>_" directory of the path '''
+    def _is_wanted_file(self, plan, file_name):
+        if self.wanted_name_set is None or plan.extract_domu_name(file_name) in self.wanted_name_set:
+            return True
+        for part in file_name.split('/'):
+            pos = part.find('_')
+            while pos > 0:
+                if part[:pos] in self.wanted_name_set:
+                    return True
+                pos = part.find('_', pos + 1)
+        return False
 
-    def _apply_vm_cfg_pattern_type_single(self, pttn_path):
-        (glob_path, search_key) = self._translate_pattern_path(pttn_path)
-        file_list = glob.glob(glob_path)
+    ''' walk_plan and skip_set restrict the walk to a part of the pattern, e.g. one mount point '''
+    def _iter_vm_cfg_pattern_type_single(self, plan, walk_plan=None, skip_set=None):
+        if walk_plan is None:
+            walk_plan = plan
+        file_list = walk_plan.expand(skip_set)
+        self._count('matches', len(file_list))
         for file_name in file_list:
-            domu_name_in_path = self._extract_domu_name_from_file_path(pttn_path, search_key, file_name)
-            early_name = file_name
-            file_name = os.path.realpath(file_name)
-            if len(domu_name_in_path) == 0:
+            if not self._is_wanted_file(plan, file_name):
                 continue
-            domu_name_in_vm_cfg = self._get_domain_name_from_file(file_name)
-            if domu_name_in_path != domu_name_in_vm_cfg and not re.search('/%s_' % domu_name_in_vm_cfg, early_name):
-                self._dprint('Domain Name Mismatch: file_name: %s, domu_name_in_path: %s, domu_name_in_vm_cfg: %s' % (file_name, domu_name_in_path, domu_name_in_vm_cfg))
-                continue
-            self._update_vm_cfg_dict(domu_name_in_vm_cfg, file_name)
+            result = self._apply_vm_cfg_pattern_to_file(plan, file_name)
+            if result is not None:
+                yield result
 
-    def _apply_vm_cfg_pattern_type_xenstore(self, pttn_path):
+    def _iter_vm_cfg_pattern_type_xenstore(self, plan):
         self._initialize_domu_list()
         self._initialize_disk_list()
-        for domu_id in self.running_domu_disk_dict.keys():
-            ''' Assume all disks are in the same dir '''
-            disk_path = self.running_domu_disk_dict[domu_id][0]
-            domu_name_in_xenstore = self.running_domu_name_dict[domu_id]
-            vm_cfg_path = '%s/%s' % (os.path.dirname(disk_path), self.C_VM_CFG_NAME)
-            domu_name_in_vm_cfg = self._get_domain_name_from_file(vm_cfg_path)
-            if len(domu_name_in_vm_cfg) != 0:
-                if domu_name_in_vm_cfg == domu_name_in_xenstore:
-                    self._update_vm_cfg_dict(domu_name_in_xenstore, vm_cfg_path)
-                else:
-                    self._dprint('file_name: %s, domu_name_in_xenstore: %s, domu_name_in_vm_cfg: %s' % (vm_cfg_path, domu_name_in_xenstore, domu_name_in_vm_cfg))
-
-    def _apply_vm_cfg_pattern(self):
-        for pttn in self.vm_cfg_pattern_list:
-            if pttn['enable'] == 'False':
+        record_list = [record for record in self.domain_registry.get_running_record_list() if record.disks is not None]
+        self._count('matches', len(record_list))
+        for record in record_list:
+            if self.wanted_name_set is not None and record.name not in self.wanted_name_set:
                 continue
+            result = self._apply_vm_cfg_pattern_to_domu(record.domu_id)
+            if result is not None:
+                yield result
 
-            pttn_path = pttn['path_pattern']
-            pttn_type = pttn['type']
-            if pttn_type == 'list':
-                self._apply_vm_cfg_pattern_type_list(pttn_path)
-            elif pttn_type == 'vmcfg':
-                self._apply_vm_cfg_pattern_type_single(pttn_path)
-            elif pttn_type == 'xenstore':
-                self._apply_vm_cfg_pattern_type_xenstore(pttn_path)
-            else:
-                assert False, 'Unknown pattern type: %s' % pttn_type
+    ''' Returns the (domain name, vm cfg path) pair of the vm.cfg next to a running domU's disk, or None '''
+    def _apply_vm_cfg_pattern_to_domu(self, domu_id):
+        ''' Assume all disks are in the same dir; a domU without disks has no vm.cfg to find this way '''
+        record = self.domain_registry.get_by_id(domu_id)
+        if record is None or not record.disks:
+            return None
+        disk_path = record.get_first_disk()
+        domu_name_in_xenstore = record.name
+        vm_cfg_path = '%s/%s' % (os.path.dirname(disk_path), self.C_VM_CFG_NAME)
+        domu_name_in_vm_cfg = self._get_domain_name_from_file(vm_cfg_path)
+        if len(domu_name_in_vm_cfg) == 0:
+            return None
+        if domu_name_in_vm_cfg != domu_name_in_xenstore:
+            self._count('name_mismatches')
+            self._dprint('file_name: %s, domu_name_in_xenstore: %s, domu_name_in_vm_cfg: %s' % (vm_cfg_path, domu_name_in_xenstore, domu_name_in_vm_cfg))
+            return None
+        return (domu_name_in_xenstore, vm_cfg_path)
 
-    def get_all_domu_name_2_vm_cfg_dict(self):
-        if len(self.vm_cfg_dict) != 0:
-            return self.vm_cfg_dict
-        self._apply_vm_cfg_pattern()
-        return self.vm_cfg_dict
+    ''' Candidates of one pattern for one domU: {DOMU_HOSTNAME} is replaced by the name and xenstore
+        is asked about that domain only; other patterns are scanned and the caller stops at the first match '''
+    def _iter_vm_cfg_pattern_for_domu(self, plan, domu_name):
+        if plan.type == 'vmcfg' and plan.search_key == VmCfgPlan.C_KEY_DOMU_HOSTNAME:
+            for narrowed in [plan.narrow(domu_name), plan.narrow(domu_name, True)]:
+                file_list = narrowed.expand()
+                self._count('matches', len(file_list))
+                for file_name in file_list:
+                    result = self._apply_vm_cfg_pattern_to_file(plan, file_name)
+                    if result is not None:
+                        yield result
+            return
+
+        if plan.type == 'xenstore':
+            self._initialize_domu_list()
+            record = self.domain_registry.get(domu_name)
+            if record is not None and record.domu_id is not None:
+                domu_id = record.domu_id
+                if record.disks is None and self.domain_tracker is None:
+                    self._initialize_disk_for_domu(domu_id)
+                if record.disks is None:
+                    return
+                self._count('matches')
+                result = self._apply_vm_cfg_pattern_to_domu(domu_id)
+                if result is not None:
+                    yield result
+            return
+
+        for result in self._iter_vm_cfg_pattern_by_type(plan):
+            yield result
+
+    ''' Yields the (domain name, vm cfg path) pairs of one pattern as they are found '''
+    def _iter_vm_cfg_pattern_by_type(self, plan):
+        if plan.type == 'list':
+            return self._iter_vm_cfg_pattern_type_list(plan)
+        elif plan.type == 'vmcfg':
+            return self._iter_vm_cfg_pattern_type_single(plan)
+        elif plan.type == 'xenstore':
+            return self._iter_vm_cfg_pattern_type_xenstore(plan)
+        else:
+            assert False, 'Unknown pattern type: %s' % plan.type
+
+    ''' Returns the (domain name, vm cfg path) pairs found by one pattern '''
+    def _apply_vm_cfg_pattern_by_type(self, plan):
+        return list(self._iter_vm_cfg_pattern_by_type(plan))
+
+    ''' Same as _iter_vm_cfg_pattern_by_type, with the pattern timed and its counters kept.
+        When streaming, the time the caller spends between two pairs is part of the pattern time '''
+    def _iter_vm_cfg_pattern_with_stats(self, indexed_plan):
+        (index, plan) = indexed_plan
+        return self._iter_with_stats(index, plan, self._iter_vm_cfg_pattern_by_type(plan))
+
+    def _iter_with_stats(self, index, plan, result_iter):
+        record = self.run_stats.begin(index, plan)
+        try:
+            for result in result_iter:
+                record.add('results')
+                yield result
+        finally:
+            self.run_stats.end()
+
+    ''' Pool worker: the pairs of one pattern as a list, timed when stats are on '''
+    def _apply_vm_cfg_pattern_in_pool(self, indexed_plan):
+        if self.run_stats is not None:
+            return list(self._iter_vm_cfg_pattern_with_stats(indexed_plan))
+        return self._apply_vm_cfg_pattern_by_type(indexed_plan[1])
+
+    ''' Run func over arg_list on up to self.jobs threads, results are yielded in the order of arg_list as soon as available.
+        With timeout, a job running longer than that is left to its thread, which is replaced by a new worker,
+        and on_timeout(arg) is yielded in its place '''
+    def _iter_in_pool(self, func, arg_list, timeout=None, on_timeout=None):
+        import threading
+        result_list = [None] * len(arg_list)
+        error_list = [None] * len(arg_list)
+        done_list = [False] * len(arg_list)
+        start_list = [None] * len(arg_list)
+        pending_list = list(range(len(arg_list)))
+        condition = threading.Condition()
 
-    def get_all_domu_name_2_vm_cfg_report(self):
+        def worker():
+            while True:
+                condition.acquire()
+                try:
+                    if len(pending_list) == 0:
+                        return
+                    index = pending_list.pop(0)
+                    start_list[index] = time.time()
+                    condition.notify_all()
+                finally:
+                    condition.release()
+                result = None
+                error = None
+                try:
+                    result = func(arg_list[index])
+                except Exception:
+                    error = sys.exc_info()[1]
+                condition.acquire()
+                try:
+                    result_list[index] = result
+                    error_list[index] = error
+                    done_list[index] = True
+                    condition.notify_all()
+                finally:
+                    condition.release()
+
+        threads = []
+        def start_worker():
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for i in range(max(1, min(self.jobs, len(arg_list)))):
+            start_worker()
+
+        abandoned = False
+        for index in range(len(arg_list)):
+            timed_out = False
+            condition.acquire()
+            try:
+                while not done_list[index]:
+                    if timeout is None or start_list[index] is None:
+                        condition.wait()
+                        continue
+                    remaining = start_list[index] + timeout - time.time()
+                    if remaining <= 0:
+                        timed_out = True
+                        break
+                    condition.wait(remaining)
+                result = result_list[index]
+                result_list[index] = None
+            finally:
+                condition.release()
+            if timed_out:
+                ''' The thread may be blocked in the kernel on a hung mount, nothing can stop it '''
+                abandoned = True
+                self.abandoned_job_count += 1
+                start_worker()
+                yield on_timeout(arg_list[index])
+                continue
+            if error_list[index] is not None:
+                raise error_list[index]
+            yield result
+
+        ''' Every job is done, the workers are only returning; do not let the interpreter exit under them '''
+        if not abandoned:
+            for thread in threads:
+                thread.join()
+
+    ''' Run func over arg_list on up to self.jobs threads, results keep the order of arg_list '''
+    def _run_in_pool(self, func, arg_list):
+        return list(self._iter_in_pool(func, arg_list))
+
+    ''' Jobs of a run with a pattern deadline, (index, plan, walk plan, skip set, mount point): one per pattern, and one
+        per mount point a vmcfg pattern lists directly (e.g. each /OVS/Repositories/*), so a hung mount only costs its
+        own part. Mount points still in backoff get no job, their pattern is marked partial '''
+    def _get_deadline_job_list(self, plan_list):
+        from mount_backoff import MountBackoff, read_mount_point_list, find_mount_point
+        if self.backoff_path and self.mount_backoff is None:
+            self.mount_backoff = MountBackoff(self.backoff_path)
+        mount_point_list = read_mount_point_list()
+        job_list = []
+        for (index, plan) in plan_list:
+            split_list = []
+            if plan.type == 'vmcfg':
+                split_list = sorted(plan.get_first_level_list(mount_point_list))
+            skip_set = None
+            if len(split_list) != 0:
+                skip_set = frozenset(split_list)
+            candidate_list = [(plan, skip_set, find_mount_point(plan.base_dir, mount_point_list))]
+            candidate_list += [(plan.descend(mount_point), None, mount_point) for mount_point in split_list]
+            for (walk_plan, skip_set, mount_point) in candidate_list:
+                if mount_point is not None and self.mount_backoff is not None:
+                    until = self.mount_backoff.get_until(mount_point)
+                    if until is not None:
+                        self._mark_partial(index, '%s skipped until %s, it timed out before' % (mount_point,
+                            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(until))))
+                        continue
+                job_list.append((index, plan, walk_plan, skip_set, mount_point))
+        return job_list
+
+    ''' Deadline worker: the pairs of one job of _get_deadline_job_list, timed when stats are on '''
+    def _apply_deadline_job(self, job):
+        (index, plan, walk_plan, skip_set, mount_point) = job
+        if plan.type == 'vmcfg':
+            result_iter = self._iter_vm_cfg_pattern_type_single(plan, walk_plan, skip_set)
+        else:
+            result_iter = self._iter_vm_cfg_pattern_by_type(plan)
+        if self.run_stats is not None:
+            result_iter = self._iter_with_stats(index, plan, result_iter)
+        result_list = list(result_iter)
+        if mount_point is not None and self.mount_backoff is not None and mount_point not in self.timed_out_mount_set:
+            self.mount_backoff.record_success(mount_point)
+        return result_list
+
+    ''' A job past its deadline: its pattern is partial and its mount point is backed off '''
+    def _on_deadline_job_timeout(self, job):
+        (index, plan, walk_plan, skip_set, mount_point) = job
+        reason = 'timed out after %gs' % self.pattern_timeout
+        if mount_point is not None:
+            reason = '%s timed out after %gs' % (mount_point, self.pattern_timeout)
+            self.timed_out_mount_set.add(mount_point)
+            if self.mount_backoff is not None:
+                reason = '%s, skipped for %ds' % (reason, self.mount_backoff.record_timeout(mount_point))
+        self._mark_partial(index, reason)
+        return []
+
+    def _mark_partial(self, index, reason):
+        self._dprint('Partial result for %s: %s' % (self.vm_cfg_pattern_list[index]['path_pattern'], reason))
+        self.partial_pattern_dict.setdefault(index, []).append(reason)
+
+    ''' {path pattern: [reasons]} of the patterns whose result of the last scan is incomplete '''
+    def get_partial_pattern_dict(self):
+        return dict([(self.vm_cfg_pattern_list[index]['path_pattern'], list(reason_list))
+            for (index, reason_list) in self.partial_pattern_dict.items()])
+
+    ''' Merge in config order, so the first pattern wins regardless of completion order '''
+    def _merge_vm_cfg_result_lists(self, result_lists):
+        self.domain_registry.clear_vm_cfg()
+        for result_list in result_lists:
+            for (domain_name, vmcfg_path) in result_list:
+                self._update_vm_cfg_dict(domain_name, vmcfg_path)
+
+    ''' Disk paths of the "disk = [...]" assignment of a vm.cfg, read within the same size cap as names,
+        as bytes for the same reason '''
+    def _read_disk_list_from_file(self, filename):
+        try:
+            fo = open(filename, 'rb')
+            try:
+                text = fo.read(self.C_MAX_NAME_READ_SIZE)
+            finally:
+                fo.close()
+        except (IOError, OSError):
+            return []
+        if self.run_stats is not None:
+            self._count('files_opened')
+            self._count('bytes_read', len(text))
+        if not isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        from disk_index import DiskIndex
+        return DiskIndex.parse_disk_list(text)
+
+    ''' Reverse index disk path -> owners, built once from the xenstore params of running domUs
+        and the "disk =" entries of every resolved vm.cfg, so stopped domUs are covered too '''
+    def get_disk_index(self):
+        if self.disk_index is not None:
+            return self.disk_index
+        from disk_index import DiskIndex
+        disk_index = DiskIndex()
         vmcfg_dict = self.get_all_domu_name_2_vm_cfg_dict()
-        domu_name_list = vmcfg_dict.keys()
-        domu_name_list.sort()
+
+        running_name_set = set()
+        if self.root is None:
+            registry = self.domain_registry
+            ''' Already filled when a xenstore pattern ran '''
+            if registry.get_running_count() == 0:
+                self._initialize_domu_list()
+            record_list = registry.get_running_record_list()
+            if len([record for record in record_list if record.disks is not None]) == 0:
+                self._initialize_disk_list()
+            running_name_set = set([record.name for record in record_list])
+            for record in record_list:
+                for disk_path in record.get_disk_list() or []:
+                    disk_index.add(disk_path, record.name, vmcfg_dict.get(record.name, ''), True)
+
+        for (domu_name, vmcfg_path) in vmcfg_dict.items():
+            for disk_path in self._read_disk_list_from_file(self._in_root(vmcfg_path)):
+                disk_index.add(disk_path, domu_name, vmcfg_path, domu_name in running_name_set)
+        self.disk_index = disk_index
+        return disk_index
+
+    ''' Yields (domain name, vm cfg path, path pattern) as soon as a domain is resolved, the first pattern still wins.
+        Patterns run one after the other, or on self.jobs threads with each pattern released in config order.
+        With a pattern timeout they always run on threads, see _get_deadline_job_list '''
+    def iter_domu_name_2_vm_cfg(self):
+        plan_list = self._get_enabled_plan_list()
+        self.domain_registry.clear_vm_cfg()
+        self.vm_cfg_complete = False
+        self._start_file_cache()
+        self.partial_pattern_dict = {}
+        self.timed_out_mount_set = set()
+        start = time.time()
+        index_list = [index for (index, plan) in plan_list]
+        if self.pattern_timeout:
+            job_list = self._get_deadline_job_list(plan_list)
+            index_list = [job[0] for job in job_list]
+            result_iter = self._iter_in_pool(self._apply_deadline_job, job_list, self.pattern_timeout, self._on_deadline_job_timeout)
+        elif self.jobs > 1:
+            result_iter = self._iter_in_pool(self._apply_vm_cfg_pattern_in_pool, plan_list)
+        elif self.run_stats is not None:
+            result_iter = (self._iter_vm_cfg_pattern_with_stats(indexed_plan) for indexed_plan in plan_list)
+        else:
+            result_iter = (self._iter_vm_cfg_pattern_by_type(plan) for (index, plan) in plan_list)
+
+        try:
+            for (position, result_list) in enumerate(result_iter):
+                index = index_list[position]
+                path_pattern = self.vm_cfg_pattern_list[index]['path_pattern']
+                for (domain_name, vmcfg_path) in result_list:
+                    vmcfg_path = self._host_path(vmcfg_path)
+                    if self.domain_registry.has_vm_cfg(domain_name):
+                        if not self._update_vm_cfg_dict(domain_name, vmcfg_path) and self.run_stats is not None:
+                            self.run_stats.add_to(index, 'conflicts')
+                        continue
+                    self._update_vm_cfg_dict(domain_name, vmcfg_path, path_pattern)
+                    if self.domain_registry.has_vm_cfg(domain_name):
+                        yield (domain_name, vmcfg_path, path_pattern)
+        finally:
+            self._end_file_cache()
+
+        self.vm_cfg_complete = True
+        if self.run_stats is not None:
+            self.run_stats.wall = time.time() - start
+        self._save_vm_cfg_cache()
+        if self.mount_backoff is not None and not self.mount_backoff.save():
+            self._dprint('Unable to save backoff file: %s' % self.backoff_path)
+
+    ''' Same as iter_domu_name_2_vm_cfg restricted to the running domUs: the running set is read first and patterns
+        run one after the other in priority order, each skipping files that cannot name a domU still unresolved.
+        The scan stops as soon as every running domU is resolved, the remaining patterns are never evaluated '''
+    def iter_running_domu_name_2_vm_cfg(self):
+        self.domain_registry.clear_vm_cfg()
+        self.vm_cfg_complete = False
+        self.tried_pattern_list = []
+        if self.root is not None or not self._initialize_domu_list():
+            return
+        self._start_file_cache()
+        self.wanted_name_set = set([name for name in self.domain_registry.get_running_name_list() if name])
+        start = time.time()
+        try:
+            for (index, plan) in self._get_enabled_plan_list():
+                if len(self.wanted_name_set) == 0:
+                    self._dprint('All running domUs resolved, remaining patterns skipped')
+                    break
+                path_pattern = self.vm_cfg_pattern_list[index]['path_pattern']
+                self.tried_pattern_list.append(path_pattern)
+                result_iter = self._iter_vm_cfg_pattern_by_type(plan)
+                if self.run_stats is not None:
+                    result_iter = self._iter_with_stats(index, plan, result_iter)
+                for (domain_name, vmcfg_path) in result_iter:
+                    ''' The first pattern wins, a later match of a resolved name is not looked at '''
+                    if domain_name not in self.wanted_name_set:
+                        continue
+                    self.wanted_name_set.discard(domain_name)
+                    vmcfg_path = self._host_path(vmcfg_path)
+                    self.domain_registry.set_vm_cfg(domain_name, vmcfg_path, path_pattern)
+                    yield (domain_name, vmcfg_path, path_pattern)
+                    if len(self.wanted_name_set) == 0:
+                        break
+                result_iter.close()
+        finally:
+            self.unresolved_name_list = sorted(self.wanted_name_set)
+            self.wanted_name_set = None
+            self._end_file_cache()
+        if self.run_stats is not None:
+            self.run_stats.wall = time.time() - start
+        self._save_vm_cfg_cache()
+
+    ''' {name: [path patterns tried]} of the running domUs the last running-only scan could not resolve '''
+    def get_unresolved_running_domu_dict(self):
+        return dict([(name, list(self.tried_pattern_list)) for name in self.unresolved_name_list])
+
+    ''' (index, plan) of the patterns to evaluate, in priority order '''
+    def _get_enabled_plan_list(self):
+        plan_list = []
+        for (index, plan) in enumerate(self.vm_cfg_plan_list):
+            if not plan.enable:
+                continue
+            if plan.type == 'xenstore' and self.root is not None:
+                continue
+            plan_list.append((index, plan))
+        return plan_list
+
+    def _save_vm_cfg_cache(self):
+        if self.vm_cfg_cache is not None:
+            self._dprint('Cache hits: %d, misses: %d' % (self.vm_cfg_cache.hits, self.vm_cfg_cache.misses))
+            if not self.vm_cfg_cache.save():
+                self._dprint('Unable to save cache file: %s' % self.vm_cfg_cache.cache_path)
+
+    ''' Starts the file cache of a run or lookup batch, empty: nothing an earlier one stat'ed or read is reused '''
+    def _start_file_cache(self):
+        self.file_cache = RunFileCache()
+        self.last_file_cache = self.file_cache
+
+    def _end_file_cache(self):
+        self.file_cache = None
+
+    ''' (domain name, vm cfg path, path pattern) of one domU, or None. Patterns are tried in priority order,
+        each on the paths this name can be at only, and every match is verified as in the full scan '''
+    def resolve(self, domu_name):
+        return list(self.iter_resolve([domu_name]))[0][1]
+
+    ''' (name, resolve(name)) of each name in turn, the lookups of one batch share one view of the files '''
+    def iter_resolve(self, name_list):
+        self._start_file_cache()
+        try:
+            for domu_name in name_list:
+                yield (domu_name, self._resolve(domu_name))
+        finally:
+            self._end_file_cache()
+
+    def _resolve(self, domu_name):
+        found = None
+        start = time.time()
+        for (index, plan) in self._get_enabled_plan_list():
+            result_iter = self._iter_vm_cfg_pattern_for_domu(plan, domu_name)
+            if self.run_stats is not None:
+                result_iter = self._iter_with_stats(index, plan, result_iter)
+            for (domain_name, vmcfg_path) in result_iter:
+                if domain_name == domu_name:
+                    found = (domain_name, self._host_path(vmcfg_path), self.vm_cfg_pattern_list[index]['path_pattern'])
+                    break
+            result_iter.close()
+            if found is not None:
+                break
+        if self.run_stats is not None:
+            self.run_stats.wall += time.time() - start
+        self._save_vm_cfg_cache()
+        return found
+
+    def get_all_domu_name_2_vm_cfg_dict(self):
+        if not self.vm_cfg_complete:
+            for item in self.iter_domu_name_2_vm_cfg():
+                pass
+        return self.get_vm_cfg_dict()
+
+    ''' {kind: {'hits', 'misses', 'ratio'}} of the file cache of the last run, kinds being realpath, stat, name and content '''
+    def get_file_cache_stats(self):
+        if self.last_file_cache is None:
+            return None
+        return self.last_file_cache.get_stats()
+
+    ''' Per-pattern table followed by the file cache hit ratios, for --stats '''
+    def format_stats_report(self):
+        lines = []
+        if self.run_stats is not None:
+            lines.append(self.run_stats.format_report())
+        if self.last_file_cache is not None:
+            lines.append(self.last_file_cache.format_report())
+        if self.command_runner is not None:
+            lines.append(self.command_runner.format_report())
+        return '\n'.join(lines)
+
+    ''' {'patterns': [per-pattern counters in config order], 'total': {...}, 'wall': seconds}, None without stats '''
+    def get_pattern_stats(self):
+        if self.run_stats is None:
+            return None
+        return self.run_stats.to_dict()
+
+    ''' (change, name, path, previous path, path pattern) of the domains added, removed or moved since the last
+        snapshot, which is then replaced by this result; empty when nothing changed. A partial scan reports no removals '''
+    def get_vm_cfg_changes(self):
+        if self.vm_cfg_snapshot is None:
+            self.vm_cfg_snapshot = VmCfgSnapshot(self.C_SNAPSHOT_PATH)
+        item_list = []
+        for (domain_name, vmcfg_path, path_pattern) in self.iter_domu_name_2_vm_cfg():
+            item_list.append((domain_name, vmcfg_path, path_pattern, self._get_stat_key(self._in_root(vmcfg_path))))
+        change_list = self.vm_cfg_snapshot.diff(item_list, len(self.partial_pattern_dict) == 0)
+        self._dprint('Snapshot hits: %d, misses: %d, changes: %d' % (self.vm_cfg_snapshot.hits, self.vm_cfg_snapshot.misses, len(change_list)))
+        if not self.vm_cfg_snapshot.save():
+            self._dprint('Unable to save snapshot file: %s' % self.vm_cfg_snapshot.snapshot_path)
+        return change_list
+
+    ''' Writes change|name|path|previous path for each change since the last snapshot, nothing when there is none '''
+    def get_vm_cfg_diff_report(self, output_format=C_FORMAT_TEXT, stream=None):
+        if stream is None:
+            stream = sys.stdout
+        change_list = self.get_vm_cfg_changes()
+        self._dprint('===== Changes: =====')
+        if len(change_list) != 0 or output_format != self.C_FORMAT_CSV:
+            write_vm_cfg_items(change_list, output_format, stream, self.C_DIFF_FIELD_LIST)
+        return change_list
+
+    ''' Writes each domain as soon as it is resolved; sorting holds everything back until the end '''
+    def get_all_domu_name_2_vm_cfg_report(self, output_format=C_FORMAT_TEXT, sort=False, stream=None):
+        if stream is None:
+            stream = sys.stdout
+        item_iter = self.iter_domu_name_2_vm_cfg()
+        if sort:
+            item_iter = sorted(item_iter)
+
         self._dprint('===== Final Result: =====')
-        for domu_name in domu_name_list:
-            print('%s|%s' % (domu_name, vmcfg_dict[domu_name]))
+        write_vm_cfg_items(item_iter, output_format, stream, self.C_FIELD_LIST)
+
+''' Writes (field, ..., path pattern) tuples; text is the fields without the pattern joined by "|" '''
+def write_vm_cfg_items(item_iter, output_format, stream, field_list, text_field_count=None):
+    if text_field_count is None:
+        text_field_count = len(field_list) - 1
+    if output_format == XenView.C_FORMAT_CSV:
+        import csv
+        writer = csv.writer(stream)
+        writer.writerow(field_list)
+    for item in item_iter:
+        if output_format == XenView.C_FORMAT_JSON:
+            stream.write('%s\n' % json.dumps(dict(zip(field_list, item)), sort_keys=True))
+        elif output_format == XenView.C_FORMAT_CSV:
+            writer.writerow(item)
+        else:
+            stream.write('%s\n' % '|'.join(item[:text_field_count]))
+
+''' Yields (disk, name, vm cfg path, running|stopped) for each owner of each disk, unknown disks are reported on stderr '''
+def iter_disk_owners(xv, disk_path_list, missing_list):
+    for (disk_path, owner_list) in xv.get_disk_index().lookup_list(disk_path_list):
+        if len(owner_list) == 0:
+            sys.stderr.write('ERROR: No domU owns %s\n' % disk_path)
+            missing_list.append(disk_path)
+        for owner in owner_list:
+            state = 'stopped'
+            if owner.running:
+                state = 'running'
+            yield (disk_path, owner.domu_name, owner.vm_cfg_path, state)
+
+''' Error message for a root that cannot be looked up, None when it is a readable directory.
+    Every path under a missing root is just not found, the run would look like a host without domUs '''
+def check_root(root):
+    if not os.path.isdir(root):
+        return 'No such directory'
+    if not os.access(root, os.R_OK | os.X_OK):
+        return 'Directory not readable'
+    return None
+
+''' Batch worker, runs in a child process: returns (root, host, [(host, name, path, pattern)], error) '''
+def resolve_root(job):
+    (root, hostname, conf_path) = job
+    host = hostname or os.path.basename(os.path.abspath(root).rstrip('/'))
+    error = check_root(root)
+    if error is not None:
+        return (root, host, [], error)
+    try:
+        xv = XenView(conf_path=conf_path, root=root, hostname=host)
+        item_list = [(host,) + item for item in xv.iter_domu_name_2_vm_cfg()]
+    except Exception:
+        return (root, host, [], str(sys.exc_info()[1]))
+    return (root, host, item_list, None)
+
+''' Resolves every root in a process pool and writes one merged result set in the order of root_list '''
+def run_batch(root_list, conf_path, hostname=None, processes=None, output_format=XenView.C_FORMAT_TEXT, sort=False, stream=None):
+    if stream is None:
+        stream = sys.stdout
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    failed_list = []
+    try:
+        result_iter = pool.imap(resolve_root, [(root, hostname, conf_path) for root in root_list])
+        def iter_items():
+            for (root, host, item_list, error) in result_iter:
+                if error is not None:
+                    sys.stderr.write('ERROR: %s: %s\n' % (root, error))
+                    failed_list.append(root)
+                for item in item_list:
+                    yield item
+        item_iter = iter_items()
+        if sort:
+            item_iter = sorted(item_iter)
+        write_vm_cfg_items(item_iter, output_format, stream, XenView.C_BATCH_FIELD_LIST)
+    finally:
+        pool.terminate()
+        pool.join()
+    return failed_list
+
+''' Option defaults, shared by the parser and the no-argument fast path; a new dict each time as lists get appended to '''
+def get_option_defaults():
+    return {
+        'debug': False,
+        'config': XenView.C_CONF_PATH,
+        'jobs': 1,
+        'toolstack': toolstack.C_AUTO,
+        'cache_file': XenView.C_CACHE_PATH,
+        'plan_cache_file': XenView.C_PLAN_CACHE_PATH,
+        'no_cache': False,
+        'format': XenView.C_FORMAT_TEXT,
+        'sort': False,
+        'stats': False,
+        'name_list': [],
+        'running': False,
+        'disk_list': [],
+        'disk_file': None,
+        'root': None,
+        'hostname': None,
+        'batch': False,
+        'processes': None,
+        'rebuild_cache': False,
+        'command_timeout': None,
+        'command_jobs': None,
+        'pattern_timeout': None,
+        'backoff_file': XenView.C_BACKOFF_PATH,
+        'diff': False,
+        'snapshot_file': XenView.C_SNAPSHOT_PATH,
+    }
+
+class DefaultOptions(object):
+    ''' What parse_opts() returns for a run without arguments, e.g. from cron, without importing optparse '''
+    def __init__(self):
+        for (key, value) in get_option_defaults().items():
+            setattr(self, key, value)
 
 def parse_opts():
     """Parse program options."""
+    if len(sys.argv) <= 1:
+        return (DefaultOptions(), [])
+
+    import optparse
+    from command_runner import CommandRunner
     parser = optparse.OptionParser(description='Generate pairs of Xen VM name and configuration file path')
-    parser.add_option('-d', '--debug', help='Turn on debug information', action='store_true', dest='debug', default=False)
+    parser.set_defaults(**get_option_defaults())
+    parser.add_option('-d', '--debug', help='Turn on debug information', action='store_true', dest='debug')
+    parser.add_option('-c', '--config', help='Pattern configuration file [default: %default]', dest='config')
+    parser.add_option('-j', '--jobs', help='Number of patterns evaluated concurrently [default: %default]', type='int', dest='jobs')
+    parser.add_option('-t', '--toolstack', help='Domain listing backend: auto, xenstore, xl or xm [default: %default]', type='choice', choices=[toolstack.C_AUTO] + toolstack.C_AUTO_ORDER, dest='toolstack')
+    parser.add_option('--cache-file', help='Cache of domain names parsed from vm.cfg files [default: %default]', dest='cache_file')
+    parser.add_option('--plan-cache-file', help='Cache of the validated pattern configuration [default: %default]', dest='plan_cache_file')
+    parser.add_option('--no-cache', help='Do not read or write the cache files', action='store_true', dest='no_cache')
+    parser.add_option('-f', '--format', help='Output format: text (name|path), json (one object per line) or csv [default: %default]', type='choice', choices=XenView.C_FORMAT_LIST, dest='format')
+    parser.add_option('-s', '--sort', help='Sort by domain name, the output starts once every pattern is done', action='store_true', dest='sort')
+    parser.add_option('--stats', help='Print time and counters of each pattern to stderr', action='store_true', dest='stats')
+    parser.add_option('-n', '--name', help='Only resolve this domU, checking the paths it can be at; may be repeated', action='append', dest='name_list')
+    parser.add_option('--running', help='Only resolve the running domUs, stopping once all are found; -j is not used', action='store_true', dest='running')
+    parser.add_option('--disk', help='Print the domU and vm.cfg owning this disk image; may be repeated', action='append', dest='disk_list')
+    parser.add_option('--disk-file', help='Same as --disk for every path listed in this file, "-" for stdin', dest='disk_file')
+    parser.add_option('-r', '--root', help='Look up every path under this directory, e.g. a collected dom0 filesystem; xenstore patterns are skipped', dest='root')
+    parser.add_option('--hostname', help='dom0 hostname for {DOM0_HOSTNAME} [default: this host, or the root directory name with --root/--batch]', dest='hostname')
+    parser.add_option('-b', '--batch', help='Treat the arguments as roots, resolve them in a process pool and print host|name|path', action='store_true', dest='batch')
+    parser.add_option('-P', '--processes', help='Processes used by --batch [default: number of CPUs]', type='int', dest='processes')
+    parser.add_option('--rebuild-cache', help='Ignore the cache file content and write it again', action='store_true', dest='rebuild_cache')
+    parser.add_option('--command-timeout', help='Seconds before a hung xm, xl or xenstore call is killed, 0 for none [default: %g]' % CommandRunner.C_DEFAULT_TIMEOUT, type='float', dest='command_timeout')
+    parser.add_option('--command-jobs', help='Xen tool calls run at the same time [default: %d]' % CommandRunner.C_DEFAULT_CONCURRENCY, type='int', dest='command_jobs')
+    parser.add_option('--pattern-timeout', help='Seconds a pattern, or its part under one mount point, may take before it is left behind '
+        'and reported as partial (exit status 2); timed out mounts are skipped by later runs for a while', type='float', dest='pattern_timeout')
+    parser.add_option('--backoff-file', help='Mount points skipped after a --pattern-timeout, "" to keep none [default: %default]', dest='backoff_file')
+    parser.add_option('--diff', help='Print only the domains added, removed or moved since the last --diff run as change|name|path|previous path, '
+        'nothing when none changed; names of unchanged vm.cfg files are taken from the snapshot', action='store_true', dest='diff')
+    parser.add_option('--snapshot-file', help='Result of the last --diff run [default: %default]', dest='snapshot_file')
     (opts, args) = parser.parse_args()
+    if opts.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if opts.pattern_timeout is not None and opts.pattern_timeout <= 0:
+        parser.error('--pattern-timeout must be a positive number of seconds')
+    if opts.running and opts.root:
+        parser.error('--running needs the live xenstore, it cannot be used with --root')
+    if opts.pattern_timeout and (opts.running or len(opts.name_list) != 0):
+        parser.error('--pattern-timeout only bounds full scans, it cannot be used with --running or --name')
+    if opts.diff and (opts.batch or opts.running or len(opts.name_list) != 0 or len(opts.disk_list) != 0 or opts.disk_file is not None):
+        parser.error('--diff compares full scans, it cannot be used with --batch, --running, --name or --disk')
     return (opts, args)
 
 
+def create_xenview(opts):
+    cache_path = opts.cache_file
+    plan_cache_path = opts.plan_cache_file
+    if opts.no_cache:
+        cache_path = None
+        plan_cache_path = None
+    hostname = opts.hostname
+    if hostname is None and opts.root:
+        hostname = os.path.basename(os.path.abspath(opts.root).rstrip('/'))
+    snapshot_path = None
+    if opts.diff:
+        snapshot_path = opts.snapshot_file
+    return XenView(opts.debug, cache_path, opts.rebuild_cache, opts.jobs, opts.toolstack, opts.config, opts.stats, opts.root, hostname, plan_cache_path,
+        opts.command_timeout, opts.command_jobs, opts.pattern_timeout, opts.backoff_file, snapshot_path)
+
 def main():
     (opts, args) = parse_opts()
-    xv = XenView(opts.debug)
-    xv.get_all_domu_name_2_vm_cfg_report()
+    if opts.batch:
+        try:
+            failed_list = run_batch(args, opts.config, opts.hostname, opts.processes, opts.format, opts.sort)
+        except IOError:
+            if sys.exc_info()[1].errno != errno.EPIPE:
+                raise
+            os._exit(0)
+        if len(failed_list) != 0:
+            sys.exit(1)
+        return
+
+    if opts.root:
+        error = check_root(opts.root)
+        if error is not None:
+            sys.stderr.write('ERROR: %s: %s\n' % (opts.root, error))
+            sys.exit(1)
+    xv = create_xenview(opts)
+    if len(opts.disk_list) != 0 or opts.disk_file is not None:
+        disk_path_list = list(opts.disk_list)
+        if opts.disk_file == '-':
+            disk_path_list += [line.strip() for line in sys.stdin if line.strip()]
+        elif opts.disk_file is not None:
+            disk_path_list += xv._get_file_content(opts.disk_file)
+        missing_list = []
+        write_vm_cfg_items(iter_disk_owners(xv, disk_path_list, missing_list), opts.format, sys.stdout,
+            XenView.C_DISK_FIELD_LIST, len(XenView.C_DISK_FIELD_LIST))
+        if len(missing_list) != 0:
+            sys.exit(1)
+        return
+
+    if len(opts.name_list) != 0:
+        missing_list = []
+        def iter_resolved():
+            for (name, item) in xv.iter_resolve(opts.name_list):
+                if item is None:
+                    sys.stderr.write('ERROR: No vm.cfg found for %s\n' % name)
+                    missing_list.append(name)
+                    continue
+                yield item
+        write_vm_cfg_items(iter_resolved(), opts.format, sys.stdout, XenView.C_FIELD_LIST)
+        if opts.stats:
+            sys.stderr.write('%s\n' % xv.format_stats_report())
+        if len(missing_list) != 0:
+            sys.exit(1)
+        return
+
+    if opts.running:
+        try:
+            item_iter = xv.iter_running_domu_name_2_vm_cfg()
+            if opts.sort:
+                item_iter = sorted(item_iter)
+            write_vm_cfg_items(item_iter, opts.format, sys.stdout, XenView.C_FIELD_LIST)
+        except IOError:
+            if sys.exc_info()[1].errno != errno.EPIPE:
+                raise
+            os._exit(0)
+        unresolved_dict = xv.get_unresolved_running_domu_dict()
+        for name in sorted(unresolved_dict.keys()):
+            sys.stderr.write('ERROR: No vm.cfg found for running domU %s, patterns tried: %s\n' % (name, ', '.join(unresolved_dict[name])))
+        if opts.stats:
+            sys.stderr.write('%s\n' % xv.format_stats_report())
+        if len(unresolved_dict) != 0:
+            sys.exit(1)
+        return
+
+    try:
+        if opts.diff:
+            xv.get_vm_cfg_diff_report(opts.format)
+        else:
+            xv.get_all_domu_name_2_vm_cfg_report(opts.format, opts.sort)
+    except IOError:
+        if sys.exc_info()[1].errno != errno.EPIPE:
+            raise
+        ''' The reader stopped early (e.g. piped to head), pool threads may still be busy '''
+        os._exit(0)
+    if opts.stats:
+        sys.stderr.write('%s\n' % xv.format_stats_report())
+    partial_dict = xv.get_partial_pattern_dict()
+    for path_pattern in sorted(partial_dict.keys()):
+        sys.stderr.write('WARNING: Partial result for %s: %s\n' % (path_pattern, '; '.join(partial_dict[path_pattern])))
+    status = 0
+    if len(partial_dict) != 0:
+        status = 2
+    if xv.abandoned_job_count != 0:
+        ''' Left behind workers may be blocked on a hung mount, the interpreter must not wait for them '''
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+    sys.exit(status)
 
 if __name__ == '__main__':
     main()
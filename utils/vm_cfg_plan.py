@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from collections import namedtuple
+
+class VmCfgPlan(namedtuple('VmCfgPlan', 'path_pattern type enable description search_key glob_path base_dir part_list path_re name_re')):
+    ''' Immutable, precompiled form of one vm_cfg_path.json entry '''
+    __slots__ = ()
+
+    ''' Constants '''
+    C_KEY_DOM0_HOSTNAME = '{DOM0_HOSTNAME}'
+    C_KEY_DOMU_HOSTNAME = '{DOMU_HOSTNAME}'
+    C_GLOB_MAGIC = re.compile('[*?[]')
+    C_TYPE_LIST = ['list', 'vmcfg', 'xenstore']
+    C_REQUIRED_KEY_LIST = ['path_pattern', 'type', 'enable']
+
+    ''' Raises ValueError for a vm_cfg_path.json entry that cannot be compiled or evaluated '''
+    @classmethod
+    def validate(cls, pttn):
+        if not isinstance(pttn, dict):
+            raise ValueError('Pattern is not an object: %r' % (pttn,))
+        for key in cls.C_REQUIRED_KEY_LIST:
+            if key not in pttn:
+                raise ValueError('Pattern has no "%s": %r' % (key, pttn))
+        if pttn['type'] not in cls.C_TYPE_LIST:
+            raise ValueError('Unknown pattern type: %s' % pttn['type'])
+
+    @classmethod
+    def compile(cls, pttn, hostname=None):
+        pttn_path = pttn['path_pattern']
+        search_key = ''
+        glob_path = pttn_path
+        if cls.C_KEY_DOM0_HOSTNAME in pttn_path:
+            if hostname is None:
+                ''' What socket.gethostname() returns, without importing socket '''
+                hostname = os.uname()[1]
+            glob_path = pttn_path.replace(cls.C_KEY_DOM0_HOSTNAME, hostname)
+            search_key = cls.C_KEY_DOM0_HOSTNAME
+        elif cls.C_KEY_DOMU_HOSTNAME in pttn_path:
+            glob_path = pttn_path.replace(cls.C_KEY_DOMU_HOSTNAME, '*')
+            search_key = cls.C_KEY_DOMU_HOSTNAME
+
+        ''' Literal leading directories are never listed, only the variable components are '''
+        base_list = []
+        part_list = []
+        for part in glob_path.split('/'):
+            if len(part_list) == 0 and not cls.C_GLOB_MAGIC.search(part):
+                base_list.append(part)
+                continue
+            if cls.C_GLOB_MAGIC.search(part):
+                part_list.append((part, re.compile('%s\\Z' % cls._translate_glob(part))))
+            else:
+                part_list.append((part, None))
+        base_dir = '/'.join(base_list)
+        if glob_path.startswith('/') and base_dir == '':
+            base_dir = '/'
+
+        path_re = re.compile('%s\\Z' % cls._translate_glob(glob_path))
+        name_re = None
+        if search_key == cls.C_KEY_DOMU_HOSTNAME:
+            (head, tail) = pttn_path.split(search_key, 1)
+            name_re = re.compile('%s([^/]*)%s\\Z' % (cls._translate_glob(head), cls._translate_glob(tail)))
+
+        return cls(pttn_path, pttn['type'], pttn['enable'] != 'False', pttn.get('description', ''),
+            search_key, glob_path, base_dir, tuple(part_list), path_re, name_re)
+
+    ''' Translate glob syntax into an escaped regex where wildcards never cross "/" '''
+    @staticmethod
+    def _translate_glob(text):
+        res = []
+        i = 0
+        n = len(text)
+        while i < n:
+            c = text[i]
+            i += 1
+            if c == '*':
+                res.append('[^/]*')
+            elif c == '?':
+                res.append('[^/]')
+            elif c == '[':
+                ''' As in fnmatch, a "]" right after "[" or "[!" is a member, not the end '''
+                j = i
+                if j < n and text[j] == '!':
+                    j += 1
+                if j < n and text[j] == ']':
+                    j += 1
+                j = text.find(']', j)
+                if j < 0:
+                    res.append('\\[')
+                    continue
+                chars = text[i:j]
+                negate = ''
+                if chars[0] == '!':
+                    negate = '^'
+                    chars = chars[1:]
+                ''' Only "-" keeps a meaning inside the class, "[", "\\" and "^" are members like any other '''
+                res.append('[%s%s]' % (negate, ''.join([ch == '-' and ch or re.escape(ch) for ch in chars])))
+                i = j + 1
+            else:
+                res.append(re.escape(c))
+        return ''.join(res)
+
+    ''' Escape glob magic so the text only matches itself '''
+    @staticmethod
+    def _escape_glob(text):
+        res = []
+        for c in text:
+            if c in '*?[':
+                res.append('[%s]' % c)
+            else:
+                res.append(c)
+        return ''.join(res)
+
+    ''' Same plan restricted to one domU, None if the pattern has no {DOMU_HOSTNAME} to narrow.
+        With prefix, "<name>_*" is walked instead, the name check also accepts such directories '''
+    def narrow(self, domu_name, prefix=False):
+        if self.search_key != self.C_KEY_DOMU_HOSTNAME:
+            return None
+        value = self._escape_glob(domu_name)
+        if prefix:
+            value = '%s_*' % value
+        path_pattern = self.path_pattern.replace(self.C_KEY_DOMU_HOSTNAME, value)
+        plan = self.compile({'path_pattern': path_pattern, 'type': self.type, 'enable': str(self.enable)})
+        return plan._replace(path_pattern=self.path_pattern, description=self.description,
+            search_key=self.search_key, path_re=self.path_re, name_re=self.name_re)
+
+    ''' Entries of path_list the first listing of base_dir would walk into, e.g. the mount points under it '''
+    def get_first_level_list(self, path_list):
+        if len(self.part_list) == 0 or self.part_list[0][1] is None:
+            return []
+        (part, part_re) = self.part_list[0]
+        entry_list = []
+        for path in path_list:
+            (parent, name) = os.path.split(path)
+            if parent != self.base_dir or not name or (name[0] == '.' and part[0] != '.'):
+                continue
+            if part_re.match(name):
+                entry_list.append(path)
+        return entry_list
+
+    ''' Same plan walked from one entry of the first listing only, see get_first_level_list '''
+    def descend(self, entry_path):
+        return self._replace(base_dir=entry_path, part_list=self.part_list[1:])
+
+    ''' Expand glob_path like glob.glob, walking only the variable components; paths in skip_set are not entered '''
+    def expand(self, skip_set=None):
+        return self.walk(skip_set)[0]
+
+    ''' Returns (matched paths, directories whose entries decide the match, existing or not) '''
+    def walk(self, skip_set=None):
+        path_list = [self.base_dir]
+        dir_list = []
+        for (part, part_re) in self.part_list:
+            next_list = []
+            for path in path_list:
+                dir_list.append(path)
+                if part_re is None:
+                    next_list.append(os.path.join(path, part))
+                    continue
+                try:
+                    names = os.listdir(path or os.curdir)
+                except OSError:
+                    continue
+                for name in names:
+                    if name[0] == '.' and part[0] != '.':
+                        continue
+                    if part_re.match(name):
+                        if skip_set is not None and os.path.join(path, name) in skip_set:
+                            continue
+                        next_list.append(os.path.join(path, name))
+            path_list = next_list
+        return ([path for path in path_list if os.path.lexists(path)], dir_list)
+
+    def match_path(self, file_path):
+        return self.path_re.match(file_path) is not None
+
+    def extract_domu_name(self, file_path):
+        if self.name_re is None:
+            return ''
+        m = self.name_re.match(file_path)
+        if m:
+            return m.group(1)
+        else:
+            return ''
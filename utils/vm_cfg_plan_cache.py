@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import marshal
+import state_file
+from vm_cfg_plan import VmCfgPlan
+
+class VmCfgPlanCache(object):
+    ''' Validated vm_cfg_path_list of one config file, kept with marshal so a warm start needs neither json nor validation '''
+    C_VERSION = 1
+
+    """ Class initializer """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+
+    ''' Any edit of the config (or another config, or interpreter) makes the cached list stale '''
+    def _get_key(self, conf_path):
+        st = os.stat(conf_path)
+        return [os.path.abspath(conf_path), st.st_mtime, st.st_size, st.st_ino, sys.version_info[0]]
+
+    ''' The cached pattern list of conf_path, None when missing, stale, unreadable or not trusted (see state_file).
+        Patterns are validated again, the check is cheap next to parsing the json '''
+    def load(self, conf_path):
+        try:
+            key = self._get_key(conf_path)
+        except OSError:
+            return None
+        data = state_file.read_state(self.cache_path, marshal.load, True)
+        if not isinstance(data, dict) or data.get('version') != self.C_VERSION or data.get('key') != key:
+            return None
+        pattern_list = data.get('pattern_list')
+        if not isinstance(pattern_list, list):
+            return None
+        try:
+            for pttn in pattern_list:
+                VmCfgPlan.validate(pttn)
+        except (ValueError, TypeError):
+            return None
+        return pattern_list
+
+    ''' Write atomically, a concurrent run reads either the old or the new plan '''
+    def save(self, conf_path, pattern_list):
+        try:
+            data = {'version': self.C_VERSION, 'key': self._get_key(conf_path), 'pattern_list': pattern_list}
+        except OSError:
+            return False
+        return state_file.write_state(self.cache_path, lambda fo: marshal.dump(data, fo), True)
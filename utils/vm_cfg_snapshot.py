@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import state_file
+
+class VmCfgSnapshot(object):
+    ''' Result of the last run, so the next one reports only the domains added, removed or moved since.
+        Each entry keeps the stat key of its vm.cfg: while the file is unchanged its name is not read again '''
+
+    ''' Constants '''
+    C_VERSION = 1
+    C_ADDED = 'added'
+    C_REMOVED = 'removed'
+    C_MOVED = 'moved'
+
+    """ Class initializer """
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+        ''' domain name -> [vm cfg path, path pattern, [dev, ino, mtime, size]] '''
+        self.entry_dict = {}
+        ''' vm cfg path -> (stat key, domain name), for the name lookups of the scan '''
+        self.path_dict = {}
+        self.dirty = False
+        import threading
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._load()
+
+    def _load(self):
+        entry_dict = state_file.load_json_entries(self.snapshot_path, self.C_VERSION)
+        if entry_dict is None:
+            return
+        self.entry_dict = entry_dict
+        for (name, entry) in self.entry_dict.items():
+            self.path_dict[entry[0]] = (entry[2], name)
+
+    ''' Name of the domain at vm cfg path when its file still has stat key, None when it must be read '''
+    def get_domain_name(self, vm_cfg_path, key):
+        entry = self.path_dict.get(vm_cfg_path)
+        self.lock.acquire()
+        try:
+            if entry is not None and key is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        finally:
+            self.lock.release()
+        return None
+
+    ''' (change, name, path, previous path, path pattern) of each difference from item_list of
+        (name, path, path pattern, stat key), by name. Unless complete, names not found are not reported
+        as removed: their pattern may only have timed out '''
+    def diff(self, item_list, complete=True):
+        change_list = []
+        new_entry_dict = {}
+        for (name, path, path_pattern, key) in item_list:
+            new_entry_dict[name] = [path, path_pattern, key]
+            entry = self.entry_dict.get(name)
+            if entry is None:
+                change_list.append((self.C_ADDED, name, path, '', path_pattern))
+            elif entry[0] != path:
+                change_list.append((self.C_MOVED, name, path, entry[0], path_pattern))
+        for (name, entry) in self.entry_dict.items():
+            if name in new_entry_dict:
+                continue
+            if complete:
+                change_list.append((self.C_REMOVED, name, entry[0], '', entry[1]))
+            else:
+                new_entry_dict[name] = entry
+        if new_entry_dict != self.entry_dict:
+            self.entry_dict = new_entry_dict
+            self.dirty = True
+        change_list.sort(key=lambda change: change[1])
+        return change_list
+
+    ''' Write atomically, only when something changed '''
+    def save(self):
+        if not self.dirty:
+            return True
+        if not state_file.save_json_entries(self.snapshot_path, self.C_VERSION, self.entry_dict):
+            return False
+        self.dirty = False
+        return True
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+class PatternStats(object):
+    ''' Constants '''
+    C_COUNTER_LIST = ['matches', 'files_opened', 'bytes_read', 'subprocesses', 'name_mismatches', 'conflicts', 'results']
+
+    """ Class initializer """
+    def __init__(self, index, plan):
+        self.index = index
+        self.path_pattern = plan.path_pattern
+        self.type = plan.type
+        self.elapsed = 0.0
+        self.counter_dict = dict([(counter, 0) for counter in self.C_COUNTER_LIST])
+
+    def add(self, counter, value=1):
+        self.counter_dict[counter] += value
+
+    def to_dict(self):
+        stats = {'index': self.index, 'path_pattern': self.path_pattern, 'type': self.type, 'elapsed': self.elapsed}
+        stats.update(self.counter_dict)
+        return stats
+
+class RunStats(object):
+    ''' Counters per vm_cfg_path_list entry, the pattern being evaluated is tracked per thread '''
+
+    """ Class initializer """
+    def __init__(self):
+        self.pattern_list = []
+        ''' Wall time of the whole evaluation, below the sum of pattern times when run on several threads '''
+        self.wall = 0.0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    ''' Starts timing one pattern on the calling thread, counters added until end() go to it.
+        A pattern evaluated again, e.g. by several lookups, keeps adding to the same counters '''
+    def begin(self, index, plan):
+        self.lock.acquire()
+        try:
+            record = self._find(index)
+            if record is None:
+                record = PatternStats(index, plan)
+                self.pattern_list.append(record)
+        finally:
+            self.lock.release()
+        self.local.record = record
+        self.local.start = time.time()
+        return record
+
+    def end(self):
+        self.local.record.elapsed += time.time() - self.local.start
+        self.local.record = None
+
+    ''' Counts against the pattern running on this thread; work outside a pattern is not counted '''
+    def add(self, counter, value=1):
+        record = getattr(self.local, 'record', None)
+        if record is not None:
+            record.add(counter, value)
+
+    ''' Counts against a given pattern, e.g. conflicts found when merging results in config order '''
+    def add_to(self, index, counter, value=1):
+        record = self._find(index)
+        if record is not None:
+            record.add(counter, value)
+
+    def _find(self, index):
+        for record in self.pattern_list:
+            if record.index == index:
+                return record
+        return None
+
+    def to_dict(self):
+        pattern_list = sorted([record.to_dict() for record in self.pattern_list], key=lambda stats: stats['index'])
+        total = {'elapsed': 0.0}
+        for counter in PatternStats.C_COUNTER_LIST:
+            total[counter] = 0
+        for stats in pattern_list:
+            for key in total.keys():
+                total[key] += stats[key]
+        return {'patterns': pattern_list, 'total': total, 'wall': self.wall}
+
+    ''' One line per pattern, in config order, followed by the totals '''
+    def format_report(self):
+        stats = self.to_dict()
+        header = ['#', 'type', 'elapsed(s)', 'matches', 'opened', 'bytes', 'spawns', 'mismatch', 'conflict', 'results', 'path_pattern']
+        lines = ['%3s %-8s %10s %8s %8s %10s %7s %8s %8s %8s  %s' % tuple(header)]
+        for item in stats['patterns'] + [dict(stats['total'], index='', type='total', path_pattern='')]:
+            lines.append('%3s %-8s %10.3f %8d %8d %10d %7d %8d %8d %8d  %s' % (item['index'], item['type'], item['elapsed'],
+                item['matches'], item['files_opened'], item['bytes_read'], item['subprocesses'],
+                item['name_mismatches'], item['conflicts'], item['results'], item['path_pattern']))
+        lines.append('wall: %.3fs' % stats['wall'])
+        return '\n'.join(lines)
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+
+class XenStoreSnapshot(object):
+    ''' Constants '''
+    C_DOMAIN_ROOT = '/local/domain'
+    C_KEY_BACKEND = 'backend'
+    C_KEY_PARAMS = 'params'
+    C_BACKEND_TYPE_VBD = 'vbd'
+
+    """ Class initializer """
+    def __init__(self, docmd, root=C_DOMAIN_ROOT):
+        self.docmd = docmd
+        self.root = root
+
+        ''' Flat index: full xenstore path -> value '''
+        self.node_dict = {}
+        ''' Tree index: full xenstore path -> ordered list of child names '''
+        self.child_dict = {}
+        ''' Frontend index: domu_id -> ordered list of vbd backend paths '''
+        self.vbd_backend_dict = {}
+
+        self.loaded = False
+
+    ''' Dump the whole subtree with a single xenstore-ls call '''
+    def load(self):
+        cmd = self.docmd(['xenstore-ls', '-f', self.root])
+        if cmd.code != 0:
+            return False
+        self.parse(cmd.out)
+        return True
+
+    ''' Refresh one subtree in place, e.g. the frontend or backend nodes of a new domain '''
+    def load_path(self, path):
+        return self.load_path_list([path])
+
+    ''' Same as load_path for several subtrees, their xenstore-ls calls run concurrently when docmd has run_all '''
+    def load_path_list(self, path_list):
+        argv_list = [['xenstore-ls', '-f', path] for path in path_list]
+        run_all = getattr(self.docmd, 'run_all', None)
+        if run_all is not None:
+            cmd_list = run_all(argv_list)
+        else:
+            cmd_list = [self.docmd(argv) for argv in argv_list]
+        loaded = True
+        for (path, cmd) in zip(path_list, cmd_list):
+            self.drop_path(path)
+            if cmd.code != 0:
+                loaded = False
+                continue
+            self.parse(cmd.out)
+        return loaded
+
+    ''' Forget one subtree, e.g. the nodes of a released domain '''
+    def drop_path(self, path):
+        path = path.rstrip('/')
+        if path not in self.node_dict:
+            return
+        for child in list(self.child_dict.get(path, [])):
+            self.drop_path('%s/%s' % (path, child))
+
+        value = self.node_dict.pop(path)
+        self.child_dict.pop(path, None)
+        parent = os.path.dirname(path)
+        if os.path.basename(path) in self.child_dict.get(parent, []):
+            self.child_dict[parent].remove(os.path.basename(path))
+        if os.path.basename(path) == self.C_KEY_BACKEND and self.C_BACKEND_TYPE_VBD in value:
+            domu_id = self._get_domu_id_from_path(path)
+            backend_list = self.vbd_backend_dict.get(domu_id, [])
+            if value in backend_list:
+                backend_list.remove(value)
+            if len(backend_list) == 0:
+                self.vbd_backend_dict.pop(domu_id, None)
+
+    ''' Parse "xenstore-ls -f" output into the flat, tree and frontend indexes '''
+    def parse(self, text):
+        for line in text.splitlines():
+            pos = line.find(' = ')
+            if pos <= 0 or line[0] != '/':
+                continue
+            path = line[:pos]
+            value = line[pos+3:].strip()
+            if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+                value = value[1:-1]
+            self._add_node(path, value)
+        self.loaded = True
+
+    def _add_node(self, path, value):
+        if path not in self.node_dict:
+            parent = os.path.dirname(path)
+            if parent != path:
+                if parent not in self.node_dict:
+                    self._add_node(parent, '')
+                self.child_dict.setdefault(parent, []).append(os.path.basename(path))
+        self.node_dict[path] = value
+
+        ''' Same rule as grepping "backend =.*vbd" from xenstore-ls /local/domain/<id> '''
+        if os.path.basename(path) == self.C_KEY_BACKEND and self.C_BACKEND_TYPE_VBD in value:
+            domu_id = self._get_domu_id_from_path(path)
+            if domu_id is not None:
+                self.vbd_backend_dict.setdefault(domu_id, []).append(value)
+
+    def _get_domu_id_from_path(self, path):
+        prefix = '%s/' % self.root
+        if not path.startswith(prefix):
+            return None
+        return path[len(prefix):].split('/')[0]
+
+    def read(self, path):
+        return self.node_dict.get(path.rstrip('/'))
+
+    def ls(self, path):
+        return self.child_dict.get(path.rstrip('/'), [])
+
+    def get_domu_id_list(self):
+        return self.ls(self.root)
+
+    ''' Get img disk list path for a given domU, None if any backend has no params '''
+    def get_disk_list(self, domu_id):
+        if '%s/%s' % (self.root, domu_id) not in self.node_dict:
+            return None
+        disks = []
+        for back in self.vbd_backend_dict.get(str(domu_id), []):
+            params = self.read('%s/%s' % (back, self.C_KEY_PARAMS))
+            if params is None:
+                return None
+            disks.append(params.strip())
+        return disks
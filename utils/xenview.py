@@ -4,38 +4,57 @@ import os
 import glob
 import re
 import sys
+import stat
+import time
 import pprint
-from subprocess import Popen,PIPE
+try:
+    import json
+except ImportError:
+    import simplejson as json # pylint: disable=import-error
+from xenstore_snapshot import XenStoreSnapshot
+from command_runner import CommandRunner
+from domain_sampler import DomainSampler
+import toolstack
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir # pylint: disable=import-error
+    except ImportError:
+        scandir = None
 
 class XenView(object):
-    class DOCMD(object):
-        def __init__(self,command):
-            self.command = command
-            p = Popen(self.command, stdin=PIPE, stdout=PIPE, \
-                stderr=PIPE, shell=True)
-            self.out,self.err = p.communicate()
-            self.code = p.returncode
-        def out(self):
-            return self.out
-        def err(self):
-            return self.err
-        def code(self):
-            return self.code
+    ''' Constants '''
+    C_SNIFF_SIZE = 4096
+    ''' The name key itself, not vif_name= and the like; the value may be followed by a comment '''
+    C_RE_NAME = re.compile(r"^\s*name\s*=(.*)")
+    C_CONF_PATH = '%s/conf/vm_cfg_path.config' % os.path.dirname(os.path.realpath(__file__))
+    C_IGNORE_CONF_PATH = '%s/../config/vm_cfg_ignore.json' % os.path.dirname(os.path.realpath(__file__))
 
     """ Class initializer """
-    def __init__(self, init_disk=False, debug=False):
+    def __init__(self, init_disk=False, debug=False, toolstack_name=toolstack.C_AUTO, conf_path=C_CONF_PATH, ignore_conf_path=C_IGNORE_CONF_PATH):
         ''' Final result with domu_id as key'''
         self.domu_dict = {}
         self.disk_dict = {}
         self.vm_cfg_dict = {}
 
         self.debug = debug
+        self.toolstack_name = toolstack_name
+        self.conf_path = conf_path
+        self.ignore_conf_path = ignore_conf_path
+        self.toolstack_backend = None
+        self.command_runner = CommandRunner(debug=debug)
 
         ''' Interim result '''
         self.conf_path_list = []
         self.possible_vm_cfg_list = []
+        self.xenstore_snapshot = None
+        self.ignore_regex_list = []
+        self.ignore_re = None
+        self.ignore_hit_dict = {}
 
         self._initialize_conf_list()
+        self._initialize_ignore_list()
         self._initialize_domu_list()
         if init_disk:
             self._initialize_disk_list()
@@ -46,35 +65,33 @@ class XenView(object):
 
     ''' Gets a list of running domUs '''
     def _initialize_domu_list(self, final_check=False):
-        if final_check:
-            cmd = self.DOCMD("xm list --state=running | grep -v Name")
-        else:
-            cmd = self.DOCMD("xm list | grep -v Name")
-        if cmd.code != 0:
-            error("Unable to get domU list")
-        for domu in cmd.out.splitlines():
-            if "Domain-0" in domu:
-                continue
-            if domu.split()[1]:
-                self.domu_dict[domu.split()[1]] = domu.split()[0]
+        (self.toolstack_backend, domu_dict) = toolstack.list_domains(self.command_runner, self.toolstack_name, final_check)
+        if domu_dict is None:
+            print("Error: Unable to get domU list")
+            return
+        self._dprint('DEBUG: Toolstack: %s, last: %.3fs' % (self.toolstack_backend.C_NAME, self.toolstack_backend.get_stats()['last']))
+        if getattr(self.toolstack_backend, 'snapshot', None) is not None:
+            self.xenstore_snapshot = self.toolstack_backend.snapshot
+        self.domu_dict.update(domu_dict)
         return True
 
+    ''' Dump xenstore once per run, all domU/backend lookups are answered from it '''
+    def _initialize_xenstore_snapshot(self):
+        if self.xenstore_snapshot is None:
+            snapshot = XenStoreSnapshot(self.command_runner)
+            if not snapshot.load():
+                return
+            self.xenstore_snapshot = snapshot
+        return self.xenstore_snapshot
+
     ''' Get img disk list path from xenstore for a given domU '''
     def _initialize_disk_for_domu(self, domu_id):
-        backends = []
-        disks = []
-        cmd = self.DOCMD("xenstore-ls /local/domain/%s" % domu_id)
-        if cmd.code != 0:
+        snapshot = self._initialize_xenstore_snapshot()
+        if snapshot is None:
+            return
+        disks = snapshot.get_disk_list(domu_id)
+        if disks is None:
             return
-        for line in cmd.out.splitlines():
-            if re.search("backend =.*vbd",line):
-                backends.append(line.split("=")[1].replace('"',''))
-
-        for back in backends:
-            cmd = self.DOCMD("xenstore-ls -f %s | grep params" % back)
-            if cmd.code != 0:
-                return
-            disks.append(cmd.out.split("=")[1].replace('"','').strip())
 
         self.disk_dict[domu_id] = disks
         return True
@@ -98,108 +115,181 @@ class XenView(object):
         return new_lines
 
     def _initialize_conf_list(self):
-        conf_path = '%s/conf/vm_cfg_path.config' % os.path.dirname(os.path.realpath(__file__))
-        dir_list = self._get_file_content(conf_path)
-        self.conf_path_list = ' '.join(dir_list)
+        self.conf_path_list = self._get_file_content(self.conf_path)
+
+    ''' All ignore rules are compiled into one case-insensitive alternation, one named group per rule '''
+    def _initialize_ignore_list(self):
+        fo = open(self.ignore_conf_path)
+        try:
+            self.ignore_regex_list = json.load(fo)['ignore_regex_list']
+        finally:
+            fo.close()
+        self.ignore_hit_dict = dict([(regex, 0) for regex in self.ignore_regex_list])
+        self.ignore_re = None
+        if len(self.ignore_regex_list) == 0:
+            return
+        group_list = ['(?P<r%d>%s)' % (i, regex) for (i, regex) in enumerate(self.ignore_regex_list)]
+        self.ignore_re = re.compile('|'.join(group_list), re.IGNORECASE)
 
     def _is_ignored(self, file_path):
-        IGNORE_LIST = [
-            '\.bk',
-            '\.bak',
-            '\.orig',
-            'old',
-            'txt$',
-            '\.auto',
-            'snapshot',
-            'Templates',
-            '\.log$',
-            'backup',
-            '\.out$',
-            'bkp',
-            'bkup',
-            'Jan',
-            'Feb',
-            'Mar',
-            'Apr',
-            'May',
-            'Jun',
-            'Jul',
-            'Aug',
-            'Sep',
-            'Oct',
-            'Nov',
-            'Dec',
-            '2010',
-            '2011',
-            '2012',
-            '2013',
-            '2014',
-            '2015',
-            '2016',
-            '2017',
-            '2018',
-            'pre',
-            'befor',
-            'after',
-            'upgrade',
-            'recover',
-            '\.ks$'
-        ]
-        for regex in IGNORE_LIST:
-            if re.search(regex, os.path.basename(file_path), re.IGNORECASE):
-                return True
+        if self.ignore_re is None:
+            return False
+        m = self.ignore_re.search(os.path.basename(file_path))
+        if m is None:
+            return False
+        regex = self.ignore_regex_list[int(m.lastgroup[1:])]
+        self.ignore_hit_dict[regex] += 1
+        return True
+
+    ''' Reads the ignore rules again after an edit of the ignore file, hit counts start over.
+        Candidates were filtered during the scan, they are scanned again on next use '''
+    def reload_ignore_list(self):
+        self._initialize_ignore_list()
+        self.possible_vm_cfg_list = []
+
+    ''' Ignore rules sorted by hits, to see which rules are doing the work '''
+    def get_ignore_stats(self):
+        return sorted(self.ignore_hit_dict.items(), key=lambda item: -item[1])
+
+    ''' Same test as "grep -Iq .": no NUL byte in the first block and at least one non-newline character '''
+    def _is_text_file(self, file_path):
+        try:
+            fo = open(file_path, 'rb')
+        except IOError:
+            return False
+        try:
+            block = fo.read(self.C_SNIFF_SIZE)
+            if b'\0' in block:
+                return False
+            while block:
+                if block.strip(b'\n'):
+                    return True
+                block = fo.read(self.C_SNIFF_SIZE)
+        finally:
+            fo.close()
         return False
 
-    def _get_all_possible_vm_cfg_list(self):
-        cmd = 'find %s -maxdepth 1 -type f -exec grep -Iq . {} \; -print 2>&1 |grep -v "No such file"' % self.conf_path_list
-        #print(cmd)
-        cmd_res = self.DOCMD(cmd)
-        if cmd_res.code != 0:
-            print("Error: command failed: %s" % cmd)
-            return []
+    ''' Applied on names before any stat or open, .vms lists are filtered on their content instead '''
+    def _is_ignored_in_scan(self, file_path):
+        if file_path.endswith('.vms'):
+            return False
+        return self._is_ignored(file_path)
+
+    ''' Regular files of a conf path at depth <= 1, like "find <path> -maxdepth 1 -type f" '''
+    def _scan_dir(self, top):
+        try:
+            st = os.lstat(top)
+        except OSError:
+            return
+        if stat.S_ISREG(st.st_mode):
+            if not self._is_ignored_in_scan(top):
+                yield top
+            return
+        if not stat.S_ISDIR(st.st_mode):
+            return
+
+        if scandir is not None:
+            try:
+                entries = scandir(top)
+            except OSError:
+                return
+            for entry in entries:
+                if self._is_ignored_in_scan(entry.name):
+                    continue
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        yield os.path.join(top, entry.name)
+                except OSError:
+                    continue
+        else:
+            try:
+                names = os.listdir(top)
+            except OSError:
+                return
+            for name in names:
+                if self._is_ignored_in_scan(name):
+                    continue
+                file_path = os.path.join(top, name)
+                try:
+                    if stat.S_ISREG(os.lstat(file_path).st_mode):
+                        yield file_path
+                except OSError:
+                    continue
+
+    ''' Generates text files found under the conf paths without forking find/grep '''
+    def _scan_vm_cfg_candidates(self):
+        for conf_path in self.conf_path_list:
+            top_list = glob.glob(conf_path)
+            if len(top_list) == 0:
+                top_list = [conf_path]
+            for top in top_list:
+                for file_path in self._scan_dir(top):
+                    if self._is_text_file(file_path):
+                        yield file_path
 
-        res_list = cmd_res.out.splitlines()
+    def _get_all_possible_vm_cfg_list(self):
+        res_list = list(self._scan_vm_cfg_candidates())
         res_size = len(res_list)
         if res_size == 0:
             print("Error: size is 0")
             return []
 
-        ''' Special handling of .vms file '''
+        ''' Special handling of .vms file, scanned files were already filtered during traversal '''
         res_list2 = []
         for file_path in res_list:
-            if re.search("\.vms$", file_path):
+            if re.search(r"\.vms$", file_path):
                 lines = self._get_file_content(file_path)
-                res_list2 += lines
+                for line in lines:
+                    ''' Filter those files that could be ignored '''
+                    if self._is_ignored(line):
+                        continue
+                    if not os.path.isfile(line):
+                        continue
+                    res_list2.append(line)
             else:
                 res_list2.append(file_path)
 
-        ''' Filter those files that could be ignored '''
-        res_list3 = []
-        for file_path in res_list2:
-            if not os.path.isfile(file_path):
-                continue
-            if self._is_ignored(file_path):
-                continue
-            res_list3.append(file_path)
         ''' Make it unique '''
-        self.possible_vm_cfg_list = list(set(res_list3))
+        self.possible_vm_cfg_list = list(set(res_list2))
         return self.possible_vm_cfg_list
 
+    ''' 'g3', "g3" or g3, without the comment that may follow it '''
+    def _parse_name_value(self, value):
+        value = value.strip()
+        if value[:1] in ('"', "'"):
+            end = value.find(value[0], 1)
+            if end != -1:
+                return value[1:end]
+            return value[1:]
+        return value.split('#', 1)[0].strip()
+
+    ''' Parse every candidate file once into a domain name -> vm cfg path list index '''
+    def _build_vm_cfg_name_index(self):
+        name_index = {}
+        for vmcfg_path in self.possible_vm_cfg_list:
+            lines = self._get_file_content(vmcfg_path)
+            for line in lines:
+                m = self.C_RE_NAME.match(line)
+                if m is None:
+                    continue
+                domu_name = self._parse_name_value(m.group(1))
+                if len(domu_name) == 0:
+                    continue
+                path_list = name_index.setdefault(domu_name, [])
+                if vmcfg_path not in path_list:
+                    path_list.append(vmcfg_path)
+        return name_index
+
     def initialize_vm_cfg_dict(self):
         if len(self.possible_vm_cfg_list) == 0:
             self._get_all_possible_vm_cfg_list()
 
+        name_index = self._build_vm_cfg_name_index()
         for domu_id in self.domu_dict.keys():
             domu_name = self.domu_dict[domu_id]
             self.vm_cfg_dict[domu_id] = ''
 
-            domu_vmcfg_path_list = []
-            for vmcfg_path in self.possible_vm_cfg_list:
-                lines = self._get_file_content(vmcfg_path)
-                for line in lines:
-                    if re.search("name\s*=", line):
-                        if re.search(domu_name, line):
-                            domu_vmcfg_path_list.append(vmcfg_path)
+            domu_vmcfg_path_list = name_index.get(domu_name, [])
             if len(domu_vmcfg_path_list) == 1:
                 self.vm_cfg_dict[domu_id] = domu_vmcfg_path_list[0]
             elif len(domu_vmcfg_path_list) == 0:
@@ -220,12 +310,89 @@ class XenView(object):
                     self._dprint('\n'.join(paths))
 
 
-def unit_test():
-    xv = XenView(debug=True)
+def unit_test(toolstack_name=toolstack.C_AUTO):
+    xv = XenView(debug=True, toolstack_name=toolstack_name)
     xv.initialize_vm_cfg_dict()
+    print('===== Ignore rule hits: =====')
+    for (regex, hits) in xv.get_ignore_stats():
+        print('%6d %s' % (hits, regex))
     #print('===== All possible VM CFG: =====\n' + '\n'.join(xv.possible_vm_cfg_list))
     print('===== Final Result: =====')
     pprint.pprint(xv.vm_cfg_dict)
 
+''' Samples every interval seconds, redrawing the top view; the history is dumped as JSON at the end, also on Ctrl-C '''
+def run_sampler(opts):
+    sampler = DomainSampler(CommandRunner(debug=opts.debug), opts.toolstack, opts.history, opts.debug)
+    show_top = opts.json != '-'
+    clear = show_top and sys.stdout.isatty()
+    next_time = time.time()
+    done = 0
+    try:
+        while opts.count == 0 or done < opts.count:
+            if not sampler.sample():
+                if sampler.sample_count == 0:
+                    sys.stderr.write('ERROR: Unable to get the domain stats from %s\n' % ', '.join(toolstack.C_STATS_ORDER))
+                    return 1
+                sys.stderr.write('WARNING: Sample %d failed\n' % (done + 1))
+            done += 1
+            if show_top:
+                if clear:
+                    sys.stdout.write('\033[H\033[J')
+                elif done > 1:
+                    sys.stdout.write('\n')
+                sys.stdout.write('%s\n' % sampler.format_top(opts.sort, opts.top))
+                sys.stdout.flush()
+            if opts.count != 0 and done >= opts.count:
+                break
+            ''' Ticks stay on the interval grid; after a slow sample the next one starts right away '''
+            next_time += opts.interval
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.time()
+    except KeyboardInterrupt:
+        pass
+
+    if opts.json == '-':
+        json.dump(sampler.to_dict(), sys.stdout, sort_keys=True)
+        sys.stdout.write('\n')
+    elif opts.json:
+        fo = open(opts.json, 'w')
+        try:
+            json.dump(sampler.to_dict(), fo, sort_keys=True)
+        finally:
+            fo.close()
+    return 0
+
+def parse_opts():
+    """Parse program options."""
+    import optparse
+    parser = optparse.OptionParser(description='Running Xen domains: their vm.cfg files, or with --sample their resource usage')
+    parser.add_option('-d', '--debug', help='Turn on debug information', action='store_true', dest='debug', default=False)
+    parser.add_option('-t', '--toolstack', help='Domain listing backend: auto, xenstore, xl or xm; --sample needs xl or xm [default: %default]',
+        type='choice', choices=[toolstack.C_AUTO] + toolstack.C_AUTO_ORDER, dest='toolstack', default=toolstack.C_AUTO)
+    parser.add_option('--sample', help='Show memory, VCPUs, state and CPU usage of every domain like top, from one list call per interval',
+        action='store_true', dest='sample', default=False)
+    parser.add_option('-i', '--interval', help='Seconds between two samples [default: %default]', type='float', dest='interval', default=1.0)
+    parser.add_option('-n', '--count', help='Samples to take, 0 until interrupted [default: %default]', type='int', dest='count', default=0)
+    parser.add_option('--history', help='Samples kept per domain [default: %default]', type='int', dest='history', default=DomainSampler.C_DEFAULT_CAPACITY)
+    parser.add_option('--sort', help='Order of the top view: cpu, mem or name [default: %default]', type='choice',
+        choices=DomainSampler.C_SORT_KEY_LIST, dest='sort', default='cpu')
+    parser.add_option('--top', help='Domains shown by the top view, 0 for all [default: %default]', type='int', dest='top', default=20)
+    parser.add_option('--json', help='Write the sample history as JSON to this file at the end, "-" for stdout instead of the top view', dest='json')
+    (opts, args) = parser.parse_args()
+    if opts.sample and opts.toolstack == toolstack.XenStoreBackend.C_NAME:
+        parser.error('xenstore has no CPU time, --sample needs xl or xm')
+    if opts.interval <= 0:
+        parser.error('--interval must be positive')
+    return (opts, args)
+
+def main():
+    (opts, args) = parse_opts()
+    if opts.sample:
+        sys.exit(run_sampler(opts))
+    unit_test(opts.toolstack)
+
 if __name__ == '__main__':
-    unit_test()
+    main()